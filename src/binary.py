@@ -1,29 +1,113 @@
 #/bin/python3
 
-""" Module to run an external binary on the shell. """
+""" Module to run an external binary.
 
+Commands are run directly, without a shell in between. The path and the version
+of each binary are looked up only once per process, no matter how many instances
+of Binary use it.
+
+Besides the blocking functions, there are asyncio counterparts, that run many
+commands concurrently in one event loop and log their output while they run.
+
+"""
+
+import asyncio
+import contextlib
 import logging
+import os
+import shlex
+import shutil
 import subprocess
 
 class BinaryException(Exception):
   """ Exceptions of this module. """
 
 
-def run_cmd(cmd):
-  """ Runs the command in the shell.
+# Maximum length of one line of output of a command run with asyncio.
+STREAM_LIMIT = 1 << 20
+
+
+# Resolved paths and versions of binaries, see resolve_binary and binary_version.
+# pylint: disable=invalid-name
+_paths = {}
+_versions = {}
+# pylint: enable=invalid-name
+
+
+def resolve_binary(name):
+  """ Looks up the path of a binary on the PATH, once per process.
+
+  name: string
+    name of the binary
+
+  returns: string
+    the path of the binary
+
+  raises: BinaryException
+    if the binary does not exist
+
+  """
+  if name not in _paths:
+    path = shutil.which(name)
+    if path is None:
+      raise BinaryException(
+          "The binary %s does not exist on this system. Please install it." % name)
+    _paths[name] = path
+  return _paths[name]
+
+
+def binary_version(path):
+  """ Asks a binary for its version, once per process.
+
+  path: string
+    path of the binary, which must support '--version'
+
+  returns: string
+    the first line of the binary's version output
+
+  """
+  if path not in _versions:
+    (out, _, code) = run_cmd([path, "--version"])
+    if code:
+      raise BinaryException("Could not determine the version of %s." % path)
+    _versions[path] = out.decode("utf-8").split("\n")[0].strip()
+  return _versions[path]
+
+
+def run_cmd(cmd, stdin=None, timeout=None, env=None):
+  """ Runs the command.
+
+  cmd: list of strings or string
+    the command and its arguments, a string is split like the shell would split it
+  stdin: bytes (optional)
+    data to pass to the command on STDIN
+  timeout: number (optional)
+    seconds after which the command is killed
+  env: dictionary (optional)
+    environment variables to set in addition to the ones of this process
 
   Returns:
     (stdout, stderr, returncode)
 
+  raises: BinaryException
+    if the command cannot be started or times out
+
   """
-  completed_process = None
+  if isinstance(cmd, str):
+    cmd = shlex.split(cmd)
+  if env:
+    env = dict(os.environ, **env)
 
   try:
-    completed_process = subprocess.run(cmd, shell=True, check=False, capture_output=True)
+    completed_process = subprocess.run(
+        cmd, check=False, capture_output=True, input=stdin, timeout=timeout, env=env)
     logging.info(completed_process)
-  except:
+  except subprocess.TimeoutExpired:
     raise BinaryException(
-        "Running command failed: %s." % cmd)
+        "Command timed out after %s seconds: %s." % (timeout, shlex.join(cmd))) from None
+  except OSError as exception:
+    raise BinaryException(
+        "Running command failed: %s: %s." % (shlex.join(cmd), exception)) from exception
 
   if not completed_process.returncode == 0:
     logging.warning("Process exited with non-zero return code.")
@@ -31,40 +115,176 @@ def run_cmd(cmd):
   return (completed_process.stdout, completed_process.stderr, completed_process.returncode)
 
 
+async def log_stream(stream, label, lines=None):
+  """ Logs the output of a running command line by line.
+
+  stream: StreamReader
+    STDOUT or STDERR of the command
+  label: string
+    prefix of the logged lines
+  lines: list (optional)
+    if given, the lines are collected in this list, too
+
+  """
+  while True:
+    line = await stream.readline()
+    if not line:
+      break
+    logging.info("%s: %s", label, line.rstrip(b"\n"))
+    if lines is not None:
+      lines.append(line)
+
+
+async def feed_stream(stream, data):
+  """ Writes data to the STDIN of a running command and closes it.
+
+  stream: StreamWriter
+    STDIN of the command
+  data: bytes
+    the data to write
+
+  """
+  try:
+    stream.write(data)
+    await stream.drain()
+    stream.close()
+  except (BrokenPipeError, ConnectionResetError):
+    # The command exited without reading all of its input, its return code tells.
+    pass
+
+
+async def run_cmd_async(cmd, stdin=None, timeout=None, env=None, capture_output=False):
+  """ Runs the command as asyncio subprocess.
+
+  The output of the command is logged while it runs, and only kept in memory if
+  requested.
+
+  cmd, timeout, env: see run_cmd
+  stdin: bytes (optional)
+    data to pass to the command on STDIN, if not given, STDIN is empty
+  capture_output: boolean
+    whether or not to return the output of the command
+
+  Returns:
+    (stdout, stderr, returncode), where stdout and stderr are None unless
+    capture_output is set
+
+  raises: BinaryException
+    if the command cannot be started or times out
+
+  """
+  # pylint: disable=too-many-arguments
+  if isinstance(cmd, str):
+    cmd = shlex.split(cmd)
+  if env:
+    env = dict(os.environ, **env)
+
+  try:
+    process = await asyncio.create_subprocess_exec(
+        *cmd, stdin=subprocess.DEVNULL if stdin is None else subprocess.PIPE,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, limit=STREAM_LIMIT)
+  except OSError as exception:
+    raise BinaryException(
+        "Running command failed: %s: %s." % (shlex.join(cmd), exception)) from exception
+
+  (out, err) = ([], []) if capture_output else (None, None)
+  communication = [log_stream(process.stdout, "Stdout", out),
+                   log_stream(process.stderr, "Stderr", err)]
+  if stdin is not None:
+    communication.append(feed_stream(process.stdin, stdin))
+  try:
+    await asyncio.wait_for(asyncio.gather(*communication, process.wait()), timeout)
+  except asyncio.TimeoutError:
+    process.kill()
+    await process.wait()
+    raise BinaryException(
+        "Command timed out after %s seconds: %s." % (timeout, shlex.join(cmd))) from None
+
+  if not process.returncode == 0:
+    logging.warning("Process exited with non-zero return code.")
+
+  if capture_output:
+    (out, err) = (b"".join(out), b"".join(err))
+  return (out, err, process.returncode)
+
+
 class Binary:
-  """ Representing an external binary. """
-  # pylint: disable=too-few-public-methods
+  """ Representing an external binary.
+
+  name: string
+    name of the binary, which is looked up on the PATH
+
+  """
 
   def __init__(self, name):
     self.__name = name
-    self.__check_installation()
+    self.__path = resolve_binary(name)
 
-  def __check_installation(self):
-    cmd = "which %s" % self.__name
-    (_, _, code) = run_cmd(cmd)
-    if code:
-      raise BinaryException(
-          "The binary %s does not exist on this system. Please install it." % self.__name)
+  @property
+  def path(self):
+    """ The path of the binary. """
+    return self.__path
+
+  @property
+  def version(self):
+    """ The version string of the binary, e.g. to detect updates. """
+    return binary_version(self.__path)
 
-  def run_binary(self, arguments):
+  def __command(self, arguments):
+    """ The command to run the binary with the given arguments. """
+    if isinstance(arguments, str):
+      arguments = shlex.split(arguments)
+    cmd = [self.__path] + list(arguments)
+    logging.info("Running command: %s", shlex.join(cmd))
+    return cmd
+
+  def run_binary(self, arguments, stdin=None, timeout=None, env=None):
     """ Runs the binary with the given arguments.
 
-    arguments: string
-      string with arguments
+    arguments: list of strings
+      the arguments
+    stdin: bytes (optional)
+      data to pass to the binary on STDIN
+    timeout: number (optional)
+      seconds after which the binary is killed
+    env: dictionary (optional)
+      environment variables to set in addition to the ones of this process
 
     returns: (str, str, str)
       tuple of (out, err, code), where out is the output of the call on STDOUT,
       err on STDERR, and code is the return code.
 
     """
-    cmd = "%s %s" % (self.__name, arguments)
-    logging.info("Running command: %s", cmd)
-    (out, err, code) = run_cmd(cmd)
+    # pylint: disable=too-many-arguments
+    cmd = self.__command(arguments)
+    (out, err, code) = run_cmd(cmd, stdin=stdin, timeout=timeout, env=env)
     logging.info("Stdout: %s", out)
     logging.info("Stderr: %s", err)
     logging.info("Return code: %s", code)
     if code:
-      raise BinaryException("Running command %s failed." % cmd)
+      raise BinaryException("Running command %s failed." % shlex.join(cmd))
     return (out, err, code)
 
-  # pylint: enable=too-few-public-methods
+  async def run_binary_async(self, arguments, stdin=None, timeout=None, env=None,
+                             capture_output=False, semaphore=None):
+    """ Runs the binary with the given arguments as asyncio subprocess.
+
+    arguments, stdin, timeout, env: see run_binary
+    capture_output: boolean
+      whether or not to return the output, it is logged in any case
+    semaphore: asyncio.Semaphore (optional)
+      limits the number of commands that run at the same time
+
+    returns: (str, str, str)
+      tuple of (out, err, code), see run_cmd_async
+
+    """
+    # pylint: disable=too-many-arguments
+    cmd = self.__command(arguments)
+    async with semaphore or contextlib.nullcontext():
+      (out, err, code) = await run_cmd_async(
+          cmd, stdin=stdin, timeout=timeout, env=env, capture_output=capture_output)
+    logging.info("Return code of %s: %s", cmd[0], code)
+    if code:
+      raise BinaryException("Running command %s failed." % shlex.join(cmd))
+    return (out, err, code)
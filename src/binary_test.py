@@ -2,12 +2,14 @@
 
 """ Unit tests for binary. """
 
+import asyncio
+import os
 import shutil
 import tempfile
 import unittest
 
 from testing import PapeterieTestCase
-from binary import run_cmd, Binary, BinaryException
+from binary import run_cmd, run_cmd_async, Binary, BinaryException
 
 
 class TestRunCmd(PapeterieTestCase):
@@ -53,6 +55,79 @@ class TestRunCmd(PapeterieTestCase):
     self.assertTrue(err)
     self.assertGreater(code, 0)
 
+  def test_run_cmd_list(self):
+    """ Test running a command given as list, which is not interpreted by a shell. """
+    cmd = ["echo", "$HOME", "a  b"]
+
+    (out, _, code) = run_cmd(cmd)
+
+    self.assertEqual(b"$HOME a  b\n", out)
+    self.assertEqual(0, code)
+
+  def test_run_cmd_env(self):
+    """ Test running a command with additional environment variables. """
+    cmd = ["sh", "-c", "echo $PAPETERIE_TEST"]
+
+    (out, _, _) = run_cmd(cmd, env={"PAPETERIE_TEST": "cat"})
+
+    self.assertEqual(b"cat\n", out)
+
+  def test_run_cmd_timeout(self):
+    """ Test that a command is killed after the timeout. """
+    with self.assertRaises(BinaryException):
+      run_cmd(["sleep", "10"], timeout=0.1)
+
+  def test_run_cmd_not_found(self):
+    """ Test running a command that does not exist. """
+    with self.assertRaises(BinaryException):
+      run_cmd(["notinstalled"])
+
+
+class TestRunCmdAsync(PapeterieTestCase):
+  """ Tests the run_cmd_async function of the binary module. """
+
+  def test_run_cmd_async_output(self):
+    """ Test running a command with input and captured output. """
+    (out, err, code) = asyncio.run(run_cmd_async(["cat"], stdin=b"cat\n", capture_output=True))
+
+    self.assertEqual(b"cat\n", out)
+    self.assertFalse(err)
+    self.assertEqual(0, code)
+
+  def test_run_cmd_async_no_capture(self):
+    """ Test that output is only kept when requested. """
+    (out, err, code) = asyncio.run(run_cmd_async(["ls", "/tmp/doesnotexist"]))
+
+    self.assertIsNone(out)
+    self.assertIsNone(err)
+    self.assertGreater(code, 0)
+
+  def test_run_cmd_async_timeout(self):
+    """ Test that a command is killed after the timeout. """
+    with self.assertRaises(BinaryException):
+      asyncio.run(run_cmd_async(["sleep", "10"], timeout=0.1))
+
+  def test_run_binary_async_semaphore(self):
+    """ Test that the semaphore limits the number of binaries running at once. """
+    async def run_all():
+      semaphore = asyncio.Semaphore(2)
+      binary = Binary("sh")
+      script = "echo start >> %s; sleep 0.2; echo end >> %s" % (log_file, log_file)
+      await asyncio.gather(*(binary.run_binary_async(["-c", script], semaphore=semaphore)
+                             for _ in range(4)))
+
+    with tempfile.TemporaryDirectory() as test_dir:
+      log_file = os.path.join(test_dir, "log")
+      asyncio.run(run_all())
+      with open(log_file, 'r') as infile:
+        events = infile.read().split()
+
+    running = 0
+    for event in events:
+      running += 1 if event == "start" else -1
+      self.assertLessEqual(running, 2)
+    self.assertEqual(8, len(events))
+
 
 class TestBinary(unittest.TestCase):
   """ Tests the Binary class of the binary module. """
@@ -70,6 +145,20 @@ class TestBinary(unittest.TestCase):
     # No exception: everything is fine
   # pylint: enable=no-self-use
 
+  def test_binary_resolved_once(self):
+    """ Test that instances of the same binary share the path and version. """
+    first = Binary("ls")
+    second = Binary("ls")
+
+    self.assertTrue(os.path.isabs(first.path))
+    self.assertEqual(first.path, second.path)
+    self.assertIs(first.version, second.version)
+
+  def test_run_binary_fail(self):
+    """ Test that a failing binary raises an exception. """
+    with self.assertRaises(BinaryException):
+      Binary("ls").run_binary(["/tmp/doesnotexist"])
+
   def test_check_installation_fail(self):
     """ Test that checking for a non-existing binary fails. """
     with self.assertRaises(BinaryException):
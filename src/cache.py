@@ -0,0 +1,246 @@
+#/bin/python3
+
+""" Module for a persistent cache of compiled pdfs.
+
+The cache is content-addressed: a pdf is stored under a hash of everything that
+went into compiling it, i.e. the tex file, the pictures it references and the
+version of pdflatex. Hence, rerunning a series only compiles the pieces of
+papeterie whose input actually changed.
+
+"""
+
+import hashlib
+import logging
+import os
+import re
+import shutil
+import tempfile
+from pathlib import Path
+
+
+DEFAULT_CACHE_DIR = os.path.join(str(Path.home()), ".papeterie", "cache")
+DEFAULT_MAX_SIZE_MB = 500
+
+# File extensions pdflatex tries when a picture is included without extension.
+PICTURE_EXTENSIONS = [".pdf", ".png", ".jpg", ".jpeg"]
+
+
+class CacheException(Exception):
+  """ Exceptions of this module. """
+
+
+def file_digest(path):
+  """ Computes the sha256 hex digest of a file's content.
+
+  path: string
+    path of the file
+
+  returns: string
+    the hex digest
+
+  """
+  sha = hashlib.sha256()
+  with open(path, 'rb') as infile:
+    for block in iter(lambda: infile.read(1 << 16), b""):
+      sha.update(block)
+  return sha.hexdigest()
+
+
+def referenced_assets(texcontent, asset_dir):
+  """ Lists the files in the asset directory that are referenced by a tex file.
+
+  texcontent: string
+    content of the tex file
+  asset_dir: string
+    directory the tex file refers to for pictures (see PAPETERIEPICPATH)
+
+  returns: list of strings
+    sorted paths of the referenced files that exist
+
+  """
+  pattern = re.escape(asset_dir.rstrip("/")) + r"/([^}\s]+)"
+  assets = set()
+  for name in re.findall(pattern, texcontent):
+    path = os.path.join(asset_dir, name)
+    candidates = [path] + [path + extension for extension in PICTURE_EXTENSIONS]
+    for candidate in candidates:
+      if os.path.isfile(candidate):
+        assets.add(candidate)
+        break
+  return sorted(assets)
+
+
+class CompileCache():
+  """ Persistent cache of compiled pdfs with least-recently-used eviction.
+
+  Only the compiled pdfs count towards the maximum size and are evicted. The
+  precompiled preambles, signatures, templates and prepared pictures in the other
+  directories are not capped: there is one of them per preamble, text snippet,
+  template or picture rather than per recipient, and they are kept until the cache
+  directory is removed.
+
+  cache_dir: string
+    directory to store the cache in, created if it does not exist
+  max_size_mb: integer
+    maximum size of all cached pdfs in megabytes
+
+  """
+
+  def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_size_mb=DEFAULT_MAX_SIZE_MB):
+    if max_size_mb <= 0:
+      raise CacheException("The cache size must be positive, got %s." % max_size_mb)
+    self.__dir = os.path.join(cache_dir, "pdf")
+    os.makedirs(self.__dir, exist_ok=True)
+    self.__format_dir = os.path.join(cache_dir, "formats")
+    self.__signature_dir = os.path.join(cache_dir, "signatures")
+    self.__template_dir = os.path.join(cache_dir, "templates")
+    self.__picture_dir = os.path.join(cache_dir, "pictures")
+    self.__max_size = max_size_mb * 1024 * 1024
+    self.__size = None
+    self.__asset_digests = {}
+
+  @property
+  def cache_dir(self):
+    """ Directory the pdfs are stored in. """
+    return self.__dir
+
+  @property
+  def format_dir(self):
+    """ Directory to store precompiled preambles in, see PdfLatex.dump_format. """
+    return self.__format_dir
+
+  @property
+  def signature_dir(self):
+    """ Directory to store signed messages in, see gpg.SignatureCache. """
+    return self.__signature_dir
+
+  @property
+  def template_dir(self):
+    """ Directory to store compiled jinja templates in, see jinja2snippet. """
+    return self.__template_dir
+
+  @property
+  def picture_dir(self):
+    """ Directory to store prepared pictures in, see pictures.PictureCache. """
+    return self.__picture_dir
+
+  def __asset_digest(self, path):
+    """ Digest of an asset file, computed once per file version. """
+    stat = os.stat(path)
+    signature = (path, stat.st_mtime_ns, stat.st_size)
+    if signature not in self.__asset_digests:
+      self.__asset_digests[signature] = file_digest(path)
+    return self.__asset_digests[signature]
+
+  def key(self, texcontent, asset_dir, version):
+    """ Computes the cache key of a tex file.
+
+    texcontent: string
+      content of the fully rendered tex file
+    asset_dir: string (optional)
+      directory of the pictures referenced by the tex file
+    version: string
+      version of the pdflatex binary
+
+    returns: string
+      the cache key
+
+    """
+    sha = hashlib.sha256()
+    sha.update(version.encode("utf-8"))
+    sha.update(b"\0")
+    sha.update(texcontent.encode("utf-8"))
+    if asset_dir:
+      for path in referenced_assets(texcontent, asset_dir):
+        sha.update(b"\0")
+        sha.update(os.path.basename(path).encode("utf-8"))
+        sha.update(self.__asset_digest(path).encode("utf-8"))
+    return sha.hexdigest()
+
+  def __path(self, key):
+    return os.path.join(self.__dir, "%s.pdf" % key)
+
+  def get(self, key, target_path):
+    """ Copies a cached pdf to the target path.
+
+    key: string
+      the cache key, see key()
+    target_path: string
+      where to copy the cached pdf to
+
+    returns: boolean
+      whether or not the pdf was found in the cache
+
+    """
+    path = self.__path(key)
+    try:
+      shutil.copyfile(path, target_path)
+      # Mark the entry as recently used.
+      os.utime(path)
+    except FileNotFoundError:
+      return False
+    logging.info("Cache hit for %s.", key)
+    return True
+
+  def put(self, key, pdf_path):
+    """ Stores a compiled pdf in the cache.
+
+    key: string
+      the cache key, see key()
+    pdf_path: string
+      path of the compiled pdf
+
+    """
+    # Write to a temporary file first, so that other processes never see partial
+    # entries.
+    (handle, tmp_path) = tempfile.mkstemp(dir=self.__dir, suffix=".tmp")
+    os.close(handle)
+    shutil.copyfile(pdf_path, tmp_path)
+    path = self.__path(key)
+    try:
+      # An entry with the same key is overwritten and no longer counts.
+      replaced_size = os.path.getsize(path)
+    except FileNotFoundError:
+      replaced_size = 0
+    os.replace(tmp_path, path)
+    logging.info("Stored %s in cache as %s.", pdf_path, key)
+
+    if self.__size is None:
+      self.__size = self.__total_size()
+    else:
+      self.__size += os.path.getsize(path) - replaced_size
+    if self.__size > self.__max_size:
+      self.evict()
+
+  def __entries(self):
+    """ Lists (mtime, size, path) of all cache entries. """
+    entries = []
+    with os.scandir(self.__dir) as scanner:
+      for entry in scanner:
+        if not entry.name.endswith(".pdf"):
+          continue
+        try:
+          stat = entry.stat()
+        except FileNotFoundError:
+          continue
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+    return entries
+
+  def __total_size(self):
+    return sum(size for (_, size, _) in self.__entries())
+
+  def evict(self):
+    """ Removes the least recently used entries until the cache fits its size. """
+    entries = sorted(self.__entries())
+    size = sum(size for (_, size, _) in entries)
+    for (_, entry_size, path) in entries:
+      if size <= self.__max_size:
+        break
+      try:
+        os.remove(path)
+        logging.info("Evicted %s from cache.", path)
+      except FileNotFoundError:
+        # Another process evicted it already.
+        pass
+      size -= entry_size
+    self.__size = size
@@ -0,0 +1,108 @@
+#!/usr/bin/python3
+
+""" Unit tests for the cache module. """
+
+import filecmp
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from testing import PapeterieTestCase
+from cache import CompileCache, CacheException, referenced_assets
+
+
+class TestCompileCache(PapeterieTestCase):
+  """ Tests the compile cache. """
+
+  VERSION = "pdfTeX 3.14"
+
+  def setUp(self):
+    self.test_dir = tempfile.mkdtemp()
+    self.cache_dir = os.path.join(self.test_dir, "cache")
+    self.pdf = os.path.join(self.TESTDATA_FOLDER, "card01.pdf")
+    self.other_pdf = os.path.join(self.TESTDATA_FOLDER, "card02.pdf")
+
+  def tearDown(self):
+    shutil.rmtree(self.test_dir)
+
+  def test_roundtrip(self):
+    """ Tests storing and retrieving a pdf. """
+    cache = CompileCache(self.cache_dir)
+    key = cache.key("tex", None, self.VERSION)
+    target = os.path.join(self.test_dir, "result.pdf")
+
+    self.assertFalse(cache.get(key, target))
+    cache.put(key, self.pdf)
+
+    self.assertTrue(cache.get(key, target))
+    self.assertTrue(filecmp.cmp(self.pdf, target, shallow=False))
+
+  def test_key_depends_on_inputs(self):
+    """ Tests that the key changes with the tex, the version and the assets. """
+    asset_dir = os.path.join(self.test_dir, "pics")
+    os.mkdir(asset_dir)
+    with open(os.path.join(asset_dir, "pic.png"), 'w') as outfile:
+      outfile.write("1")
+    cache = CompileCache(self.cache_dir)
+    tex = "\\includegraphics{%s/pic.png}" % asset_dir
+
+    key = cache.key(tex, asset_dir, self.VERSION)
+
+    self.assertEqual(key, cache.key(tex, asset_dir, self.VERSION))
+    self.assertNotEqual(key, cache.key(tex + " ", asset_dir, self.VERSION))
+    self.assertNotEqual(key, cache.key(tex, asset_dir, "pdfTeX 3.15"))
+    # Make sure the modification time changes.
+    time.sleep(0.01)
+    with open(os.path.join(asset_dir, "pic.png"), 'w') as outfile:
+      outfile.write("2")
+    self.assertNotEqual(key, cache.key(tex, asset_dir, self.VERSION))
+
+  def test_referenced_assets(self):
+    """ Tests finding pictures that are referenced without extension. """
+    asset_dir = os.path.join(self.test_dir, "pics")
+    os.mkdir(asset_dir)
+    for name in ["a.png", "b.png"]:
+      with open(os.path.join(asset_dir, name), 'w') as outfile:
+        outfile.write(name)
+    tex = "\\includegraphics{%s/a}" % asset_dir
+
+    self.assertEqual([os.path.join(asset_dir, "a.png")], referenced_assets(tex, asset_dir))
+
+  def test_eviction(self):
+    """ Tests that the least recently used entries are evicted first. """
+    cache = CompileCache(self.cache_dir, max_size_mb=1)
+    # Pretend the cache is tiny by filling it with entries of known size.
+    size = os.path.getsize(self.pdf)
+    number_of_entries = (1024 * 1024) // size + 1
+    for idx in range(number_of_entries):
+      cache.put("key%03d" % idx, self.pdf)
+      os.utime(os.path.join(cache.cache_dir, "key%03d.pdf" % idx), (idx, idx))
+    cache.evict()
+
+    target = os.path.join(self.test_dir, "result.pdf")
+    self.assertFalse(cache.get("key000", target))
+    self.assertTrue(cache.get("key%03d" % (number_of_entries - 1), target))
+
+  def test_overwrite_counted_once(self):
+    """ Tests that storing the same key again does not count the entry twice. """
+    cache = CompileCache(self.cache_dir, max_size_mb=1)
+    number_of_puts = (1024 * 1024) // os.path.getsize(self.pdf) + 2
+
+    with mock.patch.object(cache, "evict") as evict:
+      for _ in range(number_of_puts):
+        cache.put("key", self.pdf)
+      cache.put("key", self.other_pdf)
+
+    evict.assert_not_called()
+
+  def test_invalid_size(self):
+    """ Tests that a non-positive cache size is rejected. """
+    with self.assertRaises(CacheException):
+      CompileCache(self.cache_dir, max_size_mb=0)
+
+
+if __name__ == '__main__':
+  unittest.main()
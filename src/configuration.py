@@ -10,6 +10,7 @@ SNIPPETS = "snippets"
 SIGNED_SNIPPETS = "signed_snippets"
 SNIPPET = "snippet"
 KEY = "key"
+BACKGROUND = "background"
 
 
 def config_from_json(input_dir):
@@ -20,17 +21,19 @@ def config_from_json(input_dir):
   return Configuration(
       input_dir,
       config.get(SNIPPETS, None),
-      config.get(SIGNED_SNIPPETS, None))
+      config.get(SIGNED_SNIPPETS, None),
+      config.get(BACKGROUND, None))
 
 
 class Configuration():
   """ Manages the configuration of the papeterie. """
 
-  def __init__(self, input_dir, snippets=None, signed_snippets=None):
+  def __init__(self, input_dir, snippets=None, signed_snippets=None, background=None):
     self.__input_dir = input_dir
     self.__snippets = {k: os.path.join(input_dir, v)
                        for (k, v) in snippets.items()} if snippets else {}
     self.__signed_snippets = signed_snippets if signed_snippets else {}
+    self.__background = os.path.join(input_dir, background) if background else None
 
   @property
   def snippets(self):
@@ -42,6 +45,16 @@ class Configuration():
     """ The tex template file for this papeterie. """
     return os.path.join(self.__input_dir, "papeterie.tex")
 
+  @property
+  def background_template(self):
+    """ The tex template file of the background layer, None if there is none.
+
+    The background is compiled once per distinct rendering and the pages of the
+    tex template are stamped onto its pages.
+
+    """
+    return self.__background
+
   @property
   def signed_snippets(self):
     """ The mapping of signed snippets to original snippets. """
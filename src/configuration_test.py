@@ -15,6 +15,7 @@ class TestLoadFromJson(PapeterieTestCase):
     """ Valid config. """
     config = configuration.config_from_json("../testdata/")
     self.assertTrue(config)
+    self.assertIsNone(config.background_template)
 
 
 if __name__ == '__main__':
@@ -5,35 +5,91 @@
 import csv
 import logging
 
-from recipient import Recipient
+from recipient import Recipient, RecipientSchema
 
 
 class Csv2RecipientsException(Exception):
   """ Exceptions for this module. """
 
 
-def load_recipients(filename):
-  """ Reads a CSV file and creates a list of recipients. """
-  recipients = []
+def open_reader(csvfile):
+  """ Creates a CSV reader with the dialect of recipient files. """
+  return csv.reader(csvfile, delimiter=',', quotechar='"', quoting=csv.QUOTE_ALL)
+
+
+def validate_recipients(filename):
+  """ Checks the CSV file without creating any recipients.
+
+  filename: string
+    path of the CSV file
+
+  returns: (list of strings, integer)
+    the header line and the number of data lines
+
+  raises: Csv2RecipientsException
+    if there is no header line, no data line or a data line does not match the
+    header line
+
+  """
   with open(filename, newline='') as csvfile:
-    recipients_reader = csv.reader(csvfile, delimiter=',', quotechar='"', quoting=csv.QUOTE_ALL)
+    recipients_reader = open_reader(csvfile)
 
-    is_headerline = True
-    headerline = None
+    headerline = next(recipients_reader, None)
+    if headerline is None:
+      raise Csv2RecipientsException("No lines found.")
 
+    number_of_recipients = 0
     for recipient in recipients_reader:
-      if is_headerline:
-        headerline = recipient
-        is_headerline = False
-        continue
-      recipients.append(Recipient(headerline, recipient))
-
-  if is_headerline:
-    raise Csv2RecipientsException("No lines found.")
+      if len(recipient) != len(headerline):
+        raise Csv2RecipientsException(
+            "Line %d has %d fields, but the header line has %d." % (
+                recipients_reader.line_num, len(recipient), len(headerline)))
+      number_of_recipients += 1
 
-  if not recipients:
+  if not number_of_recipients:
     raise Csv2RecipientsException("No data lines found.")
 
-  logging.info("Loaded %d recipients with %d fields.", len(recipients), len(headerline))
+  return (headerline, number_of_recipients)
+
+
+def iter_recipients(filename):
+  """ Reads a CSV file and yields one recipient after the other.
+
+  The whole file is validated up front, so that errors show up before the first
+  recipient is processed. The recipients themselves are only created when they
+  are needed.
+
+  filename: string
+    path of the CSV file
 
+  returns: generator of Recipient
+    the recipients in the order of the file
+
+  raises: Csv2RecipientsException
+    see validate_recipients
+
+  """
+  (headerline, number_of_recipients) = validate_recipients(filename)
+  logging.info("Found %d recipients with %d fields.", number_of_recipients, len(headerline))
+  return read_recipients(filename, headerline)
+
+
+def read_recipients(filename, headerline):
+  """ Yields the recipients of a CSV file that was validated before.
+
+  See iter_recipients.
+
+  """
+  schema = RecipientSchema(headerline)
+  with open(filename, newline='') as csvfile:
+    recipients_reader = open_reader(csvfile)
+    next(recipients_reader)
+    for recipient in recipients_reader:
+      yield Recipient(schema, recipient)
+
+
+def load_recipients(filename):
+  """ Reads a CSV file and creates a list of recipients. """
+  recipients = list(iter_recipients(filename))
+  logging.info("Loaded %d recipients.", len(recipients))
   return recipients
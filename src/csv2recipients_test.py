@@ -3,6 +3,8 @@
 """ Unittest for the csv2recipients module. """
 
 import os
+import shutil
+import tempfile
 import unittest
 
 from testing import PapeterieTestCase
@@ -16,12 +18,32 @@ class TestCsv2Recipients(PapeterieTestCase):
   FILE_ONLY_HEADER = "recipients_onlyheader.csv"
   FILE_EMPTY = "recipients_empty.csv"
 
+  def setUp(self):
+    self.test_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.test_dir)
+
   def test_happy_file(self):
     """ Test with a file that has valid content. """
     testfile = os.path.join(self.TESTDATA_FOLDER, self.FILE_VALID)
     recipients = csv2recipients.load_recipients(testfile)
     self.assertEqual(2, len(recipients))
 
+  def test_iter_recipients(self):
+    """ Test reading recipients one by one. """
+    testfile = os.path.join(self.TESTDATA_FOLDER, self.FILE_VALID)
+    recipients = csv2recipients.iter_recipients(testfile)
+    self.assertEqual(2, len(list(recipients)))
+
+  def test_malformed_line(self):
+    """ Test that a line with too few fields is found before reading recipients. """
+    testfile = os.path.join(self.test_dir, "recipients.csv")
+    with open(testfile, 'w') as outfile:
+      outfile.write("Name,Theme\nBart,Cthulhu\nLisa\n")
+    with self.assertRaises(csv2recipients.Csv2RecipientsException):
+      csv2recipients.iter_recipients(testfile)
+
   def test_only_header(self):
     """ Test with a file which has a header only. """
     testfile = os.path.join(self.TESTDATA_FOLDER, self.FILE_ONLY_HEADER)
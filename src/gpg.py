@@ -2,13 +2,16 @@
 
 """ Module to GPG-sign a file. """
 
+import hashlib
+import logging
 import os
-import re
+import shutil
+import sys
 import tempfile
 import textwrap
 from pathlib import Path
 
-from binary import Binary
+from binary import Binary, BinaryException
 
 # Note: There is a gnupg-python library, but it does not support gpg (as of Jan 2020)
 
@@ -25,11 +28,6 @@ class Gpg2(Binary):
 
   """
 
-  # pylint: disable=anomalous-backslash-in-string
-  KEY_PATTERN = b"\s*(?P<keyid>\S+)\n.*"
-  # pylint: enable=anomalous-backslash-in-string
-  KEY_ID = "keyid"
-
   def __init__(self, homedir=None):
     super().__init__("gpg2")
     if not homedir:
@@ -56,15 +54,32 @@ class Gpg2(Binary):
       email address belonging to a key
 
     returns: string
-      the key's ID
+      the key's ID (its fingerprint)
 
     """
-    args = "--homedir=%s --list-secret-keys | grep -B 1 %s" % (self.__homedir, email)
-    (out, _, code) = self.run_binary(args)
-    if code:
-      raise Gpg2Exception("Generated key not found.")
+    args = ["--homedir=%s" % self.__homedir, "--with-colons", "--list-secret-keys", email]
+    (out, _, _) = self.run_binary(args)
+    for line in out.decode("utf-8").split("\n"):
+      if line.startswith("fpr:"):
+        return line.split(":")[9]
+    raise Gpg2Exception("Generated key not found.")
 
-    return re.search(self.KEY_PATTERN, out).group(self.KEY_ID).decode("utf-8")
+  def get_fingerprint(self, key_id):
+    """ Gets the fingerprint of the given key.
+
+    key_id: string
+      ID of the key (or anything else gpg2 accepts to select a key)
+
+    returns: string
+      the fingerprint of the (primary) key
+
+    """
+    args = ["--homedir=%s" % self.__homedir, "--with-colons", "--fingerprint", key_id]
+    (out, _, _) = self.run_binary(args)
+    for line in out.decode("utf-8").split("\n"):
+      if line.startswith("fpr:"):
+        return line.split(":")[9]
+    raise Gpg2Exception("No fingerprint found for key %s." % key_id)
 
   def generate_key(self, instructions_file):
     """ Generates a key in a temporary home dir.
@@ -75,7 +90,7 @@ class Gpg2(Binary):
       path of an instructions file for batch generation of a key
 
     """
-    args = "--homedir=%s --batch --generate-key %s" % (self.__homedir, instructions_file)
+    args = ["--homedir=%s" % self.__homedir, "--batch", "--generate-key", instructions_file]
     (_, _, code) = self.run_binary(args)
     if code:
       raise Gpg2Exception("Key generation failed.")
@@ -89,12 +104,85 @@ class Gpg2(Binary):
       ID of the key to use for signing
 
     """
-    args = "--homedir=%s --armor --clearsign --local-user %s %s" % (
-        self.__homedir, key_id, infile)
-    (_, _, code) = self.run_binary(args)
+    (_, _, code) = self.run_binary(self.__sign_arguments(key_id) + [infile])
     if code:
       raise Gpg2Exception("Signing file %s with key %id failed." % (infile, key_id))
 
+  async def sign_file_async(self, infile, key_id, semaphore=None):
+    """ Signs a file with the given key, as asyncio subprocess.
+
+    infile, key_id: see sign_file
+    semaphore: asyncio.Semaphore (optional)
+      limits the number of binaries that run at the same time
+
+    """
+    await self.run_binary_async(
+        self.__sign_arguments(key_id) + [infile], env=tty_env(), semaphore=semaphore)
+
+  def sign_text(self, text, key_id):
+    """ Signs a text with the given key, without writing it to disk.
+
+    The text is passed to gpg2 on STDIN and the signed message is read from its
+    STDOUT.
+
+    text: string
+      text to be signed
+    key_id: string
+      ID of the key to use for signing
+
+    returns: string
+      the clear-signed message
+
+    """
+    (out, _, code) = self.run_binary(
+        self.__sign_arguments(key_id), stdin=text.encode("utf-8"), env=tty_env())
+    if code:
+      raise Gpg2Exception("Signing text with key %s failed." % key_id)
+    return out.decode("utf-8")
+
+  async def sign_text_async(self, text, key_id, semaphore=None):
+    """ Signs a text with the given key, as asyncio subprocess.
+
+    text, key_id: see sign_text
+    semaphore: asyncio.Semaphore (optional)
+      limits the number of binaries that run at the same time
+
+    returns: string
+      the clear-signed message
+
+    """
+    (out, _, _) = await self.run_binary_async(
+        self.__sign_arguments(key_id), stdin=text.encode("utf-8"), env=tty_env(),
+        capture_output=True, semaphore=semaphore)
+    return out.decode("utf-8")
+
+  def __sign_arguments(self, key_id):
+    """ The arguments to clear-sign with the given key. """
+    return ["--homedir=%s" % self.__homedir, "--armor", "--clearsign", "--local-user", key_id]
+
+  def verify_text(self, signed_text, fingerprint):
+    """ Verifies a clear-signed message.
+
+    signed_text: string
+      the clear-signed message
+    fingerprint: string
+      fingerprint of the key that must have made the signature
+
+    returns: string
+      the signed text, or None if the signature is not a good one by the given key
+
+    """
+    args = ["--homedir=%s" % self.__homedir, "--status-fd=2", "--decrypt"]
+    try:
+      (out, err, _) = self.run_binary(args, stdin=signed_text.encode("utf-8"))
+    except BinaryException:
+      return None
+    for line in err.decode("utf-8", errors="replace").split("\n"):
+      fields = line.split()
+      if fields[:2] == ["[GNUPG:]", "VALIDSIG"] and fingerprint in (fields[2], fields[-1]):
+        return out.decode("utf-8")
+    return None
+
   def check_signature(self, infile):
     """ Checks that the given file contains a valid GPG signature.
 
@@ -105,52 +193,222 @@ class Gpg2(Binary):
       when the signature is not a good one
 
     """
-    args = "--homedir=%s --verify %s" % (self.__homedir, infile)
+    args = ["--homedir=%s" % self.__homedir, "--verify", infile]
     (_, _, code) = self.run_binary(args)
     if code:
       raise Gpg2Exception("The signature of file %s could not be verified." % infile)
 
 
+def tty_env():
+  """ The environment gpg2 needs to ask for the passphrase.
+
+  Without a terminal on STDIN, gpg2 cannot tell the agent where to ask for the
+  passphrase. Hence, the terminal of this process is passed on.
+
+  returns: dictionary or None
+    the additional environment variables, if any
+
+  """
+  if "GPG_TTY" not in os.environ and sys.stdin.isatty():
+    return {"GPG_TTY": os.ttyname(sys.stdin.fileno())}
+  return None
+
+
+def normalize_message(text):
+  """ Normalizes a text like clear-signing does (no trailing whitespace). """
+  return "\n".join(line.rstrip() for line in text.strip().split("\n"))
+
+
+class SignatureCache():
+  """ Persistent cache of clear-signed messages.
+
+  The entries are stored per key fingerprint, keyed by the hash of the signed
+  text. When they are loaded for the first time, they are verified against the
+  keyring. The successful verification is recorded next to the entry, together
+  with the inode, modification time and size of the entry, so that later runs do
+  not start gpg for it again unless the entry changed. When the key ID refers to a
+  different key than on the last run, the old key's entries are removed.
+
+  cache_dir: string
+    directory to store the cache in
+  gpg: Gpg2
+    the gpg2 binary
+  key_id: string
+    ID of the GPG key used for signing
+
+  """
+
+  def __init__(self, cache_dir, gpg, key_id):
+    self.__gpg = gpg
+    self.__fingerprint = gpg.get_fingerprint(key_id)
+    self.__dir = os.path.join(cache_dir, self.__fingerprint)
+    os.makedirs(self.__dir, exist_ok=True)
+    self.__forget_replaced_key(cache_dir, key_id)
+
+  def __forget_replaced_key(self, cache_dir, key_id):
+    """ Removes the entries of the key the key ID referred to before. """
+    key_file = os.path.join(
+        cache_dir, "key_%s" % hashlib.sha256(key_id.encode("utf-8")).hexdigest()[:32])
+    if os.path.exists(key_file):
+      with open(key_file, 'r') as infile:
+        previous_fingerprint = infile.read().strip()
+      if previous_fingerprint and previous_fingerprint != self.__fingerprint:
+        logging.info("Key %s changed, removing signatures of %s.", key_id,
+                     previous_fingerprint)
+        shutil.rmtree(os.path.join(cache_dir, previous_fingerprint), ignore_errors=True)
+    with open(key_file, 'w') as outfile:
+      outfile.write(self.__fingerprint)
+
+  def __path(self, text):
+    return os.path.join(
+        self.__dir, "%s.asc" % hashlib.sha256(text.encode("utf-8")).hexdigest())
+
+  @staticmethod
+  def __verified_path(path):
+    return "%s.verified" % os.path.splitext(path)[0]
+
+  @staticmethod
+  def __file_version(stat):
+    return "%d %d %d" % (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+  def __verified(self, path, stat):
+    """ Whether the entry was verified before in its current version. """
+    try:
+      with open(self.__verified_path(path), 'r') as infile:
+        return infile.read() == self.__file_version(stat)
+    except FileNotFoundError:
+      return False
+
+  def __record_verified(self, path, stat):
+    """ Records that the entry in the given version has a good signature. """
+    (handle, tmp_path) = tempfile.mkstemp(dir=self.__dir, suffix=".tmp")
+    with os.fdopen(handle, 'w') as outfile:
+      outfile.write(self.__file_version(stat))
+    os.replace(tmp_path, self.__verified_path(path))
+
+  def get(self, text):
+    """ Looks up the signed message of a text.
+
+    text: string
+      the (wrapped) text to be signed
+
+    returns: string
+      the verified signed message, or None if there is none
+
+    """
+    path = self.__path(text)
+    try:
+      with open(path, 'r', encoding='utf-8') as infile:
+        stat = os.fstat(infile.fileno())
+        signed_text = infile.read()
+    except FileNotFoundError:
+      return None
+    if self.__verified(path, stat):
+      return signed_text
+    verified_text = self.__gpg.verify_text(signed_text, self.__fingerprint)
+    if verified_text is None or normalize_message(verified_text) != normalize_message(text):
+      logging.warning("Removing invalid signature %s from cache.", path)
+      os.remove(path)
+      try:
+        os.remove(self.__verified_path(path))
+      except FileNotFoundError:
+        pass
+      return None
+    self.__record_verified(path, stat)
+    return signed_text
+
+  def put(self, text, signed_text):
+    """ Stores the signed message of a text.
+
+    text: string
+      the (wrapped) text that was signed
+    signed_text: string
+      the signed message
+
+    """
+    (handle, tmp_path) = tempfile.mkstemp(dir=self.__dir, suffix=".tmp")
+    with os.fdopen(handle, 'w', encoding='utf-8') as outfile:
+      outfile.write(signed_text)
+    os.replace(tmp_path, self.__path(text))
+    # It was just made by gpg, no need to verify it.
+    self.__record_verified(self.__path(text), os.stat(self.__path(text)))
+
+
 class Signer:
   # pylint: disable=too-few-public-methods
   """ Class to provide a simple 'sign' method for texts.
 
-  tmp_dir: string
-    path of a directory to store temporary files in
   key_id: string
     ID of the GPG key to use for signing
   gpg_homedir: string
     path of the GPG homedir
+  cache_dir: string (optional)
+    directory of a persistent cache of signed messages, see SignatureCache
 
   """
 
   LEN_SIGNATURE = 64
 
-  def __init__(self, tmp_dir, key_id, gpg_homedir=None):
+  def __init__(self, key_id, gpg_homedir=None, cache_dir=None):
     self.__gpg = Gpg2(homedir=gpg_homedir)
     self.__key_id = key_id
-    self.__tmp_dir = tmp_dir
+    self.__cache_dir = cache_dir
+    self.__cache = None
+    # Messages signed during this run, identical texts are only signed once.
+    self.__signed_texts = {}
     self.__wrapper = textwrap.TextWrapper(width=self.LEN_SIGNATURE, replace_whitespace=False)
 
   def sign(self, intext):
-    """ Sign given text file.
+    """ Sign given text.
 
     intext: string
       text to be signed
 
     """
-    infile_path = tempfile.NamedTemporaryFile(dir=self.__tmp_dir)
+    intext = self.__wrap(intext)
+    outtext = self.__lookup(intext)
+    if outtext is None:
+      outtext = self.__gpg.sign_text(intext, self.__key_id)
+      self.__store(intext, outtext)
+    return outtext
+
+  async def sign_async(self, intext, semaphore=None):
+    """ Sign given text, running gpg2 as asyncio subprocess.
+
+    intext: string
+      text to be signed
+    semaphore: asyncio.Semaphore (optional)
+      limits the number of binaries that run at the same time
+
+    """
+    intext = self.__wrap(intext)
+    outtext = self.__lookup(intext)
+    if outtext is None:
+      outtext = await self.__gpg.sign_text_async(intext, self.__key_id, semaphore)
+      self.__store(intext, outtext)
+    return outtext
+
+  def __wrap(self, intext):
     # The text is wrapped at the width of the signature, as otherwise it is line-broken
     # at arbitrary positions that make signature verification impossible.
-    intext = "\n".join(self.__wrapper.wrap(text=intext))
-    with open(infile_path.name, 'w') as infile:
-      infile.write(intext)
+    return "\n".join(self.__wrapper.wrap(text=intext))
 
-    self.__gpg.sign_file(infile.name, self.__key_id)
+  def __lookup(self, intext):
+    """ Looks up the signed message of a wrapped text in this run and in the cache. """
+    if intext in self.__signed_texts:
+      return self.__signed_texts[intext]
 
-    outfile_path = os.path.join(self.__tmp_dir, "%s.asc" % infile.name)
-    with open(outfile_path, 'r', encoding='utf-8') as outfile:
-      outtext = u"".join(outfile.readlines())
+    if self.__cache_dir and not self.__cache:
+      self.__cache = SignatureCache(self.__cache_dir, self.__gpg, self.__key_id)
 
+    outtext = self.__cache.get(intext) if self.__cache else None
+    if outtext is not None:
+      self.__signed_texts[intext] = outtext
     return outtext
+
+  def __store(self, intext, outtext):
+    """ Remembers the signed message of a wrapped text. """
+    if self.__cache:
+      self.__cache.put(intext, outtext)
+    self.__signed_texts[intext] = outtext
   # pylint: enable=too-few-public-methods
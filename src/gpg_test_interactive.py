@@ -6,8 +6,10 @@ import os
 import shutil
 import tempfile
 import unittest
+from unittest import mock
 
 from testing import PapeterieTestCase, setup_gpg
+from gpg import Gpg2, Signer
 
 
 class TestGpg(PapeterieTestCase):
@@ -49,6 +51,38 @@ class TestGpg(PapeterieTestCase):
 
     self.assertTrue(os.path.exists(infile + ".asc"))
 
+  def test_sign_text(self):
+    """ Test signing a text without files. """
+    text = "Dear Bart,\nplease come to our wedding."
+
+    signed = self.gpg.sign_text(text, self.key)
+
+    self.assertIn(text, signed)
+    outfile_path = os.path.join(self.test_dir, "text.asc")
+    with open(outfile_path, 'w') as outfile:
+      outfile.write(signed)
+    self.gpg.check_signature(outfile_path)
+
+  def test_signature_cache(self):
+    """ Test that signatures are reused across signers, but not when tampered with. """
+    cache_dir = os.path.join(self.test_dir, "signatures")
+    text = "Dear Bart,\nplease come to our wedding."
+
+    signed = Signer(self.key, self.gpg.homedir, cache_dir).sign(text)
+    with mock.patch.object(Gpg2, "verify_text") as verify_text:
+      self.assertEqual(signed, Signer(self.key, self.gpg.homedir, cache_dir).sign(text))
+    # The entry was recorded as verified when it was stored.
+    verify_text.assert_not_called()
+
+    fingerprint = self.gpg.get_fingerprint(self.key)
+    (entry,) = [name for name in os.listdir(os.path.join(cache_dir, fingerprint))
+                if name.endswith(".asc")]
+    with open(os.path.join(cache_dir, fingerprint, entry), 'w') as outfile:
+      outfile.write(signed.replace("Bart", "Lisa"))
+    resigned = Signer(self.key, self.gpg.homedir, cache_dir).sign(text)
+    self.assertIn("Bart", resigned)
+    self.assertNotIn("Lisa", resigned)
+
 
 if __name__ == '__main__':
   unittest.main()
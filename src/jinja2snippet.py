@@ -1,24 +1,82 @@
 #/bin/python3
 
-""" Provides a reusable jinja template, that renders text given a recipient. """
+""" Provides a reusable jinja template, that renders text given a recipient.
 
-from jinja2 import Template
+All templates of a directory share one jinja environment, so that they are
+loaded and compiled only once per process. Optionally, the compiled templates
+are kept on disk, so that later runs do not compile them again either.
 
+Most templates only read a few of the recipients' fields, if any. Hence, each
+template remembers what it rendered for the values of the fields it reads, and
+recipients that agree on those values share the rendered text. Only the most
+recently used renderings are kept, so that templates that read per-recipient
+fields like the name do not hold one rendering per recipient.
+
+"""
+
+import collections
+import os
+
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, meta
+
+
+# Maximum number of renderings each template keeps, see JinjaTemplate.render.
+MAX_RENDERINGS = 256
+
+# The shared environments, see get_environment.
+# pylint: disable=invalid-name
+_environments = {}
+# pylint: enable=invalid-name
+
+
+def get_environment(template_dir, bytecode_cache_dir=None):
+  """ Returns the jinja environment for the templates of a directory.
+
+  The environment is created on the first call and shared by all later calls
+  with the same arguments.
+
+  template_dir: string
+    directory of the jinja template files
+  bytecode_cache_dir: string (optional)
+    directory to store the compiled templates in, created if it does not exist
+
+  returns: Environment
+    the jinja environment
+
+  """
+  key = (os.path.abspath(template_dir), bytecode_cache_dir)
+  if key not in _environments:
+    bytecode_cache = None
+    if bytecode_cache_dir:
+      os.makedirs(bytecode_cache_dir, exist_ok=True)
+      bytecode_cache = FileSystemBytecodeCache(bytecode_cache_dir)
+    _environments[key] = Environment(
+        loader=FileSystemLoader(key[0]), bytecode_cache=bytecode_cache)
+  return _environments[key]
 
-# pylint: disable=too-few-public-methods
 
 class JinjaTemplate():
   """ Wrapper for a jinja2 template to be reused by several recipients.
 
   template_path: string
     path of the jinja template file
+  bytecode_cache_dir: string (optional)
+    directory to store the compiled template in, see get_environment
 
   """
 
-  def __init__(self, template_path):
-    with open(template_path, 'r', encoding='utf-8') as infile:
-      template_str = u"".join(infile.readlines())
-    self.__template = Template(template_str)
+  def __init__(self, template_path, bytecode_cache_dir=None):
+    environment = get_environment(os.path.dirname(template_path), bytecode_cache_dir)
+    name = os.path.basename(template_path)
+    self.__template = environment.get_template(name)
+    self.__variables = template_variables(environment, name)
+    self.__rendered = collections.OrderedDict()
+
+  @property
+  def variables(self):
+    """ The sorted tuple of variables the template reads, or None if the template
+        includes other templates and hence its variables are unknown. """
+    return self.__variables
 
   def render(self, recipient):
     """ Renders the template with the data of the recipient.
@@ -30,6 +88,50 @@ class JinjaTemplate():
       the rendered text
 
     """
-    return self.__template.render(**recipient.to_dict())
+    data = recipient.view()
+    if self.__variables is None:
+      return self.__template.render(data)
+
+    key = tuple(data.get(variable) for variable in self.__variables)
+    if key in self.__rendered:
+      self.__rendered.move_to_end(key)
+      return self.__rendered[key]
+
+    text = self.__template.render(data)
+    self.__rendered[key] = text
+    if len(self.__rendered) > MAX_RENDERINGS:
+      self.__rendered.popitem(last=False)
+    return text
+
+  def render_many(self, recipients):
+    """ Renders the template with the data of several recipients.
 
-# pylint: enable=too-few-public-methods
+    recipients: iterable of Recipient
+      the recipients' data
+
+    returns: list of strings
+      the rendered texts, in the order of the recipients
+
+    """
+    render = self.render
+    return [render(recipient) for recipient in recipients]
+
+
+def template_variables(environment, name):
+  """ Finds the variables a template reads.
+
+  environment: Environment
+    the jinja environment of the template
+  name: string
+    name of the template in the environment
+
+  returns: tuple of strings or None
+    the sorted names of the variables, or None if the template includes, imports
+    or extends other templates, whose variables are not analyzed
+
+  """
+  (source, _, _) = environment.loader.get_source(environment, name)
+  ast = environment.parse(source)
+  if list(meta.find_referenced_templates(ast)):
+    return None
+  return tuple(sorted(meta.find_undeclared_variables(ast)))
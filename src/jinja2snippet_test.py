@@ -6,6 +6,7 @@ import os
 import shutil
 import tempfile
 import unittest
+from unittest import mock
 
 from testing import PapeterieTestCase
 import jinja2snippet
@@ -33,6 +34,90 @@ class TestJinja2Snippet(PapeterieTestCase):
     expected = "Marge Simpson\n123 Baker St\nSpringfield, CA\n\n"
     self.assertEqual(result_string, expected)
 
+  def test_render_many(self):
+    """ Tests rendering a template for several recipients at once. """
+    headerline = ["AddressLine1", "AddressLine2", "AddressLine3"]
+    recipients = [Recipient(headerline, ["Marge Simpson", "123 Baker St", "Springfield, CA"]),
+                  Recipient(headerline, ["Ned Flanders", "124 Baker St", "Springfield, CA"])]
+    template_file = os.path.join(self.TESTDATA_FOLDER, "address_jinja.txt")
+
+    jinja_template = jinja2snippet.JinjaTemplate(template_file)
+    result = jinja_template.render_many(recipients)
+
+    expected = [jinja_template.render(recipient) for recipient in recipients]
+    self.assertEqual(expected, result)
+    self.assertTrue(result[1].startswith("Ned Flanders\n"))
+
+  def test_shared_environment(self):
+    """ Tests that templates of the same directory share one environment. """
+    first = jinja2snippet.get_environment(self.TESTDATA_FOLDER)
+    second = jinja2snippet.get_environment(self.TESTDATA_FOLDER + "/")
+
+    self.assertIs(first, second)
+    self.assertIsNot(first, jinja2snippet.get_environment(self.test_dir))
+
+  def test_bytecode_cache(self):
+    """ Tests that compiled templates are stored in the bytecode cache. """
+    template_file = os.path.join(self.test_dir, "snippet.ji2")
+    with open(template_file, 'w') as outfile:
+      outfile.write("{{ Name }}")
+    bytecode_cache_dir = os.path.join(self.test_dir, "bytecode")
+
+    jinja_template = jinja2snippet.JinjaTemplate(template_file, bytecode_cache_dir)
+
+    self.assertEqual("Bart", jinja_template.render(Recipient(["Name"], ["Bart"])))
+    self.assertEqual(1, len(os.listdir(bytecode_cache_dir)))
+
+  def write_template(self, name, content):
+    """ Writes a template file to the test directory and returns its path. """
+    template_file = os.path.join(self.test_dir, name)
+    with open(template_file, 'w') as outfile:
+      outfile.write(content)
+    return template_file
+
+  def test_variables(self):
+    """ Tests finding the variables a template reads. """
+    static_file = self.write_template("static.ji2", "{% set x = 1 %}Blank {{ x }}")
+    themed_file = self.write_template(
+        "themed.ji2", "{% if Theme == 'Goth' %}{{ Name }}{% endif %}")
+    include_file = self.write_template("include.ji2", "{% include 'static.ji2' %}")
+
+    self.assertEqual((), jinja2snippet.JinjaTemplate(static_file).variables)
+    self.assertEqual(("Name", "Theme"), jinja2snippet.JinjaTemplate(themed_file).variables)
+    self.assertIsNone(jinja2snippet.JinjaTemplate(include_file).variables)
+
+  def test_memoized_render(self):
+    """ Tests that recipients with the same values of the variables share a rendering. """
+    template_file = self.write_template("theme.ji2", "{{ Theme }}!")
+    headerline = ["Name", "Theme"]
+    recipients = [Recipient(headerline, ["Bart", "Goth"]),
+                  Recipient(headerline, ["Lisa", "Goth"]),
+                  Recipient(headerline, ["Maggie", "Cthulhu"])]
+
+    jinja_template = jinja2snippet.JinjaTemplate(template_file)
+    result = jinja_template.render_many(recipients)
+
+    self.assertEqual(["Goth!", "Goth!", "Cthulhu!"], result)
+    self.assertIs(result[0], result[1])
+
+  def test_memoized_render_bounded(self):
+    """ Tests that only the most recently used renderings are kept. """
+    template_file = self.write_template("name.ji2", "Dear {{ Name }}")
+    recipients = [Recipient(["Name"], ["Recipient %d" % idx]) for idx in range(1000)]
+
+    with mock.patch.object(jinja2snippet, "MAX_RENDERINGS", 2):
+      jinja_template = jinja2snippet.JinjaTemplate(template_file)
+      first = jinja_template.render(recipients[0])
+      again = jinja_template.render(recipients[0])
+      jinja_template.render_many(recipients[1:])
+      last = jinja_template.render(recipients[-1])
+      evicted = jinja_template.render(recipients[0])
+
+      self.assertIs(first, again)
+      self.assertIs(last, jinja_template.render(recipients[-1]))
+      self.assertEqual(first, evicted)
+      self.assertIsNot(first, evicted)
+
 
 if __name__ == '__main__':
   unittest.main()
@@ -14,12 +14,13 @@ from configuration import config_from_json
 from output import BaseOutputController
 from papeterie import create_single_papeterie
 from pdflatex import PdfLatex
-from snippets import from_file
+from snippets import from_file, SnippetCache
 from simple_template import SimpleTemplate
 
 
 DEFAULT_DEFAULTS = os.path.join(str(Path.home()), ".papeterie")
 DEFAULT_SNIPPETS = "default.pap"
+SNIPPET_CACHE = ".snippet_cache"
 
 
 # pylint: disable=redefined-outer-name
@@ -37,14 +38,20 @@ def setup_snippets(args, config):
 
   """
   defaults = args.defaults if args.defaults else DEFAULT_DEFAULTS
+  # The parsed snippet files are cached in the defaults directory, if there is one.
+  read_snippets = from_file
+  if os.path.isdir(defaults):
+    read_snippets = SnippetCache(os.path.join(defaults, SNIPPET_CACHE)).from_file
+
+  default_snippets = None
   default_snippets_file = os.path.join(defaults, DEFAULT_SNIPPETS)
   if os.path.exists(default_snippets_file):
-    default_snippets = from_file(
+    default_snippets = read_snippets(
         config.snippets.keys(), default_snippets_file, check_completeness=False)
   else:
     logging.info("No default snippets file found.")
 
-  snippets = from_file(config.snippets.keys(), args.snippets, check_completeness=False)
+  snippets = read_snippets(config.snippets.keys(), args.snippets, check_completeness=False)
   if default_snippets:
     snippets = default_snippets.merge_with(snippets, check_overlapping=False)
   snippets.check_completeness(config.snippets.keys())
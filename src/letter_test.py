@@ -11,7 +11,7 @@ from argparse import Namespace
 
 from testing import PapeterieTestCase
 
-from letter import run
+from letter import run, DEFAULT_SNIPPETS, SNIPPET_CACHE
 
 
 def setup_args(input_dir, snippets, output_path, keep_tmp=True, defaults=None):
@@ -87,6 +87,20 @@ class TestLetter(PapeterieTestCase):
 
     self.assert_pdf(output_path)
 
+  def test_letter_defaults(self):
+    """ Tests rendering a letter with default snippets, twice to use the snippet cache. """
+    snippets_file = os.path.join(self.DATA_FOLDER, "example_snippets_letter.pap")
+    shutil.copy(snippets_file, os.path.join(self.test_dir, DEFAULT_SNIPPETS))
+    output_path = os.path.join(self.test_dir, "result.pdf")
+    input_dir = os.path.join(self.DATA_FOLDER, "letter_en")
+    args = setup_args(input_dir, snippets_file, output_path, defaults=self.test_dir)
+
+    run(args, lambda _: None)
+    run(args, lambda _: None)
+
+    self.assert_pdf(output_path)
+    self.assertEqual(2, len(os.listdir(os.path.join(self.test_dir, SNIPPET_CACHE))))
+
 
 if __name__ == '__main__':
   unittest.main()
@@ -5,16 +5,52 @@
 Output controllers compose the various temporary and final filenames in a
 consistent manner.
 
+The temporary files are stored either on disk or in memory. pdflatex only reads
+and writes files, hence memory means a tmpfs, where files never touch a disk.
+
 """
 
 import os
 import tempfile
 
 
+# Storages of the temporary files.
+DISK = "disk"
+MEMORY = "memory"
+STORAGES = [DISK, MEMORY]
+
+# The tmpfs that keeps temporary files in memory.
+MEMORY_DIR = "/dev/shm"
+
+
 class OutputControllerException(Exception):
   """ Exceptions of this module. """
 
 
+def make_tmp_dir(storage=DISK):
+  """ Creates a directory for temporary files.
+
+  storage: string
+    DISK for the default temporary directory of the system, MEMORY for MEMORY_DIR
+
+  returns: string
+    path of the new directory
+
+  raises: OutputControllerException
+    if the storage is unknown or not available on this system
+
+  """
+  if storage == DISK:
+    return tempfile.mkdtemp()
+  if storage == MEMORY:
+    if not os.path.isdir(MEMORY_DIR) or not os.access(MEMORY_DIR, os.W_OK):
+      raise OutputControllerException(
+          "Cannot keep temporary files in memory, %s is not available." % MEMORY_DIR)
+    return tempfile.mkdtemp(dir=MEMORY_DIR, prefix="papeterie_")
+  raise OutputControllerException(
+      "Unknown storage %s, expected one of %s." % (storage, ", ".join(STORAGES)))
+
+
 class BaseOutputController():
   """ Base class for output controllers.
 
@@ -22,12 +58,15 @@ class BaseOutputController():
     path of the final output file (pdf).
   tmp_dir: string (optional)
     the path of a directory to write temporary files in
+  storage: string
+    where to create the directory for temporary files if none is given, see
+    make_tmp_dir
 
   """
-  def __init__(self, output_file, tmp_dir=None):
+  def __init__(self, output_file, tmp_dir=None, storage=DISK):
     self.__tmp_dir = tmp_dir
     if not self.__tmp_dir:
-      self.__tmp_dir = tempfile.mkdtemp()
+      self.__tmp_dir = make_tmp_dir(storage)
     self.__output_file = output_file
 
   @property
@@ -49,6 +88,16 @@ class BaseOutputController():
     """ Filename of the final output file (pdf). """
     return self.__output_file
 
+  @property
+  def format_dir(self):
+    """ Directory to store precompiled tex preambles (formats) in. """
+    return os.path.join(self.__tmp_dir, "formats")
+
+  @property
+  def picture_dir(self):
+    """ Directory to store prepared pictures in, see pictures.PictureCache. """
+    return os.path.join(self.__tmp_dir, "pictures")
+
   @property
   def tex_collection(self):
     """ Filename of the collection of tex snippets. """
@@ -70,6 +119,11 @@ class BaseOutputController():
     """ Path of the pdf file in the temporary directory. """
     return os.path.join(self.__tmp_dir, "%s.pdf" % self.pdf_basename)
 
+  @property
+  def tex_log(self):
+    """ Path of the log file pdflatex writes next to the pdf file. """
+    return os.path.join(self.__tmp_dir, "%s.log" % self.pdf_basename)
+
 
 class IndexedOutputController(BaseOutputController):
   """ Output controller which produces filenames with a given index in the filenames.
@@ -125,6 +179,76 @@ class IndexedOutputController(BaseOutputController):
     return os.path.join(self.tmp_dir, "%s.pdf" % self.pdf_basename)
 
 
+class BatchOutputController(BaseOutputController):
+  """ Output controller for a batch of pieces of papeterie compiled in one go.
+
+  The batch is compiled into one pdf, which is then split into the pdfs of the
+  individual pieces of papeterie.
+
+  output_file: see BaseOutputController
+  tmp_dir: see BaseOutputController
+  idx: integer
+    number of the batch
+
+  """
+  def __init__(self, output_file, tmp_dir, idx):
+    if not tmp_dir:
+      raise OutputControllerException(
+          "The batch output controller requires a temp dir.")
+    super().__init__(output_file, tmp_dir=tmp_dir)
+    self.__idx = idx
+
+  @property
+  def tex_result(self):
+    """ Filename of the assembled tex file of the whole batch. """
+    return os.path.join(self.tmp_dir, "batch_%03d.tex" % self.__idx)
+
+  @property
+  def pdf_basename(self):
+    # pylint: disable=no-self-use
+    return "batch_%03d" % self.__idx
+
+  @property
+  def pdf_path(self):
+    return os.path.join(self.tmp_dir, "%s.pdf" % self.pdf_basename)
+
+  @property
+  def pages_file(self):
+    """ Filename of the file in which tex notes the page ranges of the pieces. """
+    return os.path.join(self.tmp_dir, "%s.pages" % self.pdf_basename)
+
+
+class BackgroundOutputController(BaseOutputController):
+  """ Output controller for a background layer, see Configuration.background_template.
+
+  output_file: see BaseOutputController
+  tmp_dir: see BaseOutputController
+  name: string
+    name that distinguishes the renderings of the background
+
+  """
+  def __init__(self, output_file, tmp_dir, name):
+    if not tmp_dir:
+      raise OutputControllerException(
+          "The background output controller requires a temp dir.")
+    super().__init__(output_file, tmp_dir=tmp_dir)
+    self.__name = name
+
+  @property
+  def tex_result(self):
+    """ Filename of the assembled tex file of the background. """
+    return os.path.join(self.tmp_dir, "background_%s.tex" % self.__name)
+
+  @property
+  def pdf_basename(self):
+    # pylint: disable=no-self-use
+    return "background_%s" % self.__name
+
+  @property
+  def pdf_path(self):
+    return os.path.join(self.tmp_dir, "%s.pdf" % self.pdf_basename)
+
+
 class SerialOutputController(BaseOutputController):
   """ Manages the output files for a papeterie composed of a series of pieces.
 
@@ -134,21 +258,13 @@ class SerialOutputController(BaseOutputController):
     boolean, indicating whether or not a subfolder named like a timestamp should be created.
     This is useful when you want to render the same papeterie several times and want to keep
     all results.
+  storage: string
+    where to keep the temporary files, see make_tmp_dir
 
   """
 
-  def __init__(self, output_file):
-    super().__init__(output_file)
-
-  @property
-  def pdf_pattern(self):
-    """ Regex pattern to collect all pdfs of all pieces of papeterie.
-
-    idx: int
-      index of the piece of papeterie
-
-    """
-    return os.path.join(self.tmp_dir, "papeterie_*.pdf")
+  def __init__(self, output_file, storage=DISK):
+    super().__init__(output_file, storage=storage)
 
   def get_indexed_output_controller(self, idx):
     """ Returns an output controller for an indivdual numbered piece of papeterie.
@@ -158,3 +274,21 @@ class SerialOutputController(BaseOutputController):
 
     """
     return IndexedOutputController(self.output_file, self.tmp_dir, idx)
+
+  def get_batch_output_controller(self, idx):
+    """ Returns an output controller for a batch of pieces of papeterie.
+
+    idx: integer
+      number of the batch
+
+    """
+    return BatchOutputController(self.output_file, self.tmp_dir, idx)
+
+  def get_background_output_controller(self, name):
+    """ Returns an output controller for a background layer.
+
+    name: string
+      name that distinguishes the renderings of the background
+
+    """
+    return BackgroundOutputController(self.output_file, self.tmp_dir, name)
@@ -2,32 +2,332 @@
 
 """ Common high level code of all papeterie types. """
 
+import hashlib
 import logging
 
-from tex import texify
+from pdf import split_pdf
+from snippets import PAPETERIEPICPATH
+from tex import texify, split_document, BEGIN_DOCUMENT, END_DOCUMENT
 
 
-def create_single_papeterie(pdflatex, output, template, snippets):
-  """ Creates one single file of papeterie.
+class PapeterieException(Exception):
+  """ Exception for this module. """
+
+
+# Counts the pages shipped out so far and writes that count to '<jobname>.pages'
+# whenever one piece of a batch is complete. Before each piece, all LaTeX counters
+# (those in \cl@@ckpt, e.g. footnote, equation, section) start over.
+BATCH_PREAMBLE = u"""\\usepackage{atbegshi}
+\\newcount\\papeterieshipped
+\\AtBeginShipout{\\global\\advance\\papeterieshipped by 1}
+\\newwrite\\papeteriepages
+\\makeatletter
+\\newcommand{\\papeteriereset}{\\begingroup
+  \\def\\@elt##1{\\global\\csname c@##1\\endcsname\\z@}\\cl@@ckpt
+  \\endgroup}
+\\makeatother
+"""
+BATCH_SETUP = u"""
+\\immediate\\openout\\papeteriepages=\\jobname.pages
+"""
+BATCH_PIECE = u"""
+\\papeteriereset
+\\setcounter{page}{1}
+\\begingroup
+%s
+\\endgroup
+\\clearpage
+\\immediate\\write\\papeteriepages{\\the\\papeterieshipped}
+"""
+BATCH_END = u"""
+\\immediate\\closeout\\papeteriepages
+"""
+
+# Written in front of each tex file to compile. pdflatex derives the ID of a pdf
+# from the name of the output file, hence without omitting it the same document
+# would compile to different bytes for each recipient. It shares the first line
+# with the document, so that the line numbers in pdflatex's log stay the same.
+REPRODUCIBLE_OUTPUT = u"\\pdftrailerid{}"
+
+
+def render_tex(template, snippets):
+  """ Renders the tex file of one piece of papeterie.
 
-  pdflatex: PdfLatex
-    the binary that compiles the pdf
-  output: BaseOutputController
-    a thing that knows all the filenames
   template: SimpleTemplate
     a simple template with placeholders
   snippets: Snippets
     a collection of snippets that fit the placeholders of the template
 
+  returns: string
+    the content of the tex file
+
   """
   texified_snippets = snippets.transform(texify)
-  texcontent = template.render(texified_snippets)
+  return template.render(texified_snippets)
+
+
+def document_key(snippets):
+  """ Identifies the document that is rendered from snippets.
+
+  The tex file of a piece of papeterie is determined by its template and its
+  snippets. Hence, with the same template, snippets with the same key render the
+  same tex file and compile to the same pdf.
+
+  snippets: Snippets
+    a collection of snippets
+
+  returns: string
+    the hex digest of the snippets
+
+  """
+  sha = hashlib.sha256()
+  for (name, text) in sorted(snippets.view().items()):
+    sha.update(name.encode("utf-8"))
+    sha.update(b"\0")
+    sha.update(text.encode("utf-8"))
+    sha.update(b"\0")
+  return sha.hexdigest()
+
+
+def cache_key(pdflatex, texcontent, snippets, cache):
+  """ Computes the key of a rendered tex file in the compile cache.
+
+  See create_single_papeterie for the arguments.
+
+  """
+  return cache.key(texcontent, snippets.view().get(PAPETERIEPICPATH), pdflatex.version)
+
+
+def batch_cache_key(pdflatex, texcontent, snippets, cache):
+  """ Computes the key of a rendered tex file that is compiled as part of a batch.
+
+  Global state like labels or settings of one piece of a batch is not reset before
+  the next piece, hence the pdf of a piece compiled in a batch is not necessarily
+  the same as if compiled on its own. It is cached under a different key, so that
+  it is never taken for the pdf of a single compilation.
+
+  See create_single_papeterie for the arguments.
+
+  """
+  return cache_key(pdflatex, BATCH_PREAMBLE + texcontent, snippets, cache)
+
+
+def write_tex(pdflatex, output, texcontent, fmt_dir=None):
+  """ Writes a tex file to compile, see compile_tex.
+
+  returns: string
+    path of the format to compile the tex file with, None if there is none
+
+  """
+  fmt = None
+  if fmt_dir:
+    (preamble, body) = split_document(texcontent)
+    fmt = pdflatex.dump_format(preamble, fmt_dir)
+    texcontent = BEGIN_DOCUMENT + body + END_DOCUMENT + u"\n"
+
   with open(output.tex_result, 'w') as outfile:
+    outfile.write(REPRODUCIBLE_OUTPUT)
     outfile.write(texcontent)
   logging.info("Wrote tex file %s.", output.tex_result)
+  return fmt
+
+
+def compile_tex(pdflatex, output, texcontent, fmt_dir=None):
+  """ Writes a tex file and compiles it to pdf.
+
+  pdflatex: PdfLatex
+    the binary that compiles the pdf
+  output: BaseOutputController
+    a thing that knows all the filenames
+  texcontent: string
+    the content of the tex file
+  fmt_dir: string (optional)
+    if given, the preamble of the tex file is precompiled to a format in this
+    directory (or taken from there if it was precompiled before)
 
+  """
+  fmt = write_tex(pdflatex, output, texcontent, fmt_dir)
   pdflatex.run(
       output.tmp_dir,
       output.pdf_basename,
-      output.tex_result)
+      output.tex_result,
+      fmt=fmt)
   logging.info("Wrote pdf %s.", output.pdf_path)
+
+
+async def compile_tex_async(pdflatex, output, texcontent, fmt_dir=None, semaphore=None):
+  """ Writes a tex file and compiles it to pdf with an asyncio subprocess.
+
+  pdflatex, output, texcontent, fmt_dir: see compile_tex
+  semaphore: asyncio.Semaphore (optional)
+    limits the number of binaries that run at the same time
+
+  """
+  # pylint: disable=too-many-arguments
+  fmt = write_tex(pdflatex, output, texcontent, fmt_dir)
+  await pdflatex.run_async(
+      output.tmp_dir,
+      output.pdf_basename,
+      output.tex_result,
+      fmt=fmt,
+      semaphore=semaphore)
+  logging.info("Wrote pdf %s.", output.pdf_path)
+
+
+def take_from_cache(pdflatex, output, texcontent, snippets, cache):
+  """ Takes the pdf of a rendered tex file from the cache, if it is in there.
+
+  See create_single_papeterie for the arguments.
+
+  returns: (boolean, string)
+    whether or not the pdf was found, and its cache key (None without a cache)
+
+  """
+  # pylint: disable=too-many-arguments
+  if not cache:
+    return (False, None)
+  key = cache_key(pdflatex, texcontent, snippets, cache)
+  if cache.get(key, output.pdf_path):
+    logging.info("Took pdf %s from cache.", output.pdf_path)
+    return (True, key)
+  return (False, key)
+
+
+def create_single_papeterie(pdflatex, output, template, snippets, cache=None,
+                            fmt_dir=None):
+  """ Creates one single file of papeterie.
+
+  pdflatex: PdfLatex
+    the binary that compiles the pdf
+  output: BaseOutputController
+    a thing that knows all the filenames
+  template: SimpleTemplate
+    a simple template with placeholders
+  snippets: Snippets
+    a collection of snippets that fit the placeholders of the template
+  cache: CompileCache (optional)
+    a cache of compiled pdfs, pdflatex only runs if the pdf is not in there
+  fmt_dir: string (optional)
+    directory of precompiled preambles, see compile_tex
+
+  """
+  # pylint: disable=too-many-arguments
+  texcontent = render_tex(template, snippets)
+  (cached, key) = take_from_cache(pdflatex, output, texcontent, snippets, cache)
+  if cached:
+    return
+
+  compile_tex(pdflatex, output, texcontent, fmt_dir)
+
+  if cache:
+    cache.put(key, output.pdf_path)
+
+
+async def create_single_papeterie_async(pdflatex, output, template, snippets, cache=None,
+                                        fmt_dir=None, semaphore=None):
+  """ Creates one single file of papeterie, running pdflatex as asyncio subprocess.
+
+  pdflatex, output, template, snippets, cache, fmt_dir: see create_single_papeterie
+  semaphore: asyncio.Semaphore (optional)
+    limits the number of binaries that run at the same time
+
+  """
+  # pylint: disable=too-many-arguments
+  texcontent = render_tex(template, snippets)
+  (cached, key) = take_from_cache(pdflatex, output, texcontent, snippets, cache)
+  if cached:
+    return
+
+  await compile_tex_async(pdflatex, output, texcontent, fmt_dir, semaphore)
+
+  if cache:
+    cache.put(key, output.pdf_path)
+
+
+def read_page_ranges(pages_file):
+  """ Reads the page ranges of the pieces of a batch.
+
+  pages_file: string
+    path of the file written by the batch's tex file
+
+  returns: list of (integer, integer)
+    start (inclusive) and end (exclusive) page of each piece
+
+  """
+  with open(pages_file, 'r') as infile:
+    ends = [int(line) for line in infile if line.strip()]
+  return list(zip([0] + ends[:-1], ends))
+
+
+def create_papeterie_batch(pdflatex, batch_output, template, pieces, cache=None,
+                           fmt_dir=None):
+  """ Creates several files of papeterie with one single pdflatex run.
+
+  The preamble of the template is loaded only once for all pieces, the bodies of
+  the rendered documents are typeset one after another, each starting on a new
+  page. The resulting pdf is split into one pdf per piece.
+
+  Each piece starts with all LaTeX counters reset and its body in a group. Global
+  definitions and settings, labels and TeX counters of one piece still carry over to
+  the next, hence pieces with such state may look different than when compiled on
+  their own. The cache never mixes up the two, see batch_cache_key.
+
+  pdflatex: PdfLatex
+    the binary that compiles the pdf
+  batch_output: BatchOutputController
+    a thing that knows the filenames of the batch
+  template: SimpleTemplate
+    a simple template with placeholders
+  pieces: list of (BaseOutputController, Snippets)
+    the output controller and snippets of each piece of papeterie
+  cache: CompileCache (optional)
+    a cache of compiled pdfs, pieces found in there are not compiled again
+  fmt_dir: string (optional)
+    directory of precompiled preambles, see compile_tex
+
+  raises: PapeterieException
+    if the pieces' documents do not share the same preamble
+
+  """
+  preamble = None
+  bodies = []
+  compiled = []
+  for (output, snippets) in pieces:
+    texcontent = render_tex(template, snippets)
+    with open(output.tex_result, 'w') as outfile:
+      outfile.write(texcontent)
+
+    key = None
+    if cache:
+      key = batch_cache_key(pdflatex, texcontent, snippets, cache)
+      single_key = cache_key(pdflatex, texcontent, snippets, cache)
+      if cache.get(single_key, output.pdf_path) or cache.get(key, output.pdf_path):
+        logging.info("Took pdf %s from cache.", output.pdf_path)
+        continue
+
+    (piece_preamble, body) = split_document(texcontent)
+    if preamble is None:
+      preamble = piece_preamble
+    elif piece_preamble != preamble:
+      raise PapeterieException("The pieces of batch %s have different preambles." %
+                               batch_output.pdf_basename)
+    bodies.append(body)
+    compiled.append((output, key))
+
+  if not compiled:
+    return
+
+  texcontent = preamble + BATCH_PREAMBLE + BEGIN_DOCUMENT + BATCH_SETUP + \
+    u"".join(BATCH_PIECE % body for body in bodies) + BATCH_END + END_DOCUMENT + u"\n"
+  logging.info("Compiling batch %s with %d pieces.", batch_output.pdf_basename, len(compiled))
+  compile_tex(pdflatex, batch_output, texcontent, fmt_dir)
+
+  page_ranges = read_page_ranges(batch_output.pages_file)
+  if len(page_ranges) != len(compiled):
+    raise PapeterieException("Expected %d pieces in %s, but found %d." % (
+        len(compiled), batch_output.pdf_path, len(page_ranges)))
+  split_pdf(batch_output.pdf_path, page_ranges, [output.pdf_path for (output, _) in compiled])
+
+  if cache:
+    for (output, key) in compiled:
+      cache.put(key, output.pdf_path)
@@ -6,14 +6,16 @@ import os
 import shutil
 import tempfile
 import unittest
+from PyPDF2 import PdfFileReader
 
 from testing import PapeterieTestCase
 
+from cache import CompileCache
 from pdflatex import PdfLatex
-from output import BaseOutputController
+from output import BaseOutputController, SerialOutputController
 from simple_template import SimpleTemplate
 from snippets import Snippets
-from papeterie import create_single_papeterie
+from papeterie import create_single_papeterie, create_papeterie_batch, cache_key, render_tex
 
 class TestPapeterie(PapeterieTestCase):
   """ Tests the papeterie module. """
@@ -38,6 +40,76 @@ class TestPapeterie(PapeterieTestCase):
 
     self.assertTrue(os.path.exists(output.pdf_path))
 
+  def test_papeterie_batch(self):
+    """ Tests creating several pieces of papeterie with one pdflatex run. """
+    result_path = os.path.join(self.test_dir, "result.pdf")
+
+    pdflatex = PdfLatex()
+    output = SerialOutputController(result_path)
+    template_path = os.path.join(self.TESTDATA_FOLDER, "template_card.tex")
+    template = SimpleTemplate(template_path)
+    pieces = []
+    for idx in range(3):
+      snippets = Snippets({name: "%s %s" % (name, idx) for name in
+                           ["FRONT", "BACK", "INNERPAGELEFT", "INNERPAGERIGHT"]})
+      pieces.append((output.get_indexed_output_controller(idx), snippets))
+
+    create_papeterie_batch(pdflatex, output.get_batch_output_controller(0), template, pieces)
+
+    for (idx_output, _) in pieces:
+      self.assert_pdf(idx_output.pdf_path, 2)
+    shutil.rmtree(output.tmp_dir)
+
+  def write_footnote_template(self):
+    """ Writes a template whose body has a footnote. """
+    template_path = os.path.join(self.test_dir, "footnote.tex")
+    with open(template_path, 'w') as outfile:
+      outfile.write("\\documentclass{article}\n\\begin{document}\n"
+                    "TEXT\\footnote{Note}\n\\end{document}\n")
+    return SimpleTemplate(template_path)
+
+  def test_papeterie_batch_counters(self):
+    """ Tests that pieces of a batch look like pieces compiled on their own. """
+    pdflatex = PdfLatex()
+    output = SerialOutputController(os.path.join(self.test_dir, "result.pdf"))
+    template = self.write_footnote_template()
+    pieces = [(output.get_indexed_output_controller(idx), Snippets({"TEXT": "Text %d" % idx}))
+              for idx in range(2)]
+    single_output = output.get_indexed_output_controller(2)
+
+    create_papeterie_batch(pdflatex, output.get_batch_output_controller(0), template, pieces)
+    create_single_papeterie(pdflatex, single_output, template, pieces[1][1])
+
+    texts = []
+    for path in [pieces[1][0].pdf_path, single_output.pdf_path]:
+      with open(path, 'rb') as infile:
+        texts.append(PdfFileReader(infile).getPage(0).extractText())
+    self.assertEqual(texts[1], texts[0])
+    shutil.rmtree(output.tmp_dir)
+
+  def test_papeterie_batch_cache(self):
+    """ Tests that pieces of a batch are not cached as pieces compiled on their own. """
+    pdflatex = PdfLatex()
+    output = SerialOutputController(os.path.join(self.test_dir, "result.pdf"))
+    cache = CompileCache(os.path.join(self.test_dir, "cache"))
+    template = self.write_footnote_template()
+    pieces = [(output.get_indexed_output_controller(idx), Snippets({"TEXT": "Text %d" % idx}))
+              for idx in range(2)]
+    target = os.path.join(self.test_dir, "target.pdf")
+
+    create_papeterie_batch(
+        pdflatex, output.get_batch_output_controller(0), template, pieces, cache)
+
+    for (_, snippets) in pieces:
+      texcontent = render_tex(template, snippets)
+      self.assertFalse(cache.get(cache_key(pdflatex, texcontent, snippets, cache), target))
+    os.remove(pieces[0][0].pdf_path)
+    create_papeterie_batch(
+        pdflatex, output.get_batch_output_controller(1), template, pieces, cache)
+    self.assertFalse(os.path.exists(output.get_batch_output_controller(1).pdf_path))
+    self.assert_pdf(pieces[0][0].pdf_path)
+    shutil.rmtree(output.tmp_dir)
+
 
 if __name__ == '__main__':
   unittest.main()
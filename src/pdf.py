@@ -2,27 +2,375 @@
 
 """ Module to merge several pdfs into one. """
 
-import glob
+import concurrent.futures
+import hashlib
+import io
+import os
+import shutil
+import tempfile
 from PyPDF2 import PdfFileWriter, PdfFileReader
+from PyPDF2.generic import ArrayObject, DecodedStreamObject, DictionaryObject, IndirectObject, \
+    NameObject, NumberObject, StreamObject
 
+from cache import file_digest
 
-def merge_pdfs(pattern, output_path):
+
+# Number of pdfs each job merges, before the merged chunks are concatenated.
+DEFAULT_CHUNK_SIZE = 64
+
+# Attributes that pages inherit from their ancestors in the page tree.
+INHERITED_ATTRIBUTES = frozenset(["/Resources", "/MediaBox", "/CropBox", "/Rotate"])
+
+
+class PdfException(Exception):
+  """ Exceptions of this module. """
+
+
+def iter_pages(reference, inherited=None):
+  """ Lists the pages of a page tree.
+
+  reference: IndirectObject
+    reference to the root of the page tree
+  inherited: dictionary (optional)
+    attributes inherited from the ancestors of the root
+
+  returns: iterator of (IndirectObject, DictionaryObject)
+    the reference to each page, and the page with the attributes it inherits
+
+  """
+  node = reference.getObject()
+  attributes = dict(inherited or {})
+  for key in node:
+    if key in INHERITED_ATTRIBUTES:
+      attributes[key] = node.raw_get(key)
+  if "/Kids" not in node:
+    page = DictionaryObject()
+    page.update(attributes)
+    for key in node:
+      page[key] = node.raw_get(key)
+    yield (reference, page)
+    return
+  for kid in node["/Kids"]:
+    yield from iter_pages(kid, attributes)
+
+
+class PdfStreamWriter():
+  """ Writes a pdf while pdfs are added to it, instead of keeping all pages in
+      memory until the end.
+
+  The pdfs are read one at a time, and their pages and the objects they refer to
+  are written out right away. Identical objects, like pictures, fonts or the
+  contents of identical pages, are written only once: two objects are identical if
+  they have the same content, including the content of all objects they refer to.
+  Hence, what is kept in memory are only the digests and positions of the written
+  objects, and the page dictionaries of each file, so that files with the same
+  content are read only once.
+
+  outfile: file
+    binary file to write to, see close
+
+  """
+
+  # Object numbers of the page tree and the catalog, which are written last.
+  PAGES = 1
+  CATALOG = 2
+
+  def __init__(self, outfile):
+    self.__outfile = outfile
+    self.__count = self.CATALOG
+    # Positions of the written objects in the output, by object number.
+    self.__offsets = {}
+    # Object numbers of the written objects, by digest.
+    self.__numbers = {}
+    # Object numbers of the pages, in their order.
+    self.__pages = []
+    # Written page dictionaries of the files added so far, by digest of the file.
+    self.__files = {}
+    # Number of files read so far.
+    self.__reads = 0
+    # Digests of the objects of the file being read, by object number.
+    self.__digests = {}
+    # Object numbers of the pages of the file being read, by object number.
+    self.__page_numbers = {}
+    self.__outfile.write(b"%PDF-1.5\n%\xe2\xe3\xcf\xd3\n")
+
+  def add(self, path):
+    """ Writes the pages of a pdf.
+
+    path: string
+      path of the pdf
+
+    """
+    digest = file_digest(path)
+    if digest in self.__files:
+      for page in self.__files[digest]:
+        self.__add_page(self.__next_number(), page)
+      return
+
+    with open(path, 'rb') as infile:
+      reader = PdfFileReader(infile)
+      self.__reads += 1
+      self.__digests = {}
+      pages = list(iter_pages(reader.trailer["/Root"].raw_get("/Pages")))
+      # Objects may refer to pages that are not written yet.
+      self.__page_numbers = {(reference.idnum, reference.generation): self.__next_number()
+                             for (reference, _) in pages}
+      written = []
+      for (reference, page) in pages:
+        page[NameObject("/Parent")] = IndirectObject(self.PAGES, 0, None)
+        written.append(self.__serialize(page))
+        self.__add_page(self.__page_numbers[(reference.idnum, reference.generation)],
+                        written[-1])
+      self.__page_numbers = {}
+      self.__digests = {}
+    self.__files[digest] = written
+
+  def close(self):
+    """ Writes the page tree, the catalog and the cross-reference table.
+
+    The file itself is not closed.
+
+    """
+    kids = ArrayObject(IndirectObject(number, 0, None) for number in self.__pages)
+    pages = DictionaryObject()
+    pages[NameObject("/Type")] = NameObject("/Pages")
+    pages[NameObject("/Kids")] = kids
+    pages[NameObject("/Count")] = NumberObject(len(kids))
+    self.__write(self.PAGES, self.__serialize(pages))
+    catalog = DictionaryObject()
+    catalog[NameObject("/Type")] = NameObject("/Catalog")
+    catalog[NameObject("/Pages")] = IndirectObject(self.PAGES, 0, None)
+    self.__write(self.CATALOG, self.__serialize(catalog))
+
+    xref = self.__outfile.tell()
+    self.__outfile.write(b"xref\n0 %d\n0000000000 65535 f \n" % (self.__count + 1))
+    for number in range(1, self.__count + 1):
+      self.__outfile.write(b"%010d 00000 n \n" % self.__offsets[number])
+    trailer = DictionaryObject()
+    trailer[NameObject("/Size")] = NumberObject(self.__count + 1)
+    trailer[NameObject("/Root")] = IndirectObject(self.CATALOG, 0, None)
+    self.__outfile.write(b"trailer\n%s\nstartxref\n%d\n%%%%EOF\n" % (
+        self.__serialize(trailer), xref))
+
+  def __next_number(self):
+    self.__count += 1
+    return self.__count
+
+  def __add_page(self, number, page):
+    self.__write(number, page)
+    self.__pages.append(number)
+
+  def __write(self, number, serialized):
+    self.__offsets[number] = self.__outfile.tell()
+    self.__outfile.write(b"%d 0 obj\n%s\nendobj\n" % (number, serialized))
+
+  def __serialize(self, obj):
+    """ Serializes a direct object, writing the objects it refers to first. """
+    stream = io.BytesIO()
+    self.__resolve(obj).writeToStream(stream, None)
+    return stream.getvalue()
+
+  def __resolve(self, obj):
+    """ Copy of a direct object that refers to the written objects. """
+    if isinstance(obj, IndirectObject):
+      return IndirectObject(self.__write_indirect(obj), 0, None)
+    if isinstance(obj, DictionaryObject):
+      if isinstance(obj, StreamObject):
+        # Keeps the data as it is, encoded with the filters in the dictionary.
+        copy = DecodedStreamObject()
+        # pylint: disable=protected-access
+        copy._data = obj._data
+        # pylint: enable=protected-access
+      else:
+        copy = DictionaryObject()
+      for key in obj:
+        copy[key] = self.__resolve(obj.raw_get(key))
+      return copy
+    if isinstance(obj, ArrayObject):
+      return ArrayObject(self.__resolve(value) for value in obj)
+    return obj
+
+  def __known_number(self, reference):
+    """ Object number of a reference to a page or the page tree, None otherwise. """
+    if reference.pdf is None:
+      # Refers to the output already.
+      return reference.idnum
+    key = (reference.idnum, reference.generation)
+    if key in self.__page_numbers:
+      return self.__page_numbers[key]
+    obj = reference.getObject()
+    if isinstance(obj, DictionaryObject) and obj.get("/Type") == "/Pages":
+      return self.PAGES
+    return None
+
+  def __write_indirect(self, reference):
+    """ Writes an indirect object, unless an identical object was written before.
+
+    returns: integer
+      the object number in the output
+
+    """
+    number = self.__known_number(reference)
+    if number is not None:
+      return number
+    digest = self.__indirect_digest(reference)
+    if digest not in self.__numbers:
+      number = self.__next_number()
+      # Known before writing, in case the object refers back to itself.
+      self.__numbers[digest] = number
+      self.__write(number, self.__serialize(reference.getObject()))
+    return self.__numbers[digest]
+
+  def __digest(self, obj):
+    """ Digest of an object, including the objects it refers to. """
+    if isinstance(obj, IndirectObject):
+      return self.__indirect_digest(obj)
+
+    sha = hashlib.sha256()
+    if isinstance(obj, DictionaryObject):
+      sha.update(b"<<")
+      for key in sorted(obj):
+        sha.update(key.encode("utf-8"))
+        sha.update(self.__digest(obj.raw_get(key)))
+      sha.update(b">>")
+      if isinstance(obj, StreamObject):
+        # pylint: disable=protected-access
+        sha.update(obj._data)
+        # pylint: enable=protected-access
+    elif isinstance(obj, ArrayObject):
+      sha.update(b"[")
+      for value in obj:
+        sha.update(self.__digest(value))
+      sha.update(b"]")
+    else:
+      sha.update(("%s %r" % (type(obj).__name__, obj)).encode("utf-8"))
+    return sha.digest()
+
+  def __indirect_digest(self, reference):
+    """ Digest of an indirect object, computed once per object. """
+    number = self.__known_number(reference)
+    if number is not None:
+      # Pages are never shared, and neither are the objects that refer to them.
+      return hashlib.sha256(b"object %d" % number).digest()
+    key = (reference.idnum, reference.generation)
+    if key not in self.__digests:
+      # Objects that refer back to themselves get a unique digest until their
+      # digest is known, so that they are never taken for another object.
+      self.__digests[key] = hashlib.sha256(b"%d %d %d" % (self.__reads, *key)).digest()
+      self.__digests[key] = self.__digest(reference.getObject())
+    return self.__digests[key]
+
+
+def concatenate_pdfs(paths, output_path):
+  """ Concatenates PDFs, reading one at a time, see PdfStreamWriter.
+
+  paths: list of strings
+    paths of the files to concatenate, in the order in which they appear in the
+    output
+  output_path: string
+    path of the output file
+
+  """
+  with open(output_path, 'wb') as outfile:
+    writer = PdfStreamWriter(outfile)
+    for path in paths:
+      writer.add(path)
+    writer.close()
+
+
+def merge_pdfs(paths, output_path, chunk_size=DEFAULT_CHUNK_SIZE, jobs=1):
   """ Merge several PDFs into one.
 
-  pattern: string
-    pattern to list all files to merge
+  The files are read one at a time and their pages are written out right away, see
+  PdfStreamWriter. Hence, neither the number of open files nor the memory for the
+  pages grows with the number of input files.
+
+  With several jobs, chunks of chunk_size files are concatenated in parallel first,
+  and the chunks are then concatenated. This reads all pages twice, but the pages
+  of different chunks are parsed at the same time.
+
+  paths: list of strings
+    paths of the files to merge, in the order in which they appear in the output
   output_path: string
     path of the output file
+  chunk_size: integer
+    number of files each job merges at once, must be at least 2
+  jobs: integer
+    number of chunks to merge in parallel
 
   """
-  writer = PdfFileWriter()
+  if chunk_size < 2:
+    raise PdfException("The chunk size must be at least 2, got %s." % chunk_size)
 
-  paths = glob.glob(pattern)
+  if jobs <= 1 or len(paths) <= chunk_size:
+    concatenate_pdfs(paths, output_path)
+    return
 
-  for path in paths:
-    reader = PdfFileReader(path)
-    for page in range(reader.getNumPages()):
-      writer.addPage(reader.getPage(page))
+  chunk_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(output_path)))
+  try:
+    chunks = [paths[start:start + chunk_size] for start in range(0, len(paths), chunk_size)]
+    chunk_paths = [os.path.join(chunk_dir, "chunk_%05d.pdf" % idx) for idx in range(len(chunks))]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+      for _ in executor.map(concatenate_pdfs, chunks, chunk_paths):
+        pass
+    concatenate_pdfs(chunk_paths, output_path)
+  finally:
+    shutil.rmtree(chunk_dir)
 
-  with open(output_path, 'wb') as outfile:
-    writer.write(outfile)
+
+def split_pdf(path, page_ranges, output_paths):
+  """ Split a PDF into several ones.
+
+  path: string
+    path of the PDF to split
+  page_ranges: list of (integer, integer)
+    start (inclusive) and end (exclusive) of the pages of each output file,
+    counting from 0
+  output_paths: list of strings
+    paths of the output files, one per page range
+
+  """
+  with open(path, 'rb') as infile:
+    reader = PdfFileReader(infile)
+    for ((start, end), output_path) in zip(page_ranges, output_paths):
+      writer = PdfFileWriter()
+      for page in range(start, end):
+        writer.addPage(reader.getPage(page))
+      with open(output_path, 'wb') as outfile:
+        writer.write(outfile)
+
+
+def stamp_pdf(background_path, path, output_path):
+  """ Stamps the pages of a PDF onto the pages of a background PDF.
+
+  Page i of the PDF is put on top of page i of the background. Pages beyond the
+  last page of the background are taken as they are.
+
+  background_path: string
+    path of the background PDF
+  path: string
+    path of the PDF to stamp onto the background
+  output_path: string
+    path of the output file, which may be the same as path
+
+  """
+  writer = PdfFileWriter()
+  with open(background_path, 'rb') as background_file, open(path, 'rb') as infile:
+    background = PdfFileReader(background_file)
+    reader = PdfFileReader(infile)
+    for idx in range(reader.getNumPages()):
+      page = reader.getPage(idx)
+      if idx < background.getNumPages():
+        # Merging modifies the background page, hence the background is read
+        # again for each stamp.
+        background_page = background.getPage(idx)
+        background_page.mergePage(page)
+        page = background_page
+      writer.addPage(page)
+
+    # Write to a temporary file first, the output might replace the input.
+    (handle, tmp_path) = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(output_path)), suffix=".pdf")
+    with os.fdopen(handle, 'wb') as outfile:
+      writer.write(outfile)
+  os.replace(tmp_path, output_path)
@@ -2,13 +2,16 @@
 
 """ Unit tests for pdf. """
 
+import glob
 import os
 import shutil
 import tempfile
 import unittest
+from unittest import mock
+from PyPDF2 import PdfFileReader
 
 from testing import PapeterieTestCase
-from pdf import merge_pdfs
+from pdf import merge_pdfs, split_pdf
 
 
 class TestMergePdfs(PapeterieTestCase):
@@ -22,13 +25,141 @@ class TestMergePdfs(PapeterieTestCase):
 
   def test_merge_pdfs(self):
     """ Test merging pdfs. """
-    pattern = "%s/card*.pdf" % self.TESTDATA_FOLDER
+    paths = sorted(glob.glob("%s/card*.pdf" % self.TESTDATA_FOLDER))
     result = os.path.join(self.test_dir, "result.pdf")
 
-    merge_pdfs(pattern, result)
+    merge_pdfs(paths, result)
 
     self.assert_pdf(result, 2)
 
+  def test_merge_pdfs_chunked(self):
+    """ Test merging pdfs in several parallel chunks keeps the order. """
+    card01 = os.path.join(self.TESTDATA_FOLDER, "card01.pdf")
+    card02 = os.path.join(self.TESTDATA_FOLDER, "card02.pdf")
+    paths = [card01, card02, card02, card01, card02, card01, card01]
+    result = os.path.join(self.test_dir, "result.pdf")
+
+    merge_pdfs(paths, result, chunk_size=2, jobs=2)
+
+    self.assert_pdf(result, len(paths))
+    contents = {}
+    for path in [card01, card02]:
+      with open(path, 'rb') as infile:
+        contents[path] = PdfFileReader(infile).getPage(0).getContents().getData()
+    with open(result, 'rb') as infile:
+      reader = PdfFileReader(infile)
+      for (idx, path) in enumerate(paths):
+        self.assertEqual(contents[path], reader.getPage(idx).getContents().getData())
+    self.assertEqual(["result.pdf"], os.listdir(self.test_dir))
+
+  def test_merge_pdfs_shares_duplicates(self):
+    """ Test that files with the same content share their page contents. """
+    card01 = os.path.join(self.TESTDATA_FOLDER, "card01.pdf")
+    copy = os.path.join(self.test_dir, "copy.pdf")
+    shutil.copyfile(card01, copy)
+    card02 = os.path.join(self.TESTDATA_FOLDER, "card02.pdf")
+    result = os.path.join(self.test_dir, "result.pdf")
+
+    merge_pdfs([card01, card02, card01, copy], result)
+
+    self.assert_pdf(result, 4)
+    with open(result, 'rb') as infile:
+      reader = PdfFileReader(infile)
+      contents = [reader.getPage(idx).raw_get("/Contents").idnum for idx in range(4)]
+    self.assertNotEqual(contents[0], contents[1])
+    self.assertEqual(contents[0], contents[2])
+    self.assertEqual(contents[0], contents[3])
+
+  def test_merge_pdfs_shares_objects(self):
+    """ Test that identical objects of different files are merged only once. """
+    card01 = os.path.join(self.TESTDATA_FOLDER, "card01.pdf")
+    card02 = os.path.join(self.TESTDATA_FOLDER, "card02.pdf")
+    paths = [card01, card02, card01, card02]
+    result = os.path.join(self.test_dir, "result.pdf")
+
+    # The chunks [card01, card02, card01] and [card02] are different files.
+    merge_pdfs(paths, result, chunk_size=3, jobs=2)
+
+    self.assert_pdf(result, 4)
+    with open(result, 'rb') as infile:
+      reader = PdfFileReader(infile)
+      pages = [reader.getPage(idx) for idx in range(4)]
+      contents = [page.raw_get("/Contents").idnum for page in pages]
+      self.assertNotEqual(contents[0], contents[1])
+      self.assertEqual(contents[1], contents[3])
+      self.assertEqual(contents[0], contents[2])
+      self.assertEqual(pages[1]["/Resources"], pages[3]["/Resources"])
+
+  def test_merge_pdfs_one_file_at_a_time(self):
+    """ Test that only one input file is open at a time. """
+    card01 = os.path.join(self.TESTDATA_FOLDER, "card01.pdf")
+    card02 = os.path.join(self.TESTDATA_FOLDER, "card02.pdf")
+    result = os.path.join(self.test_dir, "result.pdf")
+    opened = []
+
+    def open_input(path, mode='r'):
+      if path == result:
+        return open(path, mode)
+      # All input files opened before must have been closed.
+      self.assertTrue(all(infile.closed for infile in opened))
+      opened.append(open(path, mode))
+      return opened[-1]
+
+    with mock.patch("pdf.open", open_input, create=True):
+      merge_pdfs([card01, card02] * 3, result)
+
+    self.assert_pdf(result, 6)
+
+  def write_pdf(self, path, objects):
+    """ Writes a pdf with the given objects, numbered from 1, the first is the
+        catalog. """
+    content = b"%PDF-1.4\n"
+    offsets = []
+    for (idx, obj) in enumerate(objects):
+      offsets.append(len(content))
+      content += b"%d 0 obj\n%s\nendobj\n" % (idx + 1, obj)
+    xref = len(content)
+    content += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    content += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    content += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1, xref)
+    with open(path, 'wb') as outfile:
+      outfile.write(content)
+
+  def test_merge_pdfs_references_to_pages(self):
+    """ Test that objects referring to a page refer to the page in the output. """
+    linked = os.path.join(self.test_dir, "linked.pdf")
+    self.write_pdf(linked, [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R 4 0 R] /Count 2 /MediaBox [0 0 100 100] >>",
+        b"<< /Type /Page /Parent 2 0 R /Annots [5 0 R] >>",
+        b"<< /Type /Page /Parent 2 0 R >>",
+        b"<< /Type /Annot /Subtype /Link /Rect [0 0 10 10] /Dest [4 0 R /Fit] >>"])
+    result = os.path.join(self.test_dir, "result.pdf")
+
+    merge_pdfs([os.path.join(self.TESTDATA_FOLDER, "card01.pdf"), linked], result)
+
+    with open(result, 'rb') as infile:
+      reader = PdfFileReader(infile)
+      self.assertEqual(3, reader.getNumPages())
+      link = reader.getPage(1)["/Annots"][0].getObject()
+      pages = reader.trailer["/Root"]["/Pages"]["/Kids"]
+      self.assertEqual(pages[2].idnum, link["/Dest"][0].idnum)
+      # The pages inherit the media box of the page tree.
+      self.assertEqual([0, 0, 100, 100], list(reader.getPage(2)["/MediaBox"]))
+
+  def test_split_pdf(self):
+    """ Test splitting a pdf. """
+    paths = [os.path.join(self.TESTDATA_FOLDER, "card01.pdf")] * 3
+    merged = os.path.join(self.test_dir, "merged.pdf")
+    merge_pdfs(paths, merged)
+    results = [os.path.join(self.test_dir, "result%s.pdf" % idx) for idx in range(2)]
+
+    split_pdf(merged, [(0, 1), (1, 3)], results)
+
+    self.assert_pdf(results[0], 1)
+    self.assert_pdf(results[1], 2)
+
 
 if __name__ == '__main__':
   unittest.main()
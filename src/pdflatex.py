@@ -2,21 +2,106 @@
 
 """ Module to create a pdf from a tex file. """
 
+import hashlib
+import logging
 import os
 
-from binary import Binary
+from binary import Binary, BinaryException
+from cache import file_digest
+from texlog import parse_log
+
+
+# Seconds after which pdflatex is killed.
+DEFAULT_TIMEOUT = 120
+
+# Maximum number of pdflatex passes to get references etc. right.
+DEFAULT_MAX_PASSES = 3
+
+# Never wait for input on errors, but stop at the first one.
+NONINTERACTIVE_ARGS = ["-interaction=nonstopmode", "-halt-on-error"]
+
+# Fixed creation and modification dates of the pdfs, so that the same tex file
+# always compiles to the same bytes. Unless FORCE_SOURCE_DATE is set as well,
+# \today is still the actual date.
+REPRODUCIBLE_ENV = {"SOURCE_DATE_EPOCH": "0"}
 
 
 class PdfLatexException(Exception):
   """ Exception for this module. """
 
 class PdfLatex(Binary):
-  """ The 'pdflatex' binary. """
+  """ The 'pdflatex' binary.
 
-  def __init__(self):
+  pdflatex never waits for input, it stops at the first error instead. The errors
+  are taken from its log file. The dates in the pdfs are fixed, see REPRODUCIBLE_ENV.
+
+  timeout: number
+    seconds after which a pdflatex run is killed
+  max_passes: integer
+    maximum number of times pdflatex runs on the same document, see run
+
+  """
+
+  def __init__(self, timeout=DEFAULT_TIMEOUT, max_passes=DEFAULT_MAX_PASSES):
     super().__init__("pdflatex")
+    if max_passes < 1:
+      raise PdfLatexException("The number of passes must be positive, got %s." % max_passes)
+    self.__timeout = timeout
+    self.__max_passes = max_passes
+
+  def dump_format(self, preamble, fmt_dir):
+    """ Dumps the preamble of a tex document into a format file.
 
-  def run(self, out_dir, out_basename, filename):
+    Documents compiled with the format do not need to load the packages of the
+    preamble again. The format is only dumped if there is none yet for the same
+    preamble and the same version of pdflatex.
+
+    preamble: string
+      everything before '\\begin{document}' of a tex document
+    fmt_dir: string
+      directory to store the format in
+
+    returns: string
+      path of the format, without the '.fmt' extension, see run()
+
+    """
+    sha = hashlib.sha256()
+    sha.update(self.version.encode("utf-8"))
+    sha.update(b"\0")
+    sha.update(preamble.encode("utf-8"))
+    fmt_name = "papeterie_%s" % sha.hexdigest()[:32]
+    fmt_path = os.path.join(fmt_dir, fmt_name)
+    if os.path.exists("%s.fmt" % fmt_path):
+      return fmt_path
+
+    os.makedirs(fmt_dir, exist_ok=True)
+    # Several processes might dump the same format at the same time, hence each of
+    # them works on its own files and only the final rename is shared.
+    job_name = "%s_%s" % (fmt_name, os.getpid())
+    preamble_file = os.path.join(fmt_dir, "%s.tex" % job_name)
+    with open(preamble_file, 'w') as outfile:
+      outfile.write(preamble)
+      outfile.write("\n\\dump\n")
+
+    args = ["-ini"] + NONINTERACTIVE_ARGS + [
+        "-output-directory=%s" % fmt_dir, "-jobname=%s" % job_name, "&pdflatex", preamble_file]
+    try:
+      super().run_binary(args, timeout=self.__timeout, env=REPRODUCIBLE_ENV)
+    except BinaryException as exception:
+      raise compile_error(fmt_dir, job_name, exception) from exception
+
+    dumped_format = os.path.join(fmt_dir, "%s.fmt" % job_name)
+    if not os.path.exists(dumped_format):
+      raise PdfLatexException("Ooops, no format was dumped here: %s" % dumped_format)
+    os.replace(dumped_format, "%s.fmt" % fmt_path)
+    for extension in ["tex", "log"]:
+      leftover = os.path.join(fmt_dir, "%s.%s" % (job_name, extension))
+      if os.path.exists(leftover):
+        os.remove(leftover)
+    logging.info("Dumped format %s.fmt.", fmt_path)
+    return fmt_path
+
+  def run(self, out_dir, out_basename, filename, fmt=None):
     """ Compiles a pdf from a tex file.
 
     out_dir: string
@@ -25,14 +110,120 @@ class PdfLatex(Binary):
       basename of the pdf output file
     filename: string
       path of the input tex file
+    fmt: string (optional)
+      path of a format (without the '.fmt' extension) created by dump_format(). If
+      given, the input file must only contain the document environment, since the
+      preamble is already part of the format.
+
+    pdflatex runs again as long as the document asks for it (e.g. because labels
+    changed) or its aux file changes, but at most max_passes times.
 
     """
+    args = self.__run_arguments(out_dir, out_basename, filename, fmt)
+    aux_digest = aux_file_digest(out_dir, out_basename)
+    for compile_pass in range(1, self.__max_passes + 1):
+      try:
+        super().run_binary(args, timeout=self.__timeout, env=REPRODUCIBLE_ENV)
+      except BinaryException as exception:
+        raise compile_error(out_dir, out_basename, exception) from exception
+      (rerun, aux_digest) = self.__rerun_needed(out_dir, out_basename, aux_digest, compile_pass)
+      if not rerun:
+        break
+    check_pdf(out_dir, out_basename)
+
+  async def run_async(self, out_dir, out_basename, filename, fmt=None, semaphore=None):
+    """ Compiles a pdf from a tex file as asyncio subprocess.
+
+    out_dir, out_basename, filename, fmt: see run
+    semaphore: asyncio.Semaphore (optional)
+      limits the number of binaries that run at the same time
+
+    """
+    # pylint: disable=too-many-arguments
+    args = self.__run_arguments(out_dir, out_basename, filename, fmt)
+    aux_digest = aux_file_digest(out_dir, out_basename)
+    for compile_pass in range(1, self.__max_passes + 1):
+      try:
+        await super().run_binary_async(
+            args, timeout=self.__timeout, env=REPRODUCIBLE_ENV, semaphore=semaphore)
+      except BinaryException as exception:
+        raise compile_error(out_dir, out_basename, exception) from exception
+      (rerun, aux_digest) = self.__rerun_needed(out_dir, out_basename, aux_digest, compile_pass)
+      if not rerun:
+        break
+    check_pdf(out_dir, out_basename)
+
+  def __rerun_needed(self, out_dir, out_basename, aux_digest, compile_pass):
+    """ Decides whether pdflatex needs to run again after a pass.
+
+    out_dir, out_basename: see run
+    aux_digest: string
+      digest of the aux file before the pass, None if there was none
+    compile_pass: integer
+      number of the pass that just finished, counting from 1
+
+    returns: (boolean, string)
+      whether or not to run again, and the digest of the aux file after the pass
+
+    """
+    new_aux_digest = aux_file_digest(out_dir, out_basename)
+    log_file = os.path.join(out_dir, "%s.log" % out_basename)
+    rerun = os.path.exists(log_file) and parse_log(log_file).rerun_requested
+    # A new aux file is no reason to rerun, only one that changed.
+    rerun = rerun or (aux_digest is not None and aux_digest != new_aux_digest)
+    if rerun and compile_pass == self.__max_passes:
+      logging.warning("%s still needs another pdflatex pass after %d passes.", out_basename,
+                      compile_pass)
+      rerun = False
+    elif rerun:
+      logging.info("Running pdflatex on %s again, pass %d.", out_basename, compile_pass + 1)
+    return (rerun, new_aux_digest)
+
+  @staticmethod
+  def __run_arguments(out_dir, out_basename, filename, fmt):
+    """ The arguments to compile a pdf, see run. """
     if not os.path.exists(filename):
       raise PdfLatexException("The input file %s does not exist." % filename)
 
-    args = "-output-directory=%s -jobname=%s %s" % (out_dir, out_basename, filename)
-    super().run_binary(args)
+    args = NONINTERACTIVE_ARGS + [
+        "-output-directory=%s" % out_dir, "-jobname=%s" % out_basename, filename]
+    if fmt:
+      args = ["-fmt=%s" % fmt] + args
+    return args
+
+
+def aux_file_digest(out_dir, out_basename):
+  """ Digest of the aux file pdflatex writes next to the pdf, None if there is none. """
+  aux_file = os.path.join(out_dir, "%s.aux" % out_basename)
+  if not os.path.exists(aux_file):
+    return None
+  return file_digest(aux_file)
+
+
+def compile_error(out_dir, out_basename, exception):
+  """ Describes why a pdflatex run failed, based on its log file.
+
+  out_dir: string
+    path of the output directory
+  out_basename: string
+    basename of the output files
+  exception: BinaryException
+    the exception of the failed run
+
+  returns: PdfLatexException
+    the exception to raise
+
+  """
+  log_file = os.path.join(out_dir, "%s.log" % out_basename)
+  errors = parse_log(log_file).errors if os.path.exists(log_file) else []
+  if not errors:
+    return PdfLatexException("Compiling %s failed: %s" % (out_basename, exception))
+  return PdfLatexException("Compiling %s failed: %s" % (
+      out_basename, "; ".join(str(error) for error in errors)))
+
 
-    expected_output = os.path.join(out_dir, "%s.pdf" % out_basename)
-    if not os.path.exists(expected_output):
-      raise PdfLatexException("Ooops, no pdf was generated here: %s" % expected_output)
+def check_pdf(out_dir, out_basename):
+  """ Checks that pdflatex generated a pdf, see PdfLatex.run. """
+  expected_output = os.path.join(out_dir, "%s.pdf" % out_basename)
+  if not os.path.exists(expected_output):
+    raise PdfLatexException("Ooops, no pdf was generated here: %s" % expected_output)
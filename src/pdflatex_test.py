@@ -6,9 +6,12 @@ import os
 import shutil
 import tempfile
 import unittest
+from unittest import mock
 
 from testing import PapeterieTestCase
+from binary import Binary
 from pdflatex import PdfLatex, PdfLatexException
+from texlog import parse_log
 
 
 class TestPdfLatex(PapeterieTestCase):
@@ -33,6 +36,24 @@ class TestPdfLatex(PapeterieTestCase):
     pdf = os.path.join(self.test_dir, "tex.pdf")
     self.assertTrue(os.path.exists(pdf))
 
+  def test_pdflatex_format(self):
+    """ Test running pdflatex with a precompiled preamble. """
+    with open(os.path.join(self.TESTDATA_FOLDER, "template_card_result.tex"), 'r') as infile:
+      (preamble, body) = infile.read().split("\\begin{document}")
+    texfile = os.path.join(self.test_dir, "tex.tex")
+    with open(texfile, 'w') as outfile:
+      outfile.write("\\begin{document}" + body)
+    fmt_dir = os.path.join(self.test_dir, "formats")
+
+    pdflatex = PdfLatex()
+    fmt = pdflatex.dump_format(preamble, fmt_dir)
+    self.assertEqual(fmt, pdflatex.dump_format(preamble, fmt_dir))
+    self.assertNotEqual(fmt, pdflatex.dump_format(preamble + "%", fmt_dir))
+    pdflatex.run(self.test_dir, "tex", texfile, fmt=fmt)
+
+    pdf = os.path.join(self.test_dir, "tex.pdf")
+    self.assertTrue(os.path.exists(pdf))
+
   def test_pdflatex_input_missing(self):
     """ Test running pdflatex when the input file is missing. """
     texfile = os.path.join(self.test_dir, "idontexist.tex")
@@ -41,6 +62,58 @@ class TestPdfLatex(PapeterieTestCase):
     with self.assertRaises(PdfLatexException):
       pdflatex.run(self.test_dir, "tex", texfile)
 
+  def test_pdflatex_rerun(self):
+    """ Test that pdflatex runs again until the references are right. """
+    texfile = os.path.join(self.test_dir, "tex.tex")
+    with open(texfile, 'w') as outfile:
+      outfile.write("\\documentclass{article}\n\\begin{document}\n"
+                    "\\section{A}\\label{a}See section \\ref{a}.\n\\end{document}\n")
+
+    pdflatex = PdfLatex()
+    pdflatex.run(self.test_dir, "tex", texfile)
+
+    self.assertFalse(parse_log(os.path.join(self.test_dir, "tex.log")).rerun_requested)
+
+  def test_pdflatex_unchanged_aux(self):
+    """ Test that pdflatex does not run again if the aux file stays the same. """
+    texfile = os.path.join(self.test_dir, "tex.tex")
+    with open(texfile, 'w') as outfile:
+      outfile.write("\\documentclass{article}\n\\begin{document}\n"
+                    "\\section{A}\\label{a}See section \\ref{a}.\n\\end{document}\n")
+    pdflatex = PdfLatex(timeout=60)
+    # Leaves the final aux file behind.
+    pdflatex.run(self.test_dir, "tex", texfile)
+
+    with mock.patch.object(Binary, "run_binary", autospec=True,
+                           side_effect=Binary.run_binary) as run_binary:
+      pdflatex.run(self.test_dir, "tex", texfile)
+
+    self.assertEqual(1, run_binary.call_count)
+
+  def test_pdflatex_max_passes_one(self):
+    """ Test that pdflatex stops after the maximum number of passes. """
+    texfile = os.path.join(self.test_dir, "tex.tex")
+    with open(texfile, 'w') as outfile:
+      outfile.write("\\documentclass{article}\n\\begin{document}\n"
+                    "\\section{A}\\label{a}See section \\ref{a}.\n\\end{document}\n")
+
+    pdflatex = PdfLatex(max_passes=1)
+    pdflatex.run(self.test_dir, "tex", texfile)
+
+    self.assertTrue(parse_log(os.path.join(self.test_dir, "tex.log")).rerun_requested)
+
+  def test_pdflatex_error(self):
+    """ Test that errors stop pdflatex and are taken from its log. """
+    texfile = os.path.join(self.test_dir, "tex.tex")
+    with open(texfile, 'w') as outfile:
+      outfile.write("\\documentclass{article}\n\\begin{document}\n\\FAIL\n\\end{document}\n")
+
+    pdflatex = PdfLatex(timeout=60)
+    with self.assertRaises(PdfLatexException) as context:
+      pdflatex.run(self.test_dir, "tex", texfile)
+
+    self.assertIn("line 3: Undefined control sequence.", str(context.exception))
+
 
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,274 @@
+#/bin/python3
+
+""" Module to prepare the pictures of the papeterie for pdflatex.
+
+pdflatex embeds the pictures anew for each piece of papeterie. PNGs with
+transparency, more than 8 bits per channel or an unusual color mode have to be
+decoded and converted each time, while plain RGB or grayscale PNGs are copied into
+the pdf as they are. Pictures in a higher resolution than the print only cost time
+and space.
+
+Hence, the pictures are converted once into print-ready versions, which are cached
+by the content of the original picture. The tex files then take the pictures from
+a workspace directory with the prepared versions instead of the input directory.
+
+Preparing pictures requires Pillow (python3-pil).
+
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+
+from cache import file_digest
+
+try:
+  from PIL import Image
+except ImportError:
+  # pylint: disable=invalid-name
+  Image = None
+  # pylint: enable=invalid-name
+
+
+# Resolution of the prepared pictures in dots per inch.
+DEFAULT_DPI = 300
+
+# Changes whenever the preparation changes, so that older versions are not reused.
+PREPARATION_VERSION = "2"
+
+PNG_EXTENSIONS = frozenset([".png"])
+JPEG_EXTENSIONS = frozenset([".jpg", ".jpeg"])
+
+# Color modes that pdflatex embeds without converting them.
+PLAIN_MODES = frozenset(["1", "L", "RGB"])
+
+# Color of the paper, which transparent pictures are flattened onto.
+PAPER_COLOR = (255, 255, 255)
+
+
+class PicturesException(Exception):
+  """ Exceptions of this module. """
+
+
+def flatten(image):
+  """ Converts a picture into a color mode that pdflatex embeds as it is.
+
+  image: Image
+    the picture
+
+  returns: Image
+    the picture without transparency in grayscale or RGB
+
+  """
+  if image.mode in PLAIN_MODES and "transparency" not in image.info:
+    return image
+  if image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info:
+    image = image.convert("RGBA")
+    flattened = Image.new("RGB", image.size, PAPER_COLOR)
+    flattened.paste(image, mask=image.getchannel("A"))
+    return flattened
+  if image.mode.startswith("I"):
+    # 16 or 32 bit grayscale.
+    return image.point(lambda value: value / 256).convert("L")
+  return image.convert("RGB")
+
+
+def resample(image, dpi):
+  """ Reduces the resolution of a picture to the given one, keeping its size in print.
+
+  image: Image
+    the picture
+  dpi: integer
+    the resolution in dots per inch
+
+  returns: (Image, (number, number))
+    the picture and its horizontal and vertical resolution, None if the picture
+    has none
+
+  """
+  (x_dpi, y_dpi) = image.info.get("dpi", (0, 0))
+  # pdflatex sizes pictures without a resolution as 72 dpi, hence they are taken as
+  # they are and stay without one.
+  if x_dpi <= 0 or y_dpi <= 0:
+    return (image, None)
+  if x_dpi <= dpi and y_dpi <= dpi:
+    return (image, (x_dpi, y_dpi))
+  (x_scale, y_scale) = (min(1, dpi / x_dpi), min(1, dpi / y_dpi))
+  size = (max(1, round(image.width * x_scale)), max(1, round(image.height * y_scale)))
+  return (image.resize(size, Image.LANCZOS), (x_dpi * x_scale, y_dpi * y_scale))
+
+
+def prepare_picture(path, target_path, dpi=DEFAULT_DPI):
+  """ Converts a picture into its print-ready version.
+
+  PNGs are flattened onto white paper and stored without transparency in
+  grayscale or RGB. Pictures with a higher resolution than dpi are resampled, those
+  without a resolution are not, since pdflatex takes them as 72 dpi. JPEGs
+  that need no resampling are copied as they are, since pdflatex embeds them
+  without decoding.
+
+  path: string
+    path of the PNG or JPEG picture
+  target_path: string
+    path to write the prepared picture to, in the same format
+  dpi: integer
+    maximum resolution of the prepared picture in dots per inch
+
+  raises: PicturesException
+    if Pillow is not installed or the file is not a PNG or JPEG picture
+
+  """
+  if Image is None:
+    raise PicturesException("Preparing pictures requires Pillow (python3-pil).")
+  extension = os.path.splitext(path)[1].lower()
+  if extension not in PNG_EXTENSIONS | JPEG_EXTENSIONS:
+    raise PicturesException("Cannot prepare %s, it is neither a PNG nor a JPEG." % path)
+
+  with Image.open(path) as image:
+    (resampled, resolution) = resample(image, dpi)
+    options = {"dpi": resolution} if resolution else {}
+    if extension in JPEG_EXTENSIONS:
+      if resampled is image:
+        shutil.copyfile(path, target_path)
+      else:
+        resampled.save(target_path, "JPEG", quality=95, **options)
+      return
+    flatten(resampled).save(target_path, "PNG", **options)
+
+
+class PictureCache():
+  """ Persistent cache of prepared pictures.
+
+  cache_dir: string
+    directory to store the prepared pictures in, created if it does not exist
+
+  """
+
+  def __init__(self, cache_dir):
+    self.__dir = cache_dir
+    os.makedirs(self.__dir, exist_ok=True)
+
+  def workspace(self, input_dir, dpi):
+    """ The directory to collect the prepared pictures of an input directory in.
+
+    It is the same in each run, so that the tex files and with them the keys of the
+    compile cache do not change.
+
+    input_dir: string
+      directory with the original pictures
+    dpi: integer
+      resolution of the prepared pictures
+
+    returns: string
+      path of the workspace directory
+
+    """
+    sha = hashlib.sha256()
+    sha.update(os.path.abspath(input_dir).encode("utf-8"))
+    sha.update(b"\0")
+    sha.update(str(dpi).encode("utf-8"))
+    return os.path.join(self.__dir, "workspaces", sha.hexdigest()[:16])
+
+  def prepare(self, path, dpi):
+    """ Prepares a picture, unless a picture with the same content was prepared
+        before.
+
+    path: string
+      path of the PNG or JPEG picture
+    dpi: integer
+      maximum resolution of the prepared picture, see prepare_picture
+
+    returns: string
+      path of the prepared picture in the cache
+
+    """
+    sha = hashlib.sha256()
+    sha.update(PREPARATION_VERSION.encode("utf-8"))
+    sha.update(b"\0")
+    sha.update(str(dpi).encode("utf-8"))
+    sha.update(b"\0")
+    sha.update(file_digest(path).encode("utf-8"))
+    extension = os.path.splitext(path)[1].lower()
+    prepared = os.path.join(self.__dir, "%s%s" % (sha.hexdigest(), extension))
+    if os.path.exists(prepared):
+      logging.info("Took prepared picture for %s from cache.", path)
+      return prepared
+
+    # Write to a temporary file first, so that other processes never see partial
+    # pictures.
+    (handle, tmp_path) = tempfile.mkstemp(dir=self.__dir, suffix=extension)
+    os.close(handle)
+    try:
+      prepare_picture(path, tmp_path, dpi)
+      os.replace(tmp_path, prepared)
+    finally:
+      if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    logging.info("Prepared picture %s as %s.", path, prepared)
+    return prepared
+
+
+def place(source, target, link):
+  """ Puts a file into a workspace, replacing what was there before.
+
+  source: string
+    path of the file
+  target: string
+    path in the workspace
+  link: function
+    creates the target from the source, e.g. os.link or os.symlink
+
+  """
+  tmp_path = "%s.%d.tmp" % (target, os.getpid())
+  try:
+    link(source, tmp_path)
+  except OSError:
+    # E.g. hard links across file systems.
+    shutil.copyfile(source, tmp_path)
+  os.replace(tmp_path, target)
+
+
+def prepare_pictures(input_dir, cache, dpi=DEFAULT_DPI):
+  """ Collects the prepared pictures of an input directory in a workspace.
+
+  The workspace contains the prepared versions of all PNG and JPEG pictures of the
+  input directory under their original names, and links to all other files. Hence,
+  it can replace the input directory as PAPETERIEPICPATH.
+
+  input_dir: string
+    directory with the original pictures
+  cache: PictureCache
+    the cache of prepared pictures
+  dpi: integer
+    maximum resolution of the prepared pictures, see prepare_picture
+
+  returns: string
+    path of the workspace directory
+
+  raises: PicturesException
+    if Pillow is not installed
+
+  """
+  if Image is None:
+    raise PicturesException("Preparing pictures requires Pillow (python3-pil).")
+
+  workspace = cache.workspace(input_dir, dpi)
+  os.makedirs(workspace, exist_ok=True)
+  names = set()
+  with os.scandir(input_dir) as scanner:
+    for entry in scanner:
+      names.add(entry.name)
+      target = os.path.join(workspace, entry.name)
+      extension = os.path.splitext(entry.name)[1].lower()
+      if entry.is_file() and extension in PNG_EXTENSIONS | JPEG_EXTENSIONS:
+        place(cache.prepare(entry.path, dpi), target, os.link)
+      else:
+        place(os.path.abspath(entry.path), target, os.symlink)
+
+  # Remove what is no longer in the input directory.
+  for name in set(os.listdir(workspace)) - names:
+    os.remove(os.path.join(workspace, name))
+  logging.info("Prepared the pictures of %s in %s.", input_dir, workspace)
+  return workspace
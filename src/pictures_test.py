@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+
+""" Unit tests for the pictures module. """
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from testing import PapeterieTestCase
+from pictures import Image, PictureCache, prepare_picture, prepare_pictures
+
+
+@unittest.skipIf(Image is None, "Pillow is not installed.")
+class TestPictures(PapeterieTestCase):
+  """ Tests preparing pictures. """
+
+  def setUp(self):
+    self.test_dir = tempfile.mkdtemp()
+    self.input_dir = os.path.join(self.test_dir, "input")
+    os.mkdir(self.input_dir)
+    self.picture = os.path.join(self.input_dir, "picture.png")
+    image = Image.new("RGBA", (200, 100), (255, 0, 0, 0))
+    image.paste((0, 0, 255, 255), (0, 0, 100, 100))
+    image.save(self.picture, "PNG", dpi=(600, 600))
+
+  def tearDown(self):
+    shutil.rmtree(self.test_dir)
+
+  def test_prepare_picture(self):
+    """ Tests that a picture is flattened and resampled to the given resolution. """
+    prepared = os.path.join(self.test_dir, "prepared.png")
+
+    prepare_picture(self.picture, prepared, dpi=300)
+
+    with Image.open(prepared) as image:
+      self.assertEqual("RGB", image.mode)
+      self.assertEqual((100, 50), image.size)
+      self.assertEqual((300, 300), tuple(round(dpi) for dpi in image.info["dpi"]))
+      self.assertEqual((0, 0, 255), image.getpixel((10, 25)))
+      self.assertEqual((255, 255, 255), image.getpixel((90, 25)))
+
+  def test_prepare_picture_low_resolution(self):
+    """ Tests that pictures are never upsampled. """
+    prepared = os.path.join(self.test_dir, "prepared.png")
+
+    prepare_picture(self.picture, prepared, dpi=1200)
+
+    with Image.open(prepared) as image:
+      self.assertEqual((200, 100), image.size)
+
+  def test_prepare_picture_without_resolution(self):
+    """ Tests that pictures without a resolution keep their size and get none. """
+    picture = os.path.join(self.input_dir, "untagged.png")
+    Image.new("RGBA", (720, 720), (0, 0, 255, 255)).save(picture, "PNG")
+    prepared = os.path.join(self.test_dir, "prepared.png")
+
+    prepare_picture(picture, prepared, dpi=300)
+
+    with Image.open(prepared) as image:
+      self.assertEqual("RGB", image.mode)
+      self.assertEqual((720, 720), image.size)
+      self.assertNotIn("dpi", image.info)
+
+  def test_picture_cache(self):
+    """ Tests that pictures with the same content are prepared only once. """
+    cache = PictureCache(os.path.join(self.test_dir, "cache"))
+    copy = os.path.join(self.test_dir, "copy.png")
+    shutil.copyfile(self.picture, copy)
+
+    prepared = cache.prepare(self.picture, 300)
+    self.assertEqual(prepared, cache.prepare(copy, 300))
+    self.assertNotEqual(prepared, cache.prepare(copy, 150))
+
+  def test_prepare_pictures(self):
+    """ Tests that the workspace mirrors the input directory. """
+    cache = PictureCache(os.path.join(self.test_dir, "cache"))
+    other = os.path.join(self.input_dir, "config.json")
+    with open(other, 'w') as outfile:
+      outfile.write("{}")
+
+    workspace = prepare_pictures(self.input_dir, cache, 300)
+
+    self.assertEqual(["config.json", "picture.png"], sorted(os.listdir(workspace)))
+    self.assertTrue(os.path.samefile(other, os.path.join(workspace, "config.json")))
+    with Image.open(os.path.join(workspace, "picture.png")) as image:
+      self.assertEqual((100, 50), image.size)
+
+    os.remove(other)
+    self.assertEqual(workspace, prepare_pictures(self.input_dir, cache, 300))
+    self.assertEqual(["picture.png"], os.listdir(workspace))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,675 @@
+#/bin/python3
+
+""" Module to turn recipients into individual pieces of papeterie.
+
+The work for each recipient (rendering the snippets, signing them, compiling the
+pdf) is independent of all other recipients. Hence, it can be distributed to a
+pool of worker processes.
+
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import concurrent.futures.process
+import hashlib
+import logging
+import os
+
+from configuration import config_from_json
+from gpg import Signer
+from jinja2snippet import JinjaTemplate
+from papeterie import (
+    create_single_papeterie, create_single_papeterie_async, create_papeterie_batch,
+    document_key, render_tex)
+from pdf import stamp_pdf
+from pdflatex import PdfLatex, DEFAULT_TIMEOUT
+from simple_template import SimpleTemplate
+from snippets import Snippets, PAPETERIEPICPATH
+from texlog import parse_log
+
+
+# Number of batches per worker process that are submitted ahead of time.
+MAX_PENDING_BATCHES_PER_JOB = 2
+
+
+class PipelineException(Exception):
+  """ Exceptions of this module. """
+
+
+class RecipientResult():
+  """ Outcome of processing one recipient.
+
+  idx: integer
+    number of the piece of papeterie in the whole series
+  pdf_path: string
+    path of the generated pdf, which is shared by recipients with the same document
+  error: string (optional)
+    description of what went wrong, None if the pdf was generated successfully
+  tex_log: TexLog (optional)
+    errors and warnings of the pdflatex run, None if the pdf was not compiled on
+    its own (e.g. taken from the cache or compiled in a batch)
+
+  """
+  # pylint: disable=too-few-public-methods
+
+  def __init__(self, idx, pdf_path, error=None, tex_log=None):
+    self.idx = idx
+    self.pdf_path = pdf_path
+    self.error = error
+    self.tex_log = tex_log
+
+  @property
+  def failed(self):
+    """ Whether or not processing the recipient failed. """
+    return self.error is not None
+
+  # pylint: enable=too-few-public-methods
+
+
+class Pipeline():
+  """ Renders, signs and compiles the papeterie of single recipients.
+
+  Each distinct document is compiled only once per pipeline: recipients whose
+  snippets equal those of an earlier recipient get the pdf of that recipient.
+
+  If the configuration has a background template, the tex template only holds the
+  per-recipient text layer. The background is compiled once per distinct rendering
+  (e.g. once per theme) and the text layer of each recipient is stamped onto it.
+
+  input_dir: string
+    directory with all input files
+  output: SerialOutputController
+    output controller of the whole series
+  gpg_key: string (optional)
+    ID of the GPG key to sign snippets with
+  gpg_homedir: string (optional)
+    path of the GPG homedir
+  cache: CompileCache (optional)
+    cache of compiled pdfs
+  precompile_preamble: boolean
+    whether or not to precompile the preamble of the tex template to a format, which
+    is stored in the cache if there is one
+  compile_timeout: number
+    seconds after which a pdflatex run is killed
+  picture_dir: string (optional)
+    directory the tex files take their pictures from (see PAPETERIEPICPATH), e.g. the
+    workspace of pictures.prepare_pictures. By default, the input directory.
+
+  """
+
+  def __init__(self, input_dir, output, gpg_key=None, gpg_homedir=None, cache=None,
+               precompile_preamble=False, compile_timeout=DEFAULT_TIMEOUT, picture_dir=None):
+    # pylint: disable=too-many-arguments
+    self.__picture_dir = picture_dir or input_dir
+    self.__output = output
+    self.__cache = cache
+    self.__fmt_dir = None
+    if precompile_preamble:
+      self.__fmt_dir = cache.format_dir if cache else output.format_dir
+    self.__config = config_from_json(input_dir)
+    self.__tex_template = SimpleTemplate(self.__config.tex_template)
+    self.__background_template = None
+    if self.__config.background_template:
+      self.__background_template = SimpleTemplate(self.__config.background_template)
+    self.__latex_binary = PdfLatex(compile_timeout)
+    self.__signer = Signer(gpg_key, gpg_homedir, cache.signature_dir if cache else None)
+    self.__jinja_templates = {
+        name: JinjaTemplate(template, cache.template_dir if cache else None)
+        for (name, template) in self.__config.snippets.items()}
+    # The outcomes of the documents compiled so far, see document_key.
+    self.__documents = {}
+    # The documents that are being compiled with asyncio, see process_async.
+    self.__compiling = {}
+    # The compiled renderings of the background, see __background.
+    self.__backgrounds = {}
+    # The tasks compiling renderings of the background, see __background_async.
+    self.__background_tasks = {}
+
+  def render(self, recipient):
+    """ Renders (and optionally signs) all snippets for one recipient.
+
+    recipient: Recipient
+      the recipient's data
+
+    returns: Snippets
+      the snippets ready to be filled into the tex template
+
+    """
+    return self.render_many([recipient])[0]
+
+  def render_many(self, recipients):
+    """ Renders (and optionally signs) all snippets for several recipients.
+
+    Each template renders the snippets of all recipients in one go.
+
+    recipients: list of Recipient
+      the recipients' data
+
+    returns: list of Snippets
+      the snippets ready to be filled into the tex template, in the order of the
+      recipients
+
+    """
+    rendered = {snippet: self.__jinja_templates[snippet].render_many(recipients)
+                for snippet in self.__config.snippets}
+    return [self.__complete({snippet: texts[idx] for (snippet, texts) in rendered.items()})
+            for idx in range(len(recipients))]
+
+  async def render_async(self, recipient, semaphore=None):
+    """ Renders (and optionally signs) all snippets for one recipient, running gpg2
+        as asyncio subprocess.
+
+    recipient: Recipient
+      the recipient's data
+    semaphore: asyncio.Semaphore (optional)
+      limits the number of binaries that run at the same time
+
+    returns: Snippets
+      the snippets ready to be filled into the tex template
+
+    """
+    snippets = self.__unsigned({snippet: self.__jinja_templates[snippet].render(recipient)
+                                for snippet in self.__config.snippets})
+
+    if self.__config.signed_snippets:
+      unsigned_snippets = self.__to_sign(snippets).view()
+      names = list(unsigned_snippets)
+      signed_texts = await asyncio.gather(*(
+          self.__signer.sign_async(unsigned_snippets[name], semaphore) for name in names))
+      snippets = snippets.merge_with(Snippets(dict(zip(names, signed_texts))))
+
+    return snippets
+
+  def __complete(self, snippet_dict):
+    """ Adds the special and signed snippets to the rendered snippets of a recipient. """
+    snippets = self.__unsigned(snippet_dict)
+
+    if self.__config.signed_snippets:
+      signed_snippets = self.__to_sign(snippets).transform(self.__signer.sign)
+      snippets = snippets.merge_with(signed_snippets)
+
+    return snippets
+
+  def __unsigned(self, snippet_dict):
+    """ Adds the special snippets to the rendered snippets of a recipient. """
+    snippets = Snippets(snippet_dict)
+
+    # Set a special snippet so that the picture files are correctly referenced.
+    return snippets.add(PAPETERIEPICPATH, self.__picture_dir)
+
+  def __to_sign(self, snippets):
+    """ The snippets to sign, named like their signed versions. """
+    return snippets \
+      .subset(self.__config.signed_snippets.values()) \
+      .renamed({v: k for (k, v) in self.__config.signed_snippets.items()})
+
+  def __compile_single(self, idx, idx_output, snippets):
+    """ Compiles one piece of papeterie, reporting failures instead of raising them. """
+    try:
+      create_single_papeterie(
+          self.__latex_binary, idx_output, self.__tex_template, snippets, self.__cache,
+          self.__fmt_dir)
+    # pylint: disable=broad-except
+    except Exception as exception:
+      logging.exception("Processing recipient idx %s failed.", idx)
+      return RecipientResult(idx, idx_output.pdf_path, error=str(exception),
+                             tex_log=read_tex_log(idx_output))
+    # pylint: enable=broad-except
+    return RecipientResult(idx, idx_output.pdf_path, tex_log=read_tex_log(idx_output))
+
+  async def __compile_single_async(self, idx, idx_output, snippets, semaphore):
+    """ Compiles one piece of papeterie as asyncio subprocess, see __compile_single. """
+    try:
+      await create_single_papeterie_async(
+          self.__latex_binary, idx_output, self.__tex_template, snippets, self.__cache,
+          self.__fmt_dir, semaphore)
+    # pylint: disable=broad-except
+    except Exception as exception:
+      logging.exception("Processing recipient idx %s failed.", idx)
+      return RecipientResult(idx, idx_output.pdf_path, error=str(exception),
+                             tex_log=read_tex_log(idx_output))
+    # pylint: enable=broad-except
+    return RecipientResult(idx, idx_output.pdf_path, tex_log=read_tex_log(idx_output))
+
+  def __background_output(self, snippets):
+    """ The key and output controller of the background rendered with snippets. """
+    texcontent = render_tex(self.__background_template, snippets)
+    key = hashlib.sha256(texcontent.encode("utf-8")).hexdigest()
+    # Worker processes compile their backgrounds independently of each other.
+    name = "%s_%d" % (key[:16], os.getpid())
+    return (key, self.__output.get_background_output_controller(name))
+
+  def __background(self, snippets):
+    """ Compiles the background rendered with snippets, once per rendering.
+
+    returns: string
+      path of the background pdf
+
+    raises: PipelineException
+      if the background cannot be compiled
+
+    """
+    (key, background_output) = self.__background_output(snippets)
+    if key not in self.__backgrounds:
+      error = None
+      try:
+        create_single_papeterie(
+            self.__latex_binary, background_output, self.__background_template, snippets,
+            self.__cache, self.__fmt_dir)
+      # pylint: disable=broad-except
+      except Exception as exception:
+        logging.exception("Compiling background %s failed.", background_output.pdf_basename)
+        error = str(exception)
+      # pylint: enable=broad-except
+      self.__backgrounds[key] = (background_output.pdf_path, error)
+
+    (pdf_path, error) = self.__backgrounds[key]
+    if error is not None:
+      raise PipelineException("The background could not be compiled: %s" % error)
+    return pdf_path
+
+  async def __background_async(self, snippets, semaphore):
+    """ Compiles the background rendered with snippets as asyncio subprocess, see
+        __background. """
+    (key, background_output) = self.__background_output(snippets)
+    if key not in self.__background_tasks:
+      # Recipients that need the background while it compiles wait for the same task.
+      self.__background_tasks[key] = asyncio.ensure_future(create_single_papeterie_async(
+          self.__latex_binary, background_output, self.__background_template, snippets,
+          self.__cache, self.__fmt_dir, semaphore))
+    try:
+      await asyncio.shield(self.__background_tasks[key])
+    # pylint: disable=broad-except
+    except Exception as exception:
+      raise PipelineException("The background could not be compiled: %s" % exception) \
+        from exception
+    # pylint: enable=broad-except
+    return background_output.pdf_path
+
+  def __with_background(self, result, snippets):
+    """ Stamps the text layer of a compiled recipient onto its background.
+
+    result: RecipientResult
+      the outcome of compiling the text layer
+    snippets: Snippets
+      the snippets of the recipient
+
+    returns: RecipientResult
+      the outcome of the whole piece of papeterie
+
+    """
+    try:
+      stamp_pdf(self.__background(snippets), result.pdf_path, result.pdf_path)
+    # pylint: disable=broad-except
+    except Exception as exception:
+      return background_failed(result, exception)
+    # pylint: enable=broad-except
+    return result
+
+  async def __with_background_async(self, result, snippets, semaphore):
+    """ Stamps the text layer of a compiled recipient onto its background, compiling
+        the background as asyncio subprocess, see __with_background. """
+    try:
+      stamp_pdf(await self.__background_async(snippets, semaphore), result.pdf_path,
+                result.pdf_path)
+    # pylint: disable=broad-except
+    except Exception as exception:
+      return background_failed(result, exception)
+    # pylint: enable=broad-except
+    return result
+
+  def __remember(self, key, result):
+    """ Remembers the outcome of compiling a document. """
+    self.__documents[key] = (result.idx, result.pdf_path, result.error)
+
+  def __duplicate(self, idx, idx_output, key):
+    """ The outcome of a recipient whose document was compiled before. """
+    (first_idx, pdf_path, error) = self.__documents[key]
+    logging.info("Recipient idx %s has the same document as recipient idx %s.", idx, first_idx)
+    if error is not None:
+      return RecipientResult(idx, idx_output.pdf_path, error=error)
+    return RecipientResult(idx, pdf_path)
+
+  def process_batch(self, batch):
+    """ Creates the pieces of papeterie for a batch of recipients.
+
+    If the batch contains more than one recipient, all of them are compiled with a
+    single pdflatex run. If that fails, each recipient is compiled on its own, so
+    that a broken recipient does not take the others down.
+
+    Recipients with the same document as an earlier recipient are not compiled
+    again.
+
+    batch: list of (integer, Recipient)
+      the recipients' indices in the whole series and their data
+
+    returns: list of RecipientResult
+      the outcomes in the order of the batch, failures are reported instead of raised
+
+    """
+    results = {}
+    pieces = []
+    for (idx, recipient) in batch:
+      logging.info("Processing recipient idx %s.", idx)
+      logging.info(recipient)
+    outputs = [self.__output.get_indexed_output_controller(idx) for (idx, _) in batch]
+    try:
+      rendered = self.render_many([recipient for (_, recipient) in batch])
+      pieces = [(idx, idx_output, snippets)
+                for ((idx, _), idx_output, snippets) in zip(batch, outputs, rendered)]
+    # pylint: disable=broad-except
+    except Exception:
+      # Render the recipients one by one, so that only the broken ones fail.
+      for ((idx, recipient), idx_output) in zip(batch, outputs):
+        try:
+          pieces.append((idx, idx_output, self.render(recipient)))
+        except Exception as exception:
+          logging.exception("Rendering recipient idx %s failed.", idx)
+          results[idx] = RecipientResult(idx, idx_output.pdf_path, error=str(exception))
+    # pylint: enable=broad-except
+
+    duplicates = []
+    first_pieces = {}
+    for (idx, idx_output, snippets) in pieces:
+      key = document_key(snippets)
+      if key in self.__documents or key in first_pieces:
+        duplicates.append((idx, idx_output, key))
+      else:
+        first_pieces[key] = (idx, idx_output, snippets)
+    pieces = list(first_pieces.values())
+
+    if len(pieces) > 1:
+      batch_output = self.__output.get_batch_output_controller(batch[0][0])
+      try:
+        create_papeterie_batch(
+            self.__latex_binary, batch_output, self.__tex_template,
+            [(idx_output, snippets) for (_, idx_output, snippets) in pieces], self.__cache,
+            self.__fmt_dir)
+        for (idx, idx_output, _) in pieces:
+          results[idx] = RecipientResult(idx, idx_output.pdf_path)
+        pieces = []
+      # pylint: disable=broad-except
+      except Exception:
+        logging.exception("Compiling batch %s failed, compiling recipients one by one.",
+                          batch_output.pdf_basename)
+      # pylint: enable=broad-except
+
+    for (idx, idx_output, snippets) in pieces:
+      results[idx] = self.__compile_single(idx, idx_output, snippets)
+
+    for (key, (idx, _, snippets)) in first_pieces.items():
+      if self.__background_template and not results[idx].failed:
+        results[idx] = self.__with_background(results[idx], snippets)
+      self.__remember(key, results[idx])
+    for (idx, idx_output, key) in duplicates:
+      results[idx] = self.__duplicate(idx, idx_output, key)
+
+    return [results[idx] for (idx, _) in batch]
+
+  def process(self, idx, recipient):
+    """ Creates the piece of papeterie for one recipient.
+
+    idx: integer
+      number of the piece of papeterie in the whole series
+    recipient: Recipient
+      the recipient's data
+
+    returns: RecipientResult
+      the outcome, failures are reported instead of raised
+
+    """
+    return self.process_batch([(idx, recipient)])[0]
+
+  async def process_async(self, idx, recipient, semaphore=None):
+    """ Creates the piece of papeterie for one recipient, running pdflatex and gpg2 as
+        asyncio subprocesses.
+
+    idx: integer
+      number of the piece of papeterie in the whole series
+    recipient: Recipient
+      the recipient's data
+    semaphore: asyncio.Semaphore (optional)
+      limits the number of binaries that run at the same time
+
+    returns: RecipientResult
+      the outcome, failures are reported instead of raised
+
+    """
+    logging.info("Processing recipient idx %s.", idx)
+    logging.info(recipient)
+    idx_output = self.__output.get_indexed_output_controller(idx)
+    try:
+      snippets = await self.render_async(recipient, semaphore)
+    # pylint: disable=broad-except
+    except Exception as exception:
+      logging.exception("Rendering recipient idx %s failed.", idx)
+      return RecipientResult(idx, idx_output.pdf_path, error=str(exception))
+    # pylint: enable=broad-except
+
+    key = document_key(snippets)
+    if key in self.__compiling:
+      # Another recipient with the same document is compiling it right now.
+      await self.__compiling[key]
+    if key in self.__documents:
+      return self.__duplicate(idx, idx_output, key)
+
+    compiled = asyncio.get_running_loop().create_future()
+    self.__compiling[key] = compiled
+    try:
+      result = await self.__compile_single_async(idx, idx_output, snippets, semaphore)
+      if self.__background_template and not result.failed:
+        result = await self.__with_background_async(result, snippets, semaphore)
+      self.__remember(key, result)
+    finally:
+      del self.__compiling[key]
+      compiled.set_result(None)
+    return result
+
+
+def background_failed(result, exception):
+  """ The outcome of a recipient whose text layer could not be stamped onto its
+      background. """
+  logging.exception("Adding the background of recipient idx %s failed.", result.idx)
+  return RecipientResult(result.idx, result.pdf_path, error=str(exception),
+                         tex_log=result.tex_log)
+
+
+def read_tex_log(output):
+  """ Reads the errors and warnings of the pdflatex run of an output controller.
+
+  output: BaseOutputController
+    the output controller of the pdflatex run
+
+  returns: TexLog
+    the errors and warnings, None if pdflatex did not run
+
+  """
+  if not os.path.exists(output.tex_log):
+    return None
+  return parse_log(output.tex_log)
+
+
+# The pipeline of a worker process, see init_worker.
+# pylint: disable=invalid-name
+_worker_pipeline = None
+# pylint: enable=invalid-name
+
+
+def init_worker(input_dir, output, options):
+  """ Sets up the pipeline of a worker process once, when the process starts.
+
+  input_dir, output: see Pipeline
+  options: dict
+    the optional keyword arguments of Pipeline
+
+  """
+  # pylint: disable=global-statement
+  global _worker_pipeline
+  _worker_pipeline = Pipeline(input_dir, output, **options)
+  # pylint: enable=global-statement
+
+
+def process_in_worker(batch):
+  """ Processes a batch of recipients with the pipeline of the current worker process.
+
+  See Pipeline.process_batch.
+
+  """
+  return _worker_pipeline.process_batch(batch)
+
+
+def collect_batch(output, batch, future):
+  """ Waits for a batch that was submitted to a worker process.
+
+  output: SerialOutputController
+    output controller of the whole series
+  batch: list of (integer, Recipient)
+    the batch, see batches
+  future: Future
+    the future of the submitted batch
+
+  returns: list of RecipientResult
+    the outcomes in the order of the batch
+
+  """
+  try:
+    return future.result()
+  # pylint: disable=broad-except
+  except Exception as exception:
+    # The worker itself died (e.g. it could not be set up).
+    results = []
+    for (idx, _) in batch:
+      logging.error("Worker failed for recipient idx %s: %s", idx, exception)
+      results.append(RecipientResult(
+          idx, output.get_indexed_output_controller(idx).pdf_path, error=str(exception)))
+    return results
+  # pylint: enable=broad-except
+
+
+def batches(recipients, batch_size):
+  """ Splits the recipients into batches.
+
+  recipients: iterable of Recipient
+    the recipients' data
+  batch_size: integer
+    maximum number of recipients per batch
+
+  returns: generator of lists of (integer, Recipient)
+    the batches of recipients along with their indices
+
+  """
+  batch = []
+  for (idx, recipient) in enumerate(recipients):
+    batch.append((idx, recipient))
+    if len(batch) == batch_size:
+      yield batch
+      batch = []
+  if batch:
+    yield batch
+
+
+def process_recipients(input_dir, output, recipients, jobs=1, batch_size=1, use_asyncio=False,
+                       **options):
+  """ Creates the pieces of papeterie for all recipients.
+
+  input_dir, output: see Pipeline
+  recipients: iterable of Recipient
+    the recipients' data
+  jobs: integer
+    number of worker processes, 1 processes all recipients in this process
+  batch_size: integer
+    number of recipients to compile with a single pdflatex run
+  use_asyncio: boolean
+    whether to process the recipients in one asyncio event loop of this process
+    instead, with jobs being the number of binaries that run at the same time
+  options:
+    the optional keyword arguments of Pipeline (gpg_key, gpg_homedir, ...)
+
+  returns: list of RecipientResult
+    one result per recipient, ordered by index
+
+  """
+  # pylint: disable=too-many-arguments
+  if jobs < 1:
+    raise PipelineException("The number of jobs must be positive, got %s." % jobs)
+  if batch_size < 1:
+    raise PipelineException("The batch size must be positive, got %s." % batch_size)
+
+  if use_asyncio:
+    if batch_size > 1:
+      raise PipelineException("Batches are not supported with asyncio.")
+    return asyncio.run(process_recipients_async(input_dir, output, recipients, jobs, options))
+
+  if jobs == 1:
+    pipeline = Pipeline(input_dir, output, **options)
+    return [result
+            for batch in batches(recipients, batch_size)
+            for result in pipeline.process_batch(batch)]
+
+  results = []
+  executor = start_workers(input_dir, output, jobs, options)
+  try:
+    # Only submit a few batches ahead, so that the recipients are read lazily.
+    pending = collections.deque()
+    for batch in batches(recipients, batch_size):
+      try:
+        future = executor.submit(process_in_worker, batch)
+      except concurrent.futures.process.BrokenProcessPool:
+        # A worker died (e.g. it was killed), which fails all batches in flight.
+        # Report those and go on with fresh workers.
+        logging.error("A worker process died, starting new workers.")
+        while pending:
+          results.extend(collect_batch(output, *pending.popleft()))
+        executor.shutdown()
+        executor = start_workers(input_dir, output, jobs, options)
+        future = executor.submit(process_in_worker, batch)
+      pending.append((batch, future))
+      if len(pending) >= MAX_PENDING_BATCHES_PER_JOB * jobs:
+        results.extend(collect_batch(output, *pending.popleft()))
+    while pending:
+      results.extend(collect_batch(output, *pending.popleft()))
+  finally:
+    executor.shutdown()
+  return results
+
+
+def start_workers(input_dir, output, jobs, options):
+  """ Starts a pool of worker processes, see init_worker.
+
+  returns: ProcessPoolExecutor
+    the pool
+
+  """
+  return concurrent.futures.ProcessPoolExecutor(
+      max_workers=jobs, initializer=init_worker, initargs=(input_dir, output, options))
+
+
+async def process_recipients_async(input_dir, output, recipients, jobs, options):
+  """ Creates the pieces of papeterie for all recipients in one asyncio event loop.
+
+  The recipients are processed concurrently, so that e.g. one recipient's snippets
+  are signed while another one's pdf is compiled.
+
+  input_dir, output, recipients: see process_recipients
+  jobs: integer
+    maximum number of binaries that run at the same time
+  options: dict
+    the optional keyword arguments of Pipeline
+
+  returns: list of RecipientResult
+    one result per recipient, ordered by index
+
+  """
+  pipeline = Pipeline(input_dir, output, **options)
+  semaphore = asyncio.Semaphore(jobs)
+  results = []
+  # Only start a few recipients ahead, so that the recipients are read lazily.
+  pending = collections.deque()
+  for (idx, recipient) in enumerate(recipients):
+    pending.append(asyncio.ensure_future(pipeline.process_async(idx, recipient, semaphore)))
+    if len(pending) >= MAX_PENDING_BATCHES_PER_JOB * jobs:
+      results.append(await pending.popleft())
+  while pending:
+    results.append(await pending.popleft())
+  return results
@@ -0,0 +1,193 @@
+#!/usr/bin/python3
+
+""" Unit tests for the pipeline module. """
+
+import glob
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from PyPDF2 import PdfFileReader
+
+from testing import PapeterieTestCase
+from csv2recipients import load_recipients
+from output import SerialOutputController
+from pipeline import process_recipients, Pipeline, PipelineException
+from recipient import Recipient
+
+
+class TestPipeline(PapeterieTestCase):
+  """ Tests processing recipients. """
+
+  DATA_FOLDER = "../data/"
+
+  def setUp(self):
+    self.test_dir = tempfile.mkdtemp()
+    self.output = SerialOutputController(os.path.join(self.test_dir, "result.pdf"))
+    self.recipients = load_recipients(
+        os.path.join(self.DATA_FOLDER, "example_recipients.csv"))
+    self.input_dir = os.path.join(self.DATA_FOLDER, "example_envelope")
+
+  def tearDown(self):
+    shutil.rmtree(self.test_dir)
+    shutil.rmtree(self.output.tmp_dir)
+
+  def test_parallel_results_ordered(self):
+    """ Tests that results of several workers are returned in recipient order. """
+    results = process_recipients(self.input_dir, self.output, self.recipients, jobs=2)
+
+    self.assertEqual(list(range(len(self.recipients))), [result.idx for result in results])
+    for result in results:
+      self.assertFalse(result.failed)
+      self.assert_pdf(result.pdf_path)
+
+  def test_worker_died(self):
+    """ Tests that a dying worker fails the batches in flight, but not the series. """
+    recipients = self.recipients * 3
+    process_batch = Pipeline.process_batch
+
+    def die_on_recipient(pipeline, batch):
+      if batch[0][0] == 5:
+        os._exit(1)
+      return process_batch(pipeline, batch)
+
+    # The worker processes are forked with the patched pipeline.
+    with mock.patch.object(Pipeline, "process_batch", die_on_recipient):
+      results = process_recipients(self.input_dir, self.output, recipients, jobs=2)
+
+    self.assertEqual(list(range(len(recipients))), [result.idx for result in results])
+    self.assertTrue(results[5].failed)
+    self.assertFalse(results[-1].failed)
+
+  def test_asyncio_results_ordered(self):
+    """ Tests that results of concurrent subprocesses are returned in recipient order. """
+    results = process_recipients(
+        self.input_dir, self.output, self.recipients, jobs=2, use_asyncio=True)
+
+    self.assertEqual(list(range(len(self.recipients))), [result.idx for result in results])
+    for result in results:
+      self.assertFalse(result.failed)
+      self.assert_pdf(result.pdf_path)
+
+  def test_asyncio_batches(self):
+    """ Tests that batches are rejected with asyncio. """
+    with self.assertRaises(PipelineException):
+      process_recipients(
+          self.input_dir, self.output, self.recipients, batch_size=2, use_asyncio=True)
+
+  def test_failure_reported(self):
+    """ Tests that a broken recipient is reported with the errors of pdflatex. """
+    input_dir = os.path.join(self.test_dir, "input")
+    os.mkdir(input_dir)
+    with open(os.path.join(input_dir, "config.json"), 'w') as outfile:
+      outfile.write('{ "snippets": { "MACRO": "macro.ji2" } }')
+    with open(os.path.join(input_dir, "macro.ji2"), 'w') as outfile:
+      outfile.write("{{ Macro }}")
+    with open(os.path.join(input_dir, "papeterie.tex"), 'w') as outfile:
+      outfile.write("\\documentclass{article}\n\\begin{document}\n\\MACRO\n\\end{document}\n")
+    recipients = [Recipient(["Macro"], ["relax Hello"]), Recipient(["Macro"], ["FAIL"])]
+
+    results = process_recipients(input_dir, self.output, recipients)
+
+    self.assertFalse(results[0].failed)
+    self.assertFalse(results[0].tex_log.errors)
+    self.assertTrue(results[1].failed)
+    self.assertEqual(3, results[1].tex_log.errors[0].line)
+
+  def write_macro_input(self, background=None):
+    """ Writes an input directory whose document is the recipient's macro, optionally
+        on top of a background with the given body. """
+    input_dir = os.path.join(self.test_dir, "input")
+    os.mkdir(input_dir)
+    with open(os.path.join(input_dir, "config.json"), 'w') as outfile:
+      if background is None:
+        outfile.write('{ "snippets": { "MACRO": "macro.ji2" } }')
+      else:
+        outfile.write('{ "snippets": { "MACRO": "macro.ji2" }, "background": "bg.tex" }')
+        with open(os.path.join(input_dir, "bg.tex"), 'w') as bgfile:
+          bgfile.write("\\documentclass{article}\n\\begin{document}\n%s\n\\end{document}\n" %
+                       background)
+    with open(os.path.join(input_dir, "macro.ji2"), 'w') as outfile:
+      outfile.write("{{ Macro }}")
+    with open(os.path.join(input_dir, "papeterie.tex"), 'w') as outfile:
+      outfile.write("\\documentclass{article}\n\\begin{document}\n\\MACRO\n\\end{document}\n")
+    return input_dir
+
+  def assert_deduplicated(self, results):
+    """ Checks the results of the recipients of test_duplicates_compiled_once. """
+    self.assertFalse(any(result.failed for result in results[:4]))
+    self.assertEqual(results[0].pdf_path, results[1].pdf_path)
+    self.assertEqual(results[0].pdf_path, results[3].pdf_path)
+    self.assertNotEqual(results[0].pdf_path, results[2].pdf_path)
+    for idx in [1, 3]:
+      self.assertFalse(os.path.exists(self.output.get_indexed_output_controller(idx).tex_result))
+    self.assertTrue(results[4].failed)
+    self.assertTrue(results[5].failed)
+
+  def test_duplicates_compiled_once(self):
+    """ Tests that recipients with the same document share one compiled pdf. """
+    input_dir = self.write_macro_input()
+    values = ["relax Hello", "relax Hello", "relax World", "relax Hello", "FAIL", "FAIL"]
+    recipients = [Recipient(["Macro"], [value]) for value in values]
+
+    for batch_size in [1, 3]:
+      with self.subTest(batch_size=batch_size):
+        self.assert_deduplicated(
+            process_recipients(input_dir, self.output, recipients, batch_size=batch_size))
+        shutil.rmtree(self.output.tmp_dir)
+        os.makedirs(self.output.tmp_dir)
+
+    with self.subTest(use_asyncio=True):
+      self.assert_deduplicated(
+          process_recipients(input_dir, self.output, recipients, jobs=3, use_asyncio=True))
+
+  def test_background(self):
+    """ Tests that the background is compiled once and stamped under each recipient. """
+    input_dir = self.write_macro_input("Artwork")
+    values = ["relax Hello", "relax World", "FAIL"]
+    recipients = [Recipient(["Macro"], [value]) for value in values]
+
+    for use_asyncio in [False, True]:
+      with self.subTest(use_asyncio=use_asyncio):
+        results = process_recipients(input_dir, self.output, recipients,
+                                     jobs=2 if use_asyncio else 1, use_asyncio=use_asyncio)
+
+        self.assertFalse(results[0].failed)
+        self.assertFalse(results[1].failed)
+        self.assertTrue(results[2].failed)
+        for (result, text) in zip(results[:2], ["Hello", "World"]):
+          self.assert_pdf(result.pdf_path, 1)
+          with open(result.pdf_path, 'rb') as infile:
+            page_text = PdfFileReader(infile).getPage(0).extractText()
+          # The text of the background's page and of the recipient's page.
+          self.assertIn("Artwork", page_text)
+          self.assertIn(text, page_text)
+        # One process compiles each rendering of the background only once.
+        self.assertEqual(
+            1, len(glob.glob(os.path.join(self.output.tmp_dir, "background_*.pdf"))))
+        shutil.rmtree(self.output.tmp_dir)
+        os.makedirs(self.output.tmp_dir)
+
+  def test_background_failure(self):
+    """ Tests that all recipients fail if their background does not compile. """
+    input_dir = self.write_macro_input("FAIL")
+    recipients = [Recipient(["Macro"], [value]) for value in ["relax Hello", "relax World"]]
+
+    for use_asyncio in [False, True]:
+      with self.subTest(use_asyncio=use_asyncio):
+        results = process_recipients(input_dir, self.output, recipients,
+                                     use_asyncio=use_asyncio)
+
+        for result in results:
+          self.assertTrue(result.failed)
+          self.assertIn("background", result.error)
+
+  def test_invalid_jobs(self):
+    """ Tests that a non-positive number of jobs is rejected. """
+    with self.assertRaises(PipelineException):
+      process_recipients(self.input_dir, self.output, self.recipients, jobs=0)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -2,37 +2,107 @@
 
 """ Module for the recipient class. """
 
-import logging
+from collections.abc import Mapping
+
 
 class RecipientException(Exception):
   """ Exceptions of this module. """
 
-class Recipient():
-  """ Represents one recipient of the papeterie. """
 
-  def __init__(self, headerline, recipient):
+class RecipientSchema():
+  """ The field names of a recipient file, shared by all of its recipients.
+
+  headerline: list of strings
+    the field names
+
+  """
+  __slots__ = ("__fields", "__index")
+
+  def __init__(self, headerline):
     if not headerline:
       raise RecipientException("No headerline given.")
+    self.__fields = tuple(headerline)
+    self.__index = {field: idx for (idx, field) in enumerate(self.__fields)}
+
+  @property
+  def fields(self):
+    """ The field names in the order of the header line. """
+    return self.__fields
+
+  @property
+  def index(self):
+    """ The dictionary of field names to the positions of their values. """
+    return self.__index
+
+
+class RecipientView(Mapping):
+  """ Read-only mapping of a recipient's field names to values, without copying.
+
+  schema: RecipientSchema
+    the field names
+  values: tuple of strings
+    the values, in the order of the schema's fields
+
+  """
+  __slots__ = ("__index", "__values")
+
+  def __init__(self, schema, values):
+    self.__index = schema.index
+    self.__values = values
 
-    if len(headerline) != len(recipient):
+  def __getitem__(self, field):
+    return self.__values[self.__index[field]]
+
+  def __iter__(self):
+    return iter(self.__index)
+
+  def __len__(self):
+    return len(self.__index)
+
+
+class Recipient():
+  """ Represents one recipient of the papeterie.
+
+  The field values are accessible as attributes, e.g. recipient.Theme.
+
+  headerline: list of strings or RecipientSchema
+    the field names, pass a RecipientSchema to share it among many recipients
+  recipient: list of strings
+    the values, in the order of the header line
+
+  """
+  __slots__ = ("__schema", "__values")
+
+  def __init__(self, headerline, recipient):
+    if isinstance(headerline, RecipientSchema):
+      schema = headerline
+    else:
+      schema = RecipientSchema(headerline)
+
+    if len(schema.fields) != len(recipient):
       raise RecipientException("Data line does not match headerline.")
 
-    self.__fields = headerline
-    for (idx, headerfield) in enumerate(headerline):
-      self.__setattr__(headerfield, recipient[idx])
-      logging.debug(
-          "Set attribute %s to %s.",
-          headerfield, self.__getattribute__(headerfield))
+    self.__schema = schema
+    self.__values = tuple(recipient)
+
+  def __getattr__(self, field):
+    # Private names are never fields, this also keeps copy and pickle from recursing
+    # on instances that are not initialized yet.
+    if field.startswith("_"):
+      raise AttributeError(field)
+    try:
+      return self.__values[self.__schema.index[field]]
+    except KeyError:
+      raise AttributeError(field) from None
 
   def __str__(self):
-    string = ""
-    for field in self.__fields:
-      string += field + ": " + self.__getattribute__(field) + "\n"
-    return string
+    return "".join(field + ": " + getattr(self, field) + "\n"
+                   for field in self.__schema.fields)
+
+  def view(self):
+    """ Returns a read-only mapping of the recipient's data, without copying it. """
+    return RecipientView(self.__schema, self.__values)
 
   def to_dict(self):
     """ Return's the recipient's data as dictionary. """
-    dictionary = {}
-    for field in self.__fields:
-      dictionary[field] = self.__getattribute__(field)
-    return dictionary
+    return dict(self.view())
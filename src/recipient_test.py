@@ -2,10 +2,11 @@
 
 """ Unit test for the recipient module. """
 
+import pickle
 import unittest
 
 from testing import PapeterieTestCase
-from recipient import Recipient, RecipientException
+from recipient import Recipient, RecipientSchema, RecipientException
 
 
 class TestRecipient(PapeterieTestCase):
@@ -23,6 +24,33 @@ class TestRecipient(PapeterieTestCase):
     # pylint: enable=no-member
     self.assertEqual("Cthulhu", result.to_dict()["Theme"])
 
+  def test_shared_schema(self):
+    """ Test recipients sharing the same schema. """
+    schema = RecipientSchema(["Opening", "Theme"])
+
+    first = Recipient(schema, ["Dear brother,", "Cthulhu"])
+    second = Recipient(schema, ["Dear sister,", "Goth"])
+
+    self.assertEqual("Cthulhu", first.Theme)
+    self.assertEqual("Goth", second.Theme)
+    self.assertEqual({"Opening": "Dear sister,", "Theme": "Goth"}, dict(second.view()))
+    self.assertEqual(["Opening", "Theme"], list(second.view()))
+
+  def test_unknown_field(self):
+    """ Test accessing a field that does not exist. """
+    result = Recipient(["Opening"], ["Dear brother,"])
+
+    with self.assertRaises(AttributeError):
+      # pylint: disable=pointless-statement,no-member
+      result.Theme
+      # pylint: enable=pointless-statement,no-member
+
+  def test_pickle(self):
+    """ Test that recipients can be sent to worker processes. """
+    result = pickle.loads(pickle.dumps(Recipient(["Opening"], ["Dear brother,"])))
+
+    self.assertEqual({"Opening": "Dear brother,"}, result.to_dict())
+
   def test_missing_data(self):
     """ Test with missing data value. """
     headerline = ["Opening", "Theme"]
@@ -8,20 +8,73 @@ import os
 import shutil
 import sys
 
+from cache import CompileCache, DEFAULT_CACHE_DIR, DEFAULT_MAX_SIZE_MB
 from configuration import config_from_json
-from csv2recipients import load_recipients
-from jinja2snippet import JinjaTemplate
-from output import SerialOutputController
-from papeterie import create_single_papeterie
-from pdflatex import PdfLatex
+from csv2recipients import iter_recipients
+from output import SerialOutputController, DISK, MEMORY, STORAGES
 from pdf import merge_pdfs
-from snippets import Snippets, PAPETERIEPICPATH
-from simple_template import SimpleTemplate
-from gpg import Signer
+from pdflatex import DEFAULT_TIMEOUT
+from pictures import PictureCache, prepare_pictures
+from pipeline import process_recipients
+
+
+class SerialException(Exception):
+  """ Exceptions of this module. """
+
+
+def directory_size(path):
+  """ Total size of the files in a directory and its subdirectories in bytes. """
+  return sum(os.path.getsize(os.path.join(root, name))
+             for (root, _, names) in os.walk(path) for name in names)
 
 
 # pylint: disable=redefined-outer-name
 
+def failure_log_file(args, output):
+  """ Path of the log file after a failure, see keep_for_debugging.
+
+  args:
+    commandline arguments
+  output: SerialOutputController
+    output controller of the whole series
+
+  returns: string
+    path of the log file
+
+  """
+  if args.tmp_storage == MEMORY and not args.keep_tmp:
+    return "%s.log" % output.output_file
+  return output.log_file
+
+
+def keep_for_debugging(args, output):
+  """ Handles the temporary files after a failure.
+
+  On disk, the temporary files are kept to make debugging the failure possible.
+  In memory, they would take up memory until the next reboot. Hence, they are
+  removed unless --keep-tmp is given, and only the log file is kept next to the
+  output file.
+
+  args:
+    commandline arguments
+  output: SerialOutputController
+    output controller of the whole series
+
+  """
+  if args.tmp_storage != MEMORY or not os.path.exists(output.tmp_dir):
+    return
+
+  if args.keep_tmp:
+    print("Warning: the temporary files in %s take up %.1f MB of memory until they are "
+          "removed." % (output.tmp_dir, directory_size(output.tmp_dir) / (1024 * 1024)))
+    return
+
+  if os.path.exists(output.log_file):
+    # It does not, if logging was set up before.
+    shutil.copy(output.log_file, failure_log_file(args, output))
+  shutil.rmtree(output.tmp_dir)
+
+
 def run(args, help_fn):
   """ Do the actual work.
 
@@ -31,13 +84,38 @@ def run(args, help_fn):
     function to call to print help
 
   """
-  output = SerialOutputController(args.output_file)
+  output = SerialOutputController(args.output_file, args.tmp_storage)
 
   print("Log file: %s" % output.log_file)
   logging.basicConfig(filename=output.log_file, filemode='w', level=logging.DEBUG)
 
   logging.info("Writing output to %s.", output.tmp_dir)
 
+  try:
+    create_series(args, help_fn, output)
+  except BaseException:
+    # Also when exiting or interrupted.
+    keep_for_debugging(args, output)
+    raise
+
+  if not args.keep_tmp:
+    shutil.rmtree(output.tmp_dir)
+
+
+def create_series(args, help_fn, output):
+  """ Creates the papeterie of all recipients, see run.
+
+  args:
+    commandline arguments
+  help_fn: function
+    function to call to print help
+  output: SerialOutputController
+    output controller of the whole series
+
+  raises: SerialException
+    if any recipient failed
+
+  """
   if not os.path.exists(args.recipient_file):
     print("Recipient file does not exist: %s" % args.recipient_file)
     help_fn()
@@ -55,45 +133,40 @@ def run(args, help_fn):
     help_fn()
     sys.exit(1)
 
-  recipients = load_recipients(args.recipient_file)
-  tex_template = SimpleTemplate(config.tex_template)
-  latex_binary = PdfLatex()
-  signer = Signer(output.tmp_dir, args.gpg_key, args.gpg_homedir)
-  jinja_templates = {name: JinjaTemplate(template)
-                     for (name, template) in config.snippets.items()}
-
-  idx = 0
-  for recipient in recipients:
-    logging.info("Processing recipient idx %s.", idx)
-    logging.info(recipient)
-
-    idx_output = output.get_indexed_output_controller(idx)
-
-    snippets = Snippets({snippet: jinja_templates[snippet].render(recipient)
-                         for snippet in config.snippets})
-
-    # Set a special snippet so that the picture files are correctly referenced.
-    snippets = snippets.add(PAPETERIEPICPATH, args.input_dir)
+  cache = CompileCache(args.cache_dir, args.cache_size) if args.cache else None
 
-    if config.signed_snippets:
-      signed_snippets = snippets \
-        .subset(config.signed_snippets.values()) \
-        .renamed({v: k for (k, v) in config.signed_snippets.items()}) \
-        .transform(signer.sign)
+  picture_dir = None
+  if args.picture_dpi:
+    pictures = PictureCache(cache.picture_dir if cache else output.picture_dir)
+    picture_dir = prepare_pictures(args.input_dir, pictures, args.picture_dpi)
 
-      snippets = snippets.merge_with(signed_snippets)
+  recipients = iter_recipients(args.recipient_file)
+  results = process_recipients(
+      args.input_dir, output, recipients, jobs=args.jobs, batch_size=args.batch_size,
+      use_asyncio=args.use_asyncio, gpg_key=args.gpg_key, gpg_homedir=args.gpg_homedir, cache=cache,
+      precompile_preamble=args.precompile_preamble, compile_timeout=args.timeout,
+      picture_dir=picture_dir)
 
-    create_single_papeterie(
-        latex_binary, idx_output, tex_template, snippets)
+  for result in results:
+    if result.tex_log:
+      for overfull_box in result.tex_log.overfull_boxes:
+        print("Recipient %s: %s" % (result.idx, overfull_box))
 
-    idx += 1
+  failures = [result for result in results if result.failed]
+  for failure in failures:
+    print("Recipient %s failed: %s" % (failure.idx, failure.error))
 
-  merge_pdfs(output.pdf_pattern, output.pdf_path)
+  pdf_paths = [result.pdf_path for result in results if not result.failed]
+  if not pdf_paths:
+    raise SerialException(
+        "No recipient could be processed, see %s." % failure_log_file(args, output))
+  merge_pdfs(pdf_paths, output.pdf_path, jobs=args.jobs)
 
   shutil.copy(output.pdf_path, output.output_file)
 
-  if not args.keep_tmp:
-    shutil.rmtree(output.tmp_dir)
+  if failures:
+    raise SerialException("%d of %d recipients failed, see %s." % (
+        len(failures), len(results), failure_log_file(args, output)))
 
 # pylint: enable=redefined-outer-name
 
@@ -116,9 +189,44 @@ if __name__ == "__main__":
   parser.add_argument(
       '--keep-tmp', dest="keep_tmp", default=False, action="store_true",
       help='Whether to keep the temporary files.')
+  parser.add_argument(
+      '--tmp-storage', type=str, dest="tmp_storage", default=DISK, choices=STORAGES,
+      help='Where to keep the temporary files, "memory" keeps them in /dev/shm. In '
+      'memory, they are removed even if the series fails, unless --keep-tmp is given.')
   parser.add_argument(
       '--gpg-homedir', type=str, dest="gpg_homedir", required=False,
       help='Key ID of a GPG key to sign text snippets.')
+  parser.add_argument(
+      '--jobs', type=int, dest="jobs", default=1,
+      help='Number of recipients to process in parallel.')
+  parser.add_argument(
+      '--asyncio', dest="use_asyncio", default=False, action="store_true",
+      help='Whether to run pdflatex and gpg for all recipients in one event loop, with '
+      'at most --jobs of them running at the same time, instead of in worker processes.')
+  parser.add_argument(
+      '--batch-size', type=int, dest="batch_size", default=1,
+      help='Number of recipients to compile with a single pdflatex run. LaTeX counters '
+      'are reset for each recipient, but global settings and labels carry over.')
+  parser.add_argument(
+      '--timeout', type=int, dest="timeout", default=DEFAULT_TIMEOUT,
+      help='Seconds after which pdflatex is killed.')
+  parser.add_argument(
+      '--precompile-preamble', dest="precompile_preamble", default=False,
+      action="store_true",
+      help='Whether to precompile the preamble of the tex template only once.')
+  parser.add_argument(
+      '--picture-dpi', type=int, dest="picture_dpi", default=None,
+      help='Resolution to convert the pictures to once, before compiling (requires Pillow).')
+  parser.add_argument(
+      '--cache', dest="cache", default=False, action="store_true",
+      help='Whether to reuse pdfs of earlier runs for unchanged recipients.')
+  parser.add_argument(
+      '--cache-dir', type=str, dest="cache_dir", default=DEFAULT_CACHE_DIR,
+      help='Directory of the cache of compiled pdfs.')
+  parser.add_argument(
+      '--cache-size', type=int, dest="cache_size", default=DEFAULT_MAX_SIZE_MB,
+      help='Maximum size of the cache of compiled pdfs in megabytes. Precompiled '
+      'preambles, signatures, templates and prepared pictures are not counted.')
   args = parser.parse_args()
   # pylint: enable=invalid-name
 
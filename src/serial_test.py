@@ -16,11 +16,15 @@ from argparse import Namespace
 
 from testing import PapeterieTestCase
 
-from serial import run
+import pictures
+from output import DISK, MEMORY, MEMORY_DIR
+from serial import run, SerialException
 
 
 def setup_args(recipient_file, input_dir, output_path,
-               keep_tmp=True):
+               keep_tmp=True, jobs=1, cache_dir=None, batch_size=1,
+               precompile_preamble=False, use_asyncio=False, picture_dpi=None,
+               tmp_storage=DISK):
   """ Sets up a Namespace instance just as if the user had specified commandline arguments.
 
   See serial.py for details on the arguments.
@@ -36,6 +40,16 @@ def setup_args(recipient_file, input_dir, output_path,
   args.__setattr__("gpg_homedir", None)
   args.__setattr__("output_file", output_path)
   args.__setattr__("keep_tmp", keep_tmp)
+  args.__setattr__("tmp_storage", tmp_storage)
+  args.__setattr__("jobs", jobs)
+  args.__setattr__("batch_size", batch_size)
+  args.__setattr__("use_asyncio", use_asyncio)
+  args.__setattr__("timeout", 60)
+  args.__setattr__("precompile_preamble", precompile_preamble)
+  args.__setattr__("picture_dpi", picture_dpi)
+  args.__setattr__("cache", cache_dir is not None)
+  args.__setattr__("cache_dir", cache_dir)
+  args.__setattr__("cache_size", 10)
   return args
 
 
@@ -127,6 +141,147 @@ class TestSerial(PapeterieTestCase):
 
     self.assert_pdf(output_path, 6)
 
+  def test_invitation_full_parallel(self):
+    """ Tests creating invitation cards with several worker processes. """
+    recipient_file = os.path.join(self.DATA_FOLDER, "example_recipients.csv")
+    output_path = os.path.join(self.test_dir, "result.pdf")
+    input_dir = os.path.join(self.DATA_FOLDER, "example_invitation_full")
+    args = setup_args(recipient_file, input_dir, output_path, jobs=3)
+
+    run(args, lambda _: None)
+
+    self.assert_pdf(output_path, 12)
+
+  def test_invitation_full_asyncio(self):
+    """ Tests creating invitation cards with asyncio subprocesses. """
+    recipient_file = os.path.join(self.DATA_FOLDER, "example_recipients.csv")
+    output_path = os.path.join(self.test_dir, "result.pdf")
+    input_dir = os.path.join(self.DATA_FOLDER, "example_invitation_full")
+    args = setup_args(recipient_file, input_dir, output_path, jobs=3, use_asyncio=True)
+
+    run(args, lambda _: None)
+
+    self.assert_pdf(output_path, 12)
+
+  def test_invitation_full_batched(self):
+    """ Tests creating invitation cards with several recipients per pdflatex run. """
+    recipient_file = os.path.join(self.DATA_FOLDER, "example_recipients.csv")
+    output_path = os.path.join(self.test_dir, "result.pdf")
+    input_dir = os.path.join(self.DATA_FOLDER, "example_invitation_full")
+    args = setup_args(recipient_file, input_dir, output_path, jobs=2, batch_size=4)
+
+    run(args, lambda _: None)
+
+    self.assert_pdf(output_path, 12)
+
+  def test_invitation_full_precompiled(self):
+    """ Tests creating invitation cards with a precompiled preamble. """
+    recipient_file = os.path.join(self.DATA_FOLDER, "example_recipients.csv")
+    output_path = os.path.join(self.test_dir, "result.pdf")
+    input_dir = os.path.join(self.DATA_FOLDER, "example_invitation_full")
+    args = setup_args(recipient_file, input_dir, output_path, batch_size=4,
+                      precompile_preamble=True)
+
+    run(args, lambda _: None)
+
+    self.assert_pdf(output_path, 12)
+
+  def test_invitation_full_cached(self):
+    """ Tests that a rerun with a cache produces the same result. """
+    recipient_file = os.path.join(self.DATA_FOLDER, "example_recipients.csv")
+    input_dir = os.path.join(self.DATA_FOLDER, "example_invitation_full")
+    cache_dir = os.path.join(self.test_dir, "cache")
+
+    for run_idx in range(2):
+      output_path = os.path.join(self.test_dir, "result_%s.pdf" % run_idx)
+      args = setup_args(recipient_file, input_dir, output_path, cache_dir=cache_dir)
+
+      run(args, lambda _: None)
+
+      self.assert_pdf(output_path, 12)
+
+  @unittest.skipIf(pictures.Image is None, "Pillow is not installed.")
+  def test_invitation_full_prepared_pictures(self):
+    """ Tests creating invitation cards from prepared pictures. """
+    recipient_file = os.path.join(self.DATA_FOLDER, "example_recipients.csv")
+    output_path = os.path.join(self.test_dir, "result.pdf")
+    input_dir = os.path.join(self.DATA_FOLDER, "example_invitation_full")
+    cache_dir = os.path.join(self.test_dir, "cache")
+    args = setup_args(recipient_file, input_dir, output_path, cache_dir=cache_dir,
+                      picture_dpi=150)
+
+    run(args, lambda _: None)
+
+    self.assert_pdf(output_path, 12)
+    self.assertTrue(os.listdir(os.path.join(cache_dir, "pictures", "workspaces")))
+
+  @unittest.skipUnless(os.access(MEMORY_DIR, os.W_OK), "There is no tmpfs.")
+  def test_invitation_full_in_memory(self):
+    """ Tests creating invitation cards with the temporary files in memory. """
+    recipient_file = os.path.join(self.DATA_FOLDER, "example_recipients.csv")
+    output_path = os.path.join(self.test_dir, "result.pdf")
+    input_dir = os.path.join(self.DATA_FOLDER, "example_invitation_full")
+    args = setup_args(recipient_file, input_dir, output_path, keep_tmp=False,
+                      tmp_storage=MEMORY)
+
+    run(args, lambda _: None)
+
+    self.assert_pdf(output_path, 12)
+
+  def write_failing_input(self):
+    """ Writes an input directory and recipient file, the second recipient fails. """
+    input_dir = os.path.join(self.test_dir, "input")
+    os.mkdir(input_dir)
+    with open(os.path.join(input_dir, "config.json"), 'w') as outfile:
+      outfile.write('{ "snippets": { "MACRO": "macro.ji2" } }')
+    with open(os.path.join(input_dir, "macro.ji2"), 'w') as outfile:
+      outfile.write("{{ Macro }}")
+    with open(os.path.join(input_dir, "papeterie.tex"), 'w') as outfile:
+      outfile.write("\\documentclass{article}\n\\begin{document}\n\\MACRO\n\\end{document}\n")
+    recipient_file = os.path.join(self.test_dir, "recipients.csv")
+    with open(recipient_file, 'w') as outfile:
+      outfile.write("Macro\nrelax Hello\nFAIL\n")
+    return (recipient_file, input_dir)
+
+  @unittest.skipUnless(os.access(MEMORY_DIR, os.W_OK), "There is no tmpfs.")
+  def test_failure_in_memory(self):
+    """ Tests that failures do not leave temporary files in memory behind. """
+    (recipient_file, input_dir) = self.write_failing_input()
+    output_path = os.path.join(self.test_dir, "result.pdf")
+    before = set(os.listdir(MEMORY_DIR))
+
+    with self.subTest("removed"):
+      args = setup_args(recipient_file, input_dir, output_path, keep_tmp=False,
+                        tmp_storage=MEMORY)
+      with self.assertRaisesRegex(SerialException, "1 of 2 recipients failed"):
+        run(args, lambda _: None)
+      self.assertEqual(before, set(os.listdir(MEMORY_DIR)))
+
+    with self.subTest("kept"):
+      args = setup_args(recipient_file, input_dir, output_path, keep_tmp=True,
+                        tmp_storage=MEMORY)
+      with self.assertRaises(SerialException):
+        run(args, lambda _: None)
+      kept = set(os.listdir(MEMORY_DIR)) - before
+      self.assertEqual(1, len(kept))
+      for name in kept:
+        shutil.rmtree(os.path.join(MEMORY_DIR, name))
+
+  @unittest.skipUnless(os.access(MEMORY_DIR, os.W_OK), "There is no tmpfs.")
+  def test_exit_in_memory(self):
+    """ Tests that exiting early does not leave temporary files in memory behind. """
+    recipient_file = os.path.join(self.DATA_FOLDER, "example_recipients.csv")
+    input_dir = os.path.join(self.test_dir, "missing")
+    output_path = os.path.join(self.test_dir, "result.pdf")
+    before = set(os.listdir(MEMORY_DIR))
+    args = setup_args(recipient_file, input_dir, output_path, keep_tmp=False,
+                      tmp_storage=MEMORY)
+
+    with self.assertRaises(SystemExit):
+      run(args, lambda: None)
+
+    self.assertEqual(before, set(os.listdir(MEMORY_DIR)))
+
 
 if __name__ == '__main__':
   unittest.main()
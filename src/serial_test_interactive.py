@@ -23,13 +23,16 @@ from pdfminer.pdfpage import PDFPage
 
 from testing import PapeterieTestCase, setup_gpg
 
+from output import DISK
 from serial import run
 
 # pylint: disable=too-many-arguments
 # Yeah, we could that that in a builder-like pattern.
 
 def setup_args(recipient_file, input_dir, output_path, gpg_key=None, gpg_homedir=None,
-               keep_tmp=True):
+               keep_tmp=True, jobs=1, cache_dir=None, batch_size=1,
+               precompile_preamble=False, use_asyncio=False, picture_dpi=None,
+               tmp_storage=DISK):
   """ Sets up a Namespace instance just as if the user had specified commandline arguments.
 
   See serial.py for details on the arguments.
@@ -45,6 +48,16 @@ def setup_args(recipient_file, input_dir, output_path, gpg_key=None, gpg_homedir
   args.__setattr__("gpg_homedir", gpg_homedir)
   args.__setattr__("output_file", output_path)
   args.__setattr__("keep_tmp", keep_tmp)
+  args.__setattr__("tmp_storage", tmp_storage)
+  args.__setattr__("jobs", jobs)
+  args.__setattr__("batch_size", batch_size)
+  args.__setattr__("use_asyncio", use_asyncio)
+  args.__setattr__("timeout", 60)
+  args.__setattr__("precompile_preamble", precompile_preamble)
+  args.__setattr__("picture_dpi", picture_dpi)
+  args.__setattr__("cache", cache_dir is not None)
+  args.__setattr__("cache_dir", cache_dir)
+  args.__setattr__("cache_size", 10)
   return args
 
 # pylint: disable=too-many-arguments
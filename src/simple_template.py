@@ -4,7 +4,10 @@
 
 import re
 import os
-from copy import deepcopy
+
+
+# Matches the empty string, used to expand the escapes of a replacement string.
+EMPTY_PATTERN = re.compile("")
 
 
 class TemplateException(Exception):
@@ -20,12 +23,21 @@ class SimpleTemplate:
   jinja and python's own mechanisms, because tex syntax and those engine's
   syntax was overlapping too much to not cause any headaces.
 
+  The template is split into literal text and placeholders once per set of snippet
+  names, rendering then only joins the pieces. Placeholders are found in a single
+  scan, preferring the longest snippet name, and inserted snippets are not scanned
+  for placeholders again.
+
   filepath: string
     path of the template file
+  literal: boolean
+    whether snippets are inserted literally. By default, backslash escapes in
+    snippets are processed like in the replacement string of re.sub, i.e. '\\\\'
+    becomes '\\'. That is what the output of tex.texify expects.
 
   """
 
-  def __init__(self, filepath):
+  def __init__(self, filepath, literal=False):
     if not filepath:
       raise TemplateException("No valid filename given.")
 
@@ -33,11 +45,46 @@ class SimpleTemplate:
       raise TemplateException("Template file %s does not exist." % filepath)
 
     with open(filepath, 'r', encoding='utf-8') as infile:
-      self.__template = u"".join(infile.readlines())
+      self.__template = infile.read()
+    self.__literal = literal
+    self.__compiled = {}
 
   def __str__(self):
     return str(self.__template)
 
+  def __compile(self, names):
+    """ Splits the template into literal text and placeholders.
+
+    names: iterable of strings
+      the snippet names
+
+    returns: (list of strings, list of integers)
+      the pieces of the template, and the positions of the placeholders among them
+
+    """
+    key = frozenset(names)
+    if key not in self.__compiled:
+      pieces = []
+      slots = []
+      position = 0
+      if key:
+        pattern = re.compile("|".join(
+            re.escape(name) for name in sorted(key, key=len, reverse=True)))
+        for match in pattern.finditer(self.__template):
+          pieces.append(self.__template[position:match.start()])
+          slots.append(len(pieces))
+          pieces.append(match.group(0))
+          position = match.end()
+      pieces.append(self.__template[position:])
+      self.__compiled[key] = (pieces, slots)
+    return self.__compiled[key]
+
+  def __expand(self, snippet):
+    """ Processes the backslash escapes of a snippet, unless in literal mode. """
+    if self.__literal or "\\" not in snippet:
+      return snippet
+    return EMPTY_PATTERN.sub(snippet, "")
+
   def render(self, snippets):
     """ Substitutes placeholders with the content from the given snippets.
 
@@ -48,7 +95,9 @@ class SimpleTemplate:
       a string containing the result of the substitution
 
     """
-    result = deepcopy(self.__template)
-    for (name, snippet) in snippets.to_dict().items():
-      result = re.sub(name, snippet, result)
-    return result
+    snippet_dict = snippets.view()
+    (pieces, slots) = self.__compile(snippet_dict.keys())
+    result = list(pieces)
+    for slot in slots:
+      result[slot] = self.__expand(snippet_dict[pieces[slot]])
+    return "".join(result)
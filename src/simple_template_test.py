@@ -35,6 +35,32 @@ class TestSimpleTemplate(PapeterieTestCase):
 
     self.assertEqual(expected, result)
 
+  def write_template(self, content):
+    """ Writes a template file to the test directory and returns its path. """
+    template_file = os.path.join(self.test_dir, "template.tex")
+    with open(template_file, 'w', encoding='utf-8') as outfile:
+      outfile.write(content)
+    return template_file
+
+  def test_escapes(self):
+    """ Tests that backslash escapes are processed by default, but not when literal. """
+    template_file = self.write_template("\\textbf{TEXT}")
+    content = Snippets({"TEXT": "a\\\\b"})
+
+    self.assertEqual("\\textbf{a\\b}", SimpleTemplate(template_file).render(content))
+    self.assertEqual("\\textbf{a\\\\b}",
+                     SimpleTemplate(template_file, literal=True).render(content))
+
+  def test_single_pass(self):
+    """ Tests that inserted snippets are not searched for placeholders again. """
+    template_file = self.write_template("FRONT BACK FRONT")
+    content = Snippets({"FRONT": "BACK", "BACK": "front"})
+
+    template = SimpleTemplate(template_file)
+
+    self.assertEqual("BACK front BACK", template.render(content))
+    self.assertEqual("FRONT x FRONT", template.render(Snippets({"BACK": "x"})))
+
 
 if __name__ == '__main__':
   unittest.main()
@@ -2,8 +2,14 @@
 
 """ Module to manage a collection of snippets. """
 
-from copy import deepcopy
+import functools
+import hashlib
+import io
 import logging
+import os
+import pickle
+import tempfile
+from types import MappingProxyType
 
 
 # Special snippet name to contain the path for pictures
@@ -14,14 +20,17 @@ class SnippetsException(Exception):
   """ Exception for this module. """
 
 
-def from_snippets_string(snippet_names, snippets_string, check_completeness=True):
-  """ Takes an iterable of snippet names and a string containing the snippets and creates
-       a snippet collection from it.
+def from_stream(snippet_names, lines, check_completeness=True):
+  """ Takes an iterable of snippet names and an iterable of lines containing the
+       snippets and creates a snippet collection from it.
+
+  The lines are consumed one by one, so that an open file can be parsed without
+  reading it into memory first.
 
   snippet_names:
     an iterable of snippet names
-  snippets_string:
-    a string containing the snippets in the form:
+  lines:
+    an iterable of strings, e.g. an open file, containing the snippets in the form:
 
   SNIPPET_NAME1
   snippet1
@@ -35,23 +44,34 @@ def from_snippets_string(snippet_names, snippets_string, check_completeness=True
     a Snippets instance
 
   """
+  names = set(snippet_names)
   snippet_dict = {}
 
   current_snippet_name = None
-  current_snippet = ""
-  for line in snippets_string.split("\n"):
-    if line.strip() in set(snippet_names):
-      if current_snippet != "":
-        snippet_dict[current_snippet_name] = current_snippet.strip()
-        current_snippet = ""
-        current_snippet_name = None
-      current_snippet_name = line.strip()
+  current_lines = []
+  for line in lines:
+    line = line.strip()
+    if line in names:
+      if current_lines:
+        snippet_dict[current_snippet_name] = u"\n".join(current_lines).strip()
+        current_lines = []
+      current_snippet_name = line
       continue
-    current_snippet += line.strip() + "\n"
-  snippet_dict[current_snippet_name] = current_snippet.strip()
+    current_lines.append(line)
+  snippet_dict[current_snippet_name] = u"\n".join(current_lines).strip()
   return from_dict(snippet_names, snippet_dict, check_completeness)
 
 
+def from_snippets_string(snippet_names, snippets_string, check_completeness=True):
+  """ Takes an iterable of snippet names and a string containing the snippets and creates
+       a snippet collection from it.
+
+  See from_stream for the format of the string.
+
+  """
+  return from_stream(snippet_names, snippets_string.split("\n"), check_completeness)
+
+
 def from_file(names, snippet_file_path, check_completeness=True):
   """ Read a snippet collection from file.
 
@@ -67,8 +87,82 @@ def from_file(names, snippet_file_path, check_completeness=True):
 
   """
   with open(snippet_file_path, 'r', encoding='utf-8') as infile:
-    snippet_str = u"".join(infile.readlines())
-  return from_snippets_string(names, snippet_str, check_completeness=check_completeness)
+    return from_stream(names, infile, check_completeness=check_completeness)
+
+
+def to_file(snippets, snippet_file_path):
+  """ Write a snippet collection to file, in the format from_file reads.
+
+  snippets: Snippets
+    the snippet collection
+  snippet_file_path: string
+    path of the snippet file
+
+  """
+  with open(snippet_file_path, 'w', encoding='utf-8') as outfile:
+    snippets.write(outfile)
+
+
+class SnippetCache():
+  """ Persistent cache of parsed snippet files.
+
+  Each file is parsed once for each set of snippet names, the parsed snippets are
+  pickled to the cache directory. The file is parsed again as soon as its
+  modification time or size changes.
+
+  cache_dir: string
+    directory to store the parsed snippets in, created if it does not exist
+
+  """
+
+  def __init__(self, cache_dir):
+    self.__dir = cache_dir
+    os.makedirs(self.__dir, exist_ok=True)
+
+  def __path(self, names, snippet_file_path):
+    sha = hashlib.sha256()
+    sha.update(os.path.abspath(snippet_file_path).encode("utf-8"))
+    for name in sorted(names):
+      sha.update(b"\0")
+      sha.update(name.encode("utf-8"))
+    return os.path.join(self.__dir, "%s.pickle" % sha.hexdigest())
+
+  def from_file(self, names, snippet_file_path, check_completeness=True):
+    """ Read a snippet collection from file, or from the cache if the file did not
+        change since it was cached.
+
+    See from_file for the arguments.
+
+    """
+    names = frozenset(names)
+    stat = os.stat(snippet_file_path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    path = self.__path(names, snippet_file_path)
+
+    snippet_dict = None
+    try:
+      with open(path, 'rb') as infile:
+        (cached_signature, cached_dict) = pickle.load(infile)
+      if cached_signature == signature:
+        snippet_dict = cached_dict
+    except (OSError, EOFError, ValueError, pickle.UnpicklingError) as exception:
+      if not isinstance(exception, FileNotFoundError):
+        logging.warning("Ignoring broken snippet cache entry %s: %s", path, exception)
+
+    if snippet_dict is None:
+      snippet_dict = from_file(names, snippet_file_path, check_completeness=False).to_dict()
+      (handle, tmp_path) = tempfile.mkstemp(dir=self.__dir, suffix=".tmp")
+      with os.fdopen(handle, 'wb') as outfile:
+        pickle.dump((signature, snippet_dict), outfile)
+      os.replace(tmp_path, path)
+      logging.info("Stored snippets of %s in cache.", snippet_file_path)
+    else:
+      logging.info("Took snippets of %s from cache.", snippet_file_path)
+
+    result = Snippets(snippet_dict)
+    if check_completeness:
+      result.check_completeness(names)
+    return result
 
 
 def from_dict(names, snippet_dict, check_completeness=True):
@@ -109,30 +203,91 @@ def from_dict(names, snippet_dict, check_completeness=True):
   return result
 
 
+@functools.lru_cache(maxsize=None)
+def check_overlap(names):
+  """ Checks that no snippet name is a substring of another snippet name.
+
+  This is to make sure that we don't mess up our stupid simple template mechanism.
+  The result is cached, so each set of names is only checked once.
+
+  names: frozenset of strings
+    the snippet names
+
+  raises: SnippetsException
+    if one snippet name is a substring of another one
+
+  """
+  for name in names:
+    for other_name in names:
+      if name != other_name:
+        if name in other_name or other_name in name:
+          raise SnippetsException(
+              "Snippet name %s and %s are substrings of each other." % (
+                  name, other_name))
+
+
 class Snippets():
   """ A collection of snippets.
 
   Main purpose is to fill simple templates. Therefore, the list of snippet names must
   match the ALL CAPS placeholders in the template. ALL CAPS is enforced on construction.
 
+  A collection is never changed after construction. All operations create new
+  collections, which only copy the references to the snippets, not the snippets
+  themselves.
+
   snippet_dict:
     a dictionray of snippet names to snippets.
 
   """
+  __slots__ = ("__snippets",)
+
   def __init__(self, snippet_dict):
     self.__snippets = {k.upper(): v for (k, v) in snippet_dict.items()}
-    self.__check_overlap()
+    check_overlap(frozenset(self.__snippets))
+
+  @classmethod
+  def __trusted(cls, snippet_dict, check=True):
+    """ Creates a collection from a dictionary with upper case names, taking it over
+        without copying.
+
+    snippet_dict: dictionary
+      the snippets, must not be used by the caller afterwards
+    check: boolean
+      whether or not the names need to be checked for overlaps, which is not
+      necessary if they are the names of an existing collection
+
+    """
+    result = cls.__new__(cls)
+    result.__snippets = snippet_dict
+    if check:
+      check_overlap(frozenset(snippet_dict))
+    return result
 
   def __len__(self):
     return len(self.__snippets)
 
   def to_dict(self):
-    """ Returns the dictionary of snippet names to snippets. """
-    return deepcopy(self.__snippets)
+    """ Returns a copy of the dictionary of snippet names to snippets. """
+    return dict(self.__snippets)
+
+  def view(self):
+    """ Returns a read-only view of the snippet names and snippets, without copying. """
+    return MappingProxyType(self.__snippets)
 
   def __str__(self):
     """ Returns the string representation of the collection.
 
+    See write for the format.
+
+    """
+    stream = io.StringIO()
+    self.write(stream)
+    return stream.getvalue()
+
+  def write(self, stream):
+    """ Writes the string representation of the collection to a stream.
+
     Note: the snippets are ordered alphabetically by snippet name.
 
     Format:
@@ -142,14 +297,14 @@ class Snippets():
     snippet2
     ...
 
+    stream: file-like object
+      a text stream to write to
+
     """
-    string = ""
-    names_ordered = list(self.__snippets.keys())
-    names_ordered.sort()
-    for name in names_ordered:
+    for name in sorted(self.__snippets):
       logging.debug("Adding snippet to string: %s", name)
-      string += name + "\n" + self.__snippets[name] + "\n"
-    return string
+      stream.write(name + "\n")
+      stream.write(self.__snippets[name] + "\n")
 
   def check_completeness(self, names):
     """ Checks if all given snippet names are in the snippet collection.
@@ -166,20 +321,6 @@ class Snippets():
         raise SnippetsException("Required snippet %s is not in snippet dictionary: %s" %
                                 (name, self.__snippets.keys()))
 
-  def __check_overlap(self):
-    """ Checks that no snippet name is a substring of another snippet name.
-
-    This is to make sure that we don't mess up our stupid simple template mechanism.
-
-    """
-    for name in self.__snippets:
-      for other_name in self.__snippets:
-        if name != other_name:
-          if name in other_name or other_name in name:
-            raise SnippetsException(
-                "Snippet name %s and %s are substrings of each other." % (
-                    name, other_name))
-
   def subset(self, subset):
     """ Create a snippet collection that is a subset of another one.
 
@@ -190,7 +331,8 @@ class Snippets():
       a new Snippets instance containing only the requested subset of snippets
 
     """
-    return Snippets({name: self.__snippets[name] for name in subset})
+    # A subset of names that do not overlap does not overlap either.
+    return Snippets.__trusted({name: self.__snippets[name] for name in subset}, check=False)
 
   def renamed(self, name_map):
     """ Create a snippet collection by renaming the snippets of another one.
@@ -216,7 +358,8 @@ class Snippets():
       a new Snippets instance with transformed valued
 
     """
-    return Snippets({name: fn(snippet) for (name, snippet) in self.__snippets.items()})
+    return Snippets.__trusted(
+        {name: fn(snippet) for (name, snippet) in self.__snippets.items()}, check=False)
   # pylint: enable=invalid-name
 
   def merge_with(self, mergee, check_overlapping=True):
@@ -234,13 +377,14 @@ class Snippets():
       (updating original snippets)
 
     """
+    mergee_snippets = mergee.view()
     if check_overlapping:
-      if set(self.to_dict().keys()).intersection(set(mergee.to_dict().keys())):
+      if not self.__snippets.keys().isdisjoint(mergee_snippets.keys()):
         raise SnippetsException("Snippet keys are overlapping.")
 
-    new_dict = deepcopy(self.to_dict())
-    new_dict.update(mergee.to_dict())
-    return Snippets(new_dict)
+    new_dict = dict(self.__snippets)
+    new_dict.update(mergee_snippets)
+    return Snippets.__trusted(new_dict)
 
   def add(self, name, snippet):
     """ Creates a snippet collection from the original with an additional snippet in it.
@@ -253,6 +397,6 @@ class Snippets():
       content of the additional snippet
 
     """
-    new_dict = deepcopy(self.to_dict())
+    new_dict = dict(self.__snippets)
     new_dict[name.upper()] = snippet
-    return Snippets(new_dict)
+    return Snippets.__trusted(new_dict)
@@ -2,6 +2,7 @@
 
 """ Unit tests for snippets. """
 
+import io
 import os
 import unittest
 import shutil
@@ -163,6 +164,58 @@ class TestSnippets(PapeterieTestCase):
     expected = {"A": "a", "B": "b", "C": "c"}
     self.assertEqual(result.to_dict(), expected)
 
+  def test_from_stream(self):
+    """ Test creation from a stream of lines, with multi-line snippets. """
+    stream = io.StringIO("A\na1\n\na2\nB\n  b  \nC\nc\n")
+
+    result = snippets.from_stream(["A", "B", "C"], stream)
+
+    expected = {"A": "a1\n\na2", "B": "b", "C": "c"}
+    self.assertEqual(result.to_dict(), expected)
+
+  def test_to_file(self):
+    """ Test that writing and reading a file gives the same snippets. """
+    original = snippets.Snippets({"A": "a1\na2", "C": "c", "B": "b"})
+    snippet_file_path = os.path.join(self.test_dir, "snippets")
+
+    snippets.to_file(original, snippet_file_path)
+    result = snippets.from_file(["A", "B", "C"], snippet_file_path)
+
+    self.assertEqual(original.to_dict(), result.to_dict())
+
+  def test_snippet_cache(self):
+    """ Test that cached snippet files are only parsed again when they change. """
+    snippet_file_path = os.path.join(self.test_dir, "snippets")
+    with open(snippet_file_path, 'w') as outfile:
+      outfile.write("A\na\nB\nb")
+    cache = snippets.SnippetCache(os.path.join(self.test_dir, "cache"))
+
+    first = cache.from_file(["A", "B"], snippet_file_path)
+    second = cache.from_file(["A", "B"], snippet_file_path)
+    subset = cache.from_file(["A"], snippet_file_path, check_completeness=False)
+
+    self.assertEqual({"A": "a", "B": "b"}, first.to_dict())
+    self.assertEqual({"A": "a", "B": "b"}, second.to_dict())
+    self.assertEqual({"A": "a\nB\nb"}, subset.to_dict())
+    self.assertEqual(2, len(os.listdir(os.path.join(self.test_dir, "cache"))))
+
+    with open(snippet_file_path, 'w') as outfile:
+      outfile.write("A\nx\nB\ny\n")
+    third = cache.from_file(["A", "B"], snippet_file_path)
+
+    self.assertEqual({"A": "x", "B": "y"}, third.to_dict())
+
+  def test_snippet_cache_completeness_fail(self):
+    """ Test that snippets from the cache are checked for completeness. """
+    snippet_file_path = os.path.join(self.test_dir, "snippets")
+    with open(snippet_file_path, 'w') as outfile:
+      outfile.write("A\na")
+    cache = snippets.SnippetCache(os.path.join(self.test_dir, "cache"))
+    cache.from_file(["A", "B"], snippet_file_path, check_completeness=False)
+
+    with self.assertRaises(snippets.SnippetsException):
+      cache.from_file(["A", "B"], snippet_file_path)
+
   def test_from_file_completeness_fail(self):
     """ Test creation from files. """
     snippet_file_content = "A\na\nC\nc"
@@ -197,6 +250,33 @@ class TestSnippets(PapeterieTestCase):
     expected = {"A": "a", "B": "b", "C": "c", "X": "x"}
     self.assertEqual(expected, result.to_dict())
 
+  def test_add_overlapping_snippet(self):
+    """ Test that added snippet names are checked for overlaps. """
+    original = snippets.Snippets({"A": "a", "B": "b"})
+
+    with self.assertRaises(snippets.SnippetsException):
+      original.add("AB", "ab")
+
+  def test_immutable(self):
+    """ Test that neither to_dict nor derived collections change the original. """
+    original = snippets.Snippets({"A": "a", "B": "b"})
+
+    original.to_dict()["A"] = "x"
+    original.add("C", "c")
+    original.merge_with(snippets.Snippets({"A": "y"}), check_overlapping=False)
+
+    self.assertEqual({"A": "a", "B": "b"}, original.to_dict())
+
+  def test_view(self):
+    """ Test the read-only view of a collection. """
+    original = snippets.Snippets({"A": "a", "B": "b"})
+
+    view = original.view()
+
+    self.assertEqual({"A": "a", "B": "b"}, dict(view))
+    with self.assertRaises(TypeError):
+      view["A"] = "x"
+
 # pylint: enable=too-many-public-methods
 
 
@@ -3,26 +3,170 @@
 """ Module to texify strings. """
 
 import re
+import unicodedata
+
+
+class TexException(Exception):
+  """ Exception for this module. """
+
+
+BEGIN_DOCUMENT = u"\\begin{document}"
+END_DOCUMENT = u"\\end{document}"
+
+# Combining marks and the tex accents that put them on a letter. Accents that are
+# named by a letter take their argument in braces, e.g. '\v{c}'.
+ACCENTS = {
+    u'\u0300': u"\\`",
+    u'\u0301': u"\\'",
+    u'\u0302': u"\\^",
+    u'\u0303': u"\\~",
+    u'\u0304': u"\\=",
+    u'\u0306': u"\\u",
+    u'\u0307': u"\\.",
+    u'\u0308': u"\\\"",
+    u'\u030a': u"\\r",
+    u'\u030b': u"\\H",
+    u'\u030c': u"\\v",
+    u'\u0323': u"\\d",
+    u'\u0327': u"\\c",
+    u'\u0328': u"\\k",
+    u'\u0331': u"\\b",
+}
 
-
-# TODO: add moar data from
-# https://www.utf8-chartable.de/unicode-utf8-table.pl?start=128&names=-&utf8=string-literal
-UMLAUTS = {
-    u'ü': u"\\\"u",
-    u'ö': u"\\\"o",
-    u'ä': u"\\\"a",
-    u'Ü': u"\\\"U",
-    u'Ö': u"\\\"O",
-    u'Ä': u"\\\"A",
-    u'é': u"\\\'e",
-    u'ß': u"{\\\\\\\\ss}",
+# Unicode blocks with latin letters, whose accented letters are derived from
+# their canonical decomposition.
+LATIN_BLOCKS = [
+    (0x00c0, 0x0250),
+    (0x1e00, 0x1f00),
+]
+
+# Characters without a decomposition into a letter and accents.
+SYMBOLS = {
+    u'\u00a0': u"~",
+    u'¡': u"{\\textexclamdown}",
+    u'£': u"{\\pounds}",
+    u'§': u"{\\S}",
+    u'©': u"{\\copyright}",
+    u'«': u"{\\guillemotleft}",
+    u'°': u"{\\textdegree}",
+    u'¶': u"{\\P}",
+    u'»': u"{\\guillemotright}",
+    u'¿': u"{\\textquestiondown}",
+    u'Æ': u"{\\AE}",
+    u'Ð': u"{\\DH}",
+    u'Ø': u"{\\O}",
+    u'Þ': u"{\\TH}",
+    u'ß': u"{\\ss}",
+    u'æ': u"{\\ae}",
+    u'ð': u"{\\dh}",
+    u'ø': u"{\\o}",
+    u'þ': u"{\\th}",
+    u'Đ': u"{\\DJ}",
+    u'đ': u"{\\dj}",
+    u'ı': u"{\\i}",
+    u'Ł': u"{\\L}",
+    u'ł': u"{\\l}",
+    u'Ŋ': u"{\\NG}",
+    u'ŋ': u"{\\ng}",
+    u'Œ': u"{\\OE}",
+    u'œ': u"{\\oe}",
+    u'ȷ': u"{\\j}",
+    u'ẞ': u"{\\SS}",
+    u'–': u"{\\textendash}",
+    u'—': u"{\\textemdash}",
+    u'‘': u"{\\textquoteleft}",
+    u'’': u"{\\textquoteright}",
+    u'‚': u"{\\quotesinglbase}",
+    u'“': u"{\\textquotedblleft}",
+    u'”': u"{\\textquotedblright}",
+    u'„': u"{\\quotedblbase}",
+    u'…': u"{\\dots}",
+    u'€': u"{\\texteuro}",
 }
 
+# Replacements in the output format of texify (see below), that are no single
+# characters.
 OTHER = {
-    u'trasse': u"tra{\\\\\\\\ss}e",
-    u'\n': u'\\\\\\\\\\\\\\\\\n',
+    u'trasse': u"tra{\\\\ss}e",
+    u'\n': u"\\\\\\\\\n",
 }
 
+# Empty lines are converted to '\\' by default. However that confuses latex and
+# hence, we replace those with '\leavevmode\\'. More info:
+# https://texfaq.org/FAQ-noline
+EMPTY_LINE = u"\\\\leavevmode\\\\\\\\\n"
+
+
+def tex_accent(char):
+  """ Composes the tex representation of an accented latin letter.
+
+  char: string
+    a single character
+
+  returns: string or None
+    the tex representation, or None if the character is no accented latin letter
+    or carries an accent tex does not know
+
+  """
+  decomposition = unicodedata.decomposition(char).split()
+  if not decomposition or decomposition[0].startswith("<"):
+    return None
+  (base, mark) = (chr(int(code, 16)) for code in decomposition)
+  if mark not in ACCENTS:
+    return None
+  if not ("a" <= base.lower() <= "z"):
+    base = tex_accent(base)
+    if base is None:
+      return None
+  accent = ACCENTS[mark]
+  if accent[-1].isalpha() or len(base) > 1:
+    return u"%s{%s}" % (accent, base)
+  return accent + base
+
+
+def escape_replacement(tex):
+  """ Escapes a piece of tex for the output format of texify.
+
+  The output of texify is inserted by SimpleTemplate, which processes backslash
+  escapes. Hence, the backslash of each control word is doubled.
+
+  tex: string
+    a piece of tex
+
+  returns: string
+    the escaped piece of tex
+
+  """
+  return re.sub(r"\\(?=[A-Za-z])", r"\\\\", tex)
+
+
+def build_replacements():
+  """ Builds the table of all replacements texify makes.
+
+  returns: dictionary
+    the replacements, mapping strings to their escaped tex representation
+
+  """
+  replacements = {}
+  for (start, end) in LATIN_BLOCKS:
+    for code in range(start, end):
+      tex = tex_accent(chr(code))
+      if tex is not None:
+        replacements[chr(code)] = escape_replacement(tex)
+  for (char, tex) in SYMBOLS.items():
+    replacements[char] = escape_replacement(tex)
+  replacements.update(OTHER)
+  return replacements
+
+
+REPLACEMENTS = build_replacements()
+
+# The first alternative matches newlines that end an empty line, i.e. that
+# directly follow another newline or start the string.
+TEXIFY_PATTERN = re.compile(u"(?<![^\n])(\n)|%s|[%s]" % (
+    u"|".join(re.escape(key) for key in REPLACEMENTS if len(key) > 1),
+    u"".join(re.escape(key) for key in REPLACEMENTS if len(key) == 1)))
+
 
 def tex_strip(string):
   """ Strips the last added newline.
@@ -41,32 +185,20 @@ def tex_strip(string):
   return string
 
 
-def fix_empty_lines(string):
-  """ Special treatment for empty lines.
-
-  Empty lines are converted to '\\\\' by default.
-  However that confuses latex and hence, we replace those with
-  '\\leavevmode\\\\'. More info: https://texfaq.org/FAQ-noline
-
-  string: string
-    string to fix
-
-  returns: string
-    fixed string
-
-  """
-  newline_only = u'\\\\\\\\'
-  fixed_lines = []
-  for line in string.split('\n'):
-    if line == newline_only:
-      line = u"\\\\leavevmode" + line
-    fixed_lines.append(line)
-  return '\n'.join(fixed_lines)
+def texify_match(match):
+  """ Returns the replacement of one match of TEXIFY_PATTERN. """
+  if match.lastindex:
+    return EMPTY_LINE
+  return REPLACEMENTS[match.group()]
 
 
 def texify(string):
   """ Convert a string to its representation in tex.
 
+  All replacements are made in a single pass over the string. The result is
+  meant to be inserted by SimpleTemplate, hence control words are written with
+  a doubled backslash, e.g. '{\\\\ss}'.
+
   string: string
     text to convert to tex
 
@@ -74,12 +206,27 @@ def texify(string):
     string in tex syntax
 
   """
-  substitutions = OTHER
-  substitutions.update(UMLAUTS)
-
-  #logging.debug("String before texify: %s", string)
-  for (key, value) in substitutions.items():
-    string = re.sub(key, value, string)
-  #logging.debug("String after texify: %s", string)
-  string = fix_empty_lines(string)
-  return tex_strip(string)
+  if string.isascii() and u"\n" not in string and u"trasse" not in string:
+    return string
+  return tex_strip(TEXIFY_PATTERN.sub(texify_match, string))
+
+
+def split_document(texcontent):
+  """ Splits a tex document into its preamble and its body.
+
+  texcontent: string
+    content of a complete tex document
+
+  returns: (string, string)
+    the preamble (everything before '\\begin{document}') and the body (everything
+    between '\\begin{document}' and '\\end{document}')
+
+  raises: TexException
+    if the document is not delimited by '\\begin{document}' and '\\end{document}'
+
+  """
+  begin = texcontent.find(BEGIN_DOCUMENT)
+  end = texcontent.rfind(END_DOCUMENT)
+  if begin < 0 or end < begin:
+    raise TexException("The tex document does not contain a document environment.")
+  return (texcontent[:begin], texcontent[begin + len(BEGIN_DOCUMENT):end])
@@ -5,7 +5,7 @@
 import unittest
 
 from testing import PapeterieTestCase
-from tex import texify
+from tex import texify, split_document, TexException
 
 
 class TestTexifyText(PapeterieTestCase):
@@ -41,6 +41,56 @@ class TestTexifyText(PapeterieTestCase):
     result = texify(string)
     self.assertEqual(result, u"A\\\\\\\\\n\\\\leavevmode\\\\\\\\\nB")
 
+  def test_leading_empty_line(self):
+    """ Tests that an empty first line is fixed, too. """
+    string = "\nA"
+    result = texify(string)
+    self.assertEqual(result, u"\\\\leavevmode\\\\\\\\\nA")
+
+  def test_accents(self):
+    """ Tests letters with accents beyond the german umlauts. """
+    string = u"Čeština, Ångström, façade, Łódź, señor"
+    result = texify(string)
+    self.assertEqual(result, u"\\\\v{C}e\\\\v{s}tina, \\\\r{A}ngstr\\\"om, fa\\\\c{c}ade, "
+                     u"{\\\\L}\\'od\\'z, se\\~nor")
+
+  def test_nested_accents(self):
+    """ Tests letters with more than one accent. """
+    string = u"ǖ"
+    result = texify(string)
+    self.assertEqual(result, u"\\={\\\"u}")
+
+  def test_symbols(self):
+    """ Tests characters that are no accented letters. """
+    string = u"„Œuvre“ – 5 €"
+    result = texify(string)
+    self.assertEqual(result, u"{\\\\quotedblbase}{\\\\OE}uvre{\\\\textquotedblleft} "
+                     u"{\\\\textendash} 5 {\\\\texteuro}")
+
+  def test_unknown_characters(self):
+    """ Tests that characters without a tex representation are kept. """
+    string = u"日本"
+    result = texify(string)
+    self.assertEqual(result, u"日本")
+
+
+class TestSplitDocument(PapeterieTestCase):
+  """ Test split_document. """
+
+  def test_split(self):
+    """ Tests splitting a document into preamble and body. """
+    document = "\\documentclass{scrartcl}\n\\begin{document}\nA\n\\end{document}\n"
+
+    (preamble, body) = split_document(document)
+
+    self.assertEqual("\\documentclass{scrartcl}\n", preamble)
+    self.assertEqual("\nA\n", body)
+
+  def test_no_document(self):
+    """ Tests splitting something that is not a complete document. """
+    with self.assertRaises(TexException):
+      split_document("A")
+
 
 if __name__ == '__main__':
   unittest.main()
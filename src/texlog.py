@@ -0,0 +1,135 @@
+#/bin/python3
+
+""" Module to extract errors and warnings from the log file of pdflatex. """
+
+import re
+
+
+# Kinds of messages.
+ERROR = "error"
+OVERFULL_BOX = "overfull box"
+
+# '! Undefined control sequence.', followed by e.g. 'l.12 \foo' a few lines later.
+ERROR_PATTERN = re.compile(r"^! (?P<text>.*)$")
+ERROR_LINE_PATTERN = re.compile(r"^l\.(?P<line>\d+)")
+# Number of lines after an error to look for its line number.
+ERROR_CONTEXT = 10
+# Messages that ask for another pdflatex pass, e.g. 'LaTeX Warning: Label(s) may
+# have changed. Rerun to get cross-references right.'
+RERUN_PATTERN = re.compile(
+    r"Rerun to get|Label\(s\) may have changed|Please rerun LaTeX|Rerun LaTeX")
+# 'Overfull \hbox (12.3pt too wide) in paragraph at lines 10--12' or
+# 'Overfull \vbox (3.0pt too high) detected at line 15'.
+OVERFULL_BOX_PATTERN = re.compile(
+    r"^Overfull \\[hv]box \((?P<amount>[\d.]+pt) too (?:wide|high)\)"
+    r".*?(?:lines? (?P<line>\d+)(?:--\d+)?)?$")
+
+
+class TexMessage():
+  """ One error or warning of a pdflatex run.
+
+  kind: string
+    ERROR or OVERFULL_BOX
+  text: string
+    the message as found in the log
+  line: integer (optional)
+    the line of the tex file the message refers to
+
+  """
+  # pylint: disable=too-few-public-methods
+
+  def __init__(self, kind, text, line=None):
+    self.kind = kind
+    self.text = text
+    self.line = line
+
+  def __str__(self):
+    if self.line is None:
+      return self.text
+    return "line %d: %s" % (self.line, self.text)
+
+  # pylint: enable=too-few-public-methods
+
+
+class TexLog():
+  """ The errors and warnings of a pdflatex run.
+
+  messages: list of TexMessage
+    the messages in the order of the log
+  rerun_requested: boolean
+    whether or not the document asks for another pdflatex pass
+
+  """
+
+  def __init__(self, messages, rerun_requested=False):
+    self.__messages = messages
+    self.__rerun_requested = rerun_requested
+
+  @property
+  def rerun_requested(self):
+    """ Whether or not the document asks for another pdflatex pass. """
+    return self.__rerun_requested
+
+  @property
+  def messages(self):
+    """ All messages in the order of the log. """
+    return self.__messages
+
+  @property
+  def errors(self):
+    """ The errors, which made pdflatex stop. """
+    return [message for message in self.__messages if message.kind == ERROR]
+
+  @property
+  def overfull_boxes(self):
+    """ The warnings about overfull boxes, i.e. text that sticks out of its box. """
+    return [message for message in self.__messages if message.kind == OVERFULL_BOX]
+
+
+def parse_lines(lines):
+  """ Extracts errors and warnings from the lines of a pdflatex log.
+
+  lines: list of strings
+    the lines of the log
+
+  returns: TexLog
+    the errors and warnings
+
+  """
+  messages = []
+  for (idx, line) in enumerate(lines):
+    match = ERROR_PATTERN.match(line)
+    if match:
+      error_line = None
+      for context in lines[idx + 1:idx + 1 + ERROR_CONTEXT]:
+        line_match = ERROR_LINE_PATTERN.match(context)
+        if line_match:
+          error_line = int(line_match.group("line"))
+          break
+      messages.append(TexMessage(ERROR, match.group("text").strip(), error_line))
+      continue
+
+    match = OVERFULL_BOX_PATTERN.match(line)
+    if match:
+      box_line = int(match.group("line")) if match.group("line") else None
+      messages.append(TexMessage(OVERFULL_BOX, line.strip(), box_line))
+
+  # pdflatex breaks long lines of the log, possibly in the middle of a message.
+  rerun_requested = RERUN_PATTERN.search("".join(lines)) is not None
+  return TexLog(messages, rerun_requested)
+
+
+def parse_log(log_file):
+  """ Extracts errors and warnings from a pdflatex log file.
+
+  log_file: string
+    path of the log file
+
+  returns: TexLog
+    the errors and warnings
+
+  """
+  # pdflatex writes the log in the encoding of the input, which is not necessarily
+  # utf-8.
+  with open(log_file, 'r', encoding='utf-8', errors='replace') as infile:
+    return parse_lines(infile.read().split("\n"))
@@ -0,0 +1,66 @@
+#!/usr/bin/python3
+
+""" Unit tests for the texlog module. """
+
+import unittest
+
+from testing import PapeterieTestCase
+from texlog import parse_lines, ERROR, OVERFULL_BOX
+
+
+LOG = r"""This is pdfTeX, Version 3.14159265-2.6-1.40.21 (TeX Live 2020) (preloaded format=pdflatex)
+(./papeterie_001.tex
+LaTeX2e <2020-02-02> patch level 2
+Overfull \hbox (12.3pt too wide) in paragraph at lines 10--12
+[]\T1/cmr/m/n/10 Supercalifragilisticexpialidocious|
+
+Overfull \vbox (3.0pt too high) has occurred while \output is active []
+
+! Undefined control sequence.
+<recently read> \foo
+
+l.17 \foo
+         {}
+Here is how much of TeX's memory you used:
+"""
+
+
+class TestTexLog(PapeterieTestCase):
+  """ Tests parsing pdflatex logs. """
+
+  def test_parse(self):
+    """ Tests extracting errors and overfull boxes with their lines. """
+    tex_log = parse_lines(LOG.split("\n"))
+
+    self.assertEqual([ERROR], [message.kind for message in tex_log.errors])
+    self.assertEqual("Undefined control sequence.", tex_log.errors[0].text)
+    self.assertEqual(17, tex_log.errors[0].line)
+    self.assertEqual([OVERFULL_BOX, OVERFULL_BOX],
+                     [message.kind for message in tex_log.overfull_boxes])
+    self.assertEqual([10, None], [message.line for message in tex_log.overfull_boxes])
+    self.assertEqual(3, len(tex_log.messages))
+
+  def test_parse_clean(self):
+    """ Tests parsing a log without errors and warnings. """
+    tex_log = parse_lines(["This is pdfTeX", "Output written on papeterie.pdf (1 page)."])
+
+    self.assertFalse(tex_log.messages)
+
+  def test_rerun_requested(self):
+    """ Tests detecting requests for another pass, even if the log broke the line. """
+    tex_log = parse_lines([
+        "LaTeX Warning: Label(s) may have changed. Rerun to get cross-references rig",
+        "ht."])
+
+    self.assertTrue(tex_log.rerun_requested)
+    self.assertFalse(parse_lines(LOG.split("\n")).rerun_requested)
+
+  def test_error_without_line(self):
+    """ Tests an error that does not refer to a line of the tex file. """
+    tex_log = parse_lines(["! Emergency stop.", "<*> papeterie.tex"])
+
+    self.assertEqual("Emergency stop.", str(tex_log.errors[0]))
+
+
+if __name__ == '__main__':
+  unittest.main()